@@ -0,0 +1,217 @@
+"""Load test for the relay: concurrent AlertClient pollers plus bursty PUT producers.
+
+Runs ``relay_api.app`` with uvicorn on a free localhost port, with relay_db in a temp
+directory and Slack disabled, then reports GET/PUT throughput, p50/p99 latency and database
+growth. With --check, exits non-zero if the report misses THRESHOLDS, so relay changes can be
+compared offline::
+
+    RELAY_KEY=bench python -m benchmarks.relay_load --pollers 20 --producers 2 --duration 10 --check
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+os.environ.setdefault('RELAY_KEY', 'relay-benchmark')
+
+# Minimum throughput (requests/s) and maximum latency (ms) for --check. Deliberately loose:
+# they catch order-of-magnitude regressions, not noise between machines.
+THRESHOLDS = {
+    'get_rps': 200.0,
+    'put_rps': 20.0,
+    'get_p99_ms': 250.0,
+    'put_p99_ms': 500.0,
+    'errors': 0,
+}
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@contextlib.contextmanager
+def local_relay(dbpath=None):
+    """ Serve relay_api.app on localhost with relay_db at dbpath (temp file if None) and no Slack.
+    Yields (relay_api module, port). Module settings changed here are restored on exit.
+    """
+
+    import uvicorn
+    from ovro_alert import notify, relay_api, relay_db
+
+    with contextlib.ExitStack() as stack:
+        if dbpath is None:
+            dbpath = os.path.join(stack.enter_context(tempfile.TemporaryDirectory()), 'relay.db')
+        saved = (relay_db.DBPATH, relay_api.cl, relay_api.slack)
+        relay_db.DBPATH = dbpath
+        relay_api.cl, relay_api.slack = None, notify.SlackNotifier(None)
+
+        port = _free_port()
+        server = uvicorn.Server(uvicorn.Config(relay_api.app, host='127.0.0.1', port=port,
+                                               log_level='warning', access_log=False))
+        thread = threading.Thread(target=server.run, name='relay-bench-server', daemon=True)
+        thread.start()
+        try:
+            deadline = time.monotonic() + 10
+            while not server.started:
+                if not thread.is_alive() or time.monotonic() > deadline:
+                    raise RuntimeError('relay did not start')
+                time.sleep(0.01)
+            yield relay_api, port
+        finally:
+            server.should_exit = True
+            thread.join(timeout=10)
+            relay_db.DBPATH, relay_api.cl, relay_api.slack = saved
+
+
+@contextlib.contextmanager
+def _pool(alert_client, size):
+    """ One pooled connection per thread, so the run measures the relay rather than reconnects. """
+
+    from requests.adapters import HTTPAdapter
+
+    session = alert_client.session()
+    saved = session.adapters['http://']
+    session.mount('http://', HTTPAdapter(max_retries=alert_client.retry, pool_maxsize=size))
+    try:
+        yield
+    finally:
+        session.mount('http://', saved)
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def _db_stats(dbpath):
+    size = sum(os.path.getsize(path) for path in (dbpath, dbpath + '-wal') if os.path.exists(path))
+    if not os.path.exists(dbpath):
+        return 0, size
+    conn = sqlite3.connect(dbpath)
+    try:
+        rows = conn.execute('SELECT COUNT(*) FROM commands').fetchone()[0]
+    except sqlite3.OperationalError:
+        rows = 0
+    conn.close()
+    return rows, size
+
+
+def run(pollers=10, producers=2, duration=5.0, burst=20, burst_interval=0.5,
+        routes=('chime', 'casm', 'ligo', 'gcn', 'dsa'), dbpath=None):
+    """ Drive a local relay and return a report dict (see THRESHOLDS for the checked keys). """
+
+    from ovro_alert import alert_client, relay_db
+
+    get_ms, put_ms = [], []
+    errors = [0]
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    with local_relay(dbpath) as (relay_api, port), _pool(alert_client, pollers + producers):
+        dbpath = relay_db.DBPATH
+        rows0, size0 = _db_stats(dbpath)
+
+        def poller(i):
+            client = alert_client.AlertClient(routes[i % len(routes)], ip='127.0.0.1', port=str(port))
+            local = []
+            while not stop.is_set():
+                t0 = time.perf_counter()
+                dd = client.get()
+                local.append((time.perf_counter() - t0) * 1e3)
+                if 'command_mjd' not in dd:
+                    with lock:
+                        errors[0] += 1
+            with lock:
+                get_ms.extend(local)
+
+        def producer(i):
+            client = alert_client.AlertClient(routes[i % len(routes)], ip='127.0.0.1', port=str(port))
+            local = []
+            n = 0
+            while not stop.is_set():
+                for _ in range(burst):
+                    t0 = time.perf_counter()
+                    status = client.set('observation', args={'producer': i, 'n': n})
+                    local.append((time.perf_counter() - t0) * 1e3)
+                    n += 1
+                    if status != 200:
+                        with lock:
+                            errors[0] += 1
+                stop.wait(burst_interval)
+            with lock:
+                put_ms.extend(local)
+
+        threads = ([threading.Thread(target=poller, args=(i,)) for i in range(pollers)]
+                   + [threading.Thread(target=producer, args=(i,)) for i in range(producers)])
+        t0 = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        time.sleep(duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - t0
+
+        relay_db.flush()
+        rows1, size1 = _db_stats(dbpath)
+
+    return {
+        'pollers': pollers, 'producers': producers, 'duration_s': round(elapsed, 3),
+        'gets': len(get_ms), 'puts': len(put_ms),
+        'get_rps': round(len(get_ms) / elapsed, 1), 'put_rps': round(len(put_ms) / elapsed, 1),
+        'get_p50_ms': round(_percentile(get_ms, 0.5), 3), 'get_p99_ms': round(_percentile(get_ms, 0.99), 3),
+        'put_p50_ms': round(_percentile(put_ms, 0.5), 3), 'put_p99_ms': round(_percentile(put_ms, 0.99), 3),
+        'db_rows_added': rows1 - rows0, 'db_bytes_added': size1 - size0,
+        'errors': errors[0],
+    }
+
+
+def check(report, thresholds=THRESHOLDS):
+    """ List of threshold failures (empty if report passes). *_rps are minimums, others maximums. """
+
+    failures = []
+    for key, limit in thresholds.items():
+        value = report[key]
+        if key.endswith('_rps') and value < limit:
+            failures.append(f'{key} {value} < {limit}')
+        elif not key.endswith('_rps') and value > limit:
+            failures.append(f'{key} {value} > {limit}')
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pollers', type=int, default=10)
+    parser.add_argument('--producers', type=int, default=2)
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds')
+    parser.add_argument('--burst', type=int, default=20, help='PUTs per producer burst')
+    parser.add_argument('--burst-interval', type=float, default=0.5, help='seconds between bursts')
+    parser.add_argument('--check', action='store_true', help='exit 1 if THRESHOLDS are not met')
+    args = parser.parse_args(argv)
+    for name in ('ovro_alert.alert_client', 'fastapi'):  # per-request DEBUG logs would dominate the run
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    report = run(pollers=args.pollers, producers=args.producers, duration=args.duration,
+                 burst=args.burst, burst_interval=args.burst_interval)
+    print(json.dumps(report, indent=2))
+    if args.check:
+        failures = check(report)
+        for failure in failures:
+            print(f'FAIL {failure}', file=sys.stderr)
+        return 1 if failures else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
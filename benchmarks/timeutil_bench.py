@@ -0,0 +1,63 @@
+"""Microbenchmark of ovro_alert.timeutil against astropy.time and datetime.strptime.
+
+Reports microseconds per call for the current MJD and for parsing a GCN-style timestamp, plus the
+largest disagreement with astropy (ms) over a sample of times::
+
+    python -m benchmarks.timeutil_bench --number 20000
+"""
+import argparse
+import json
+import sys
+import timeit
+
+SAMPLE_ISO = '2024-05-01T12:34:56.789Z'
+
+
+def _us(stmt, number):
+    return round(min(timeit.repeat(stmt, number=number, repeat=3)) / number * 1e6, 3)
+
+
+def max_error_ms(n=1000):
+    """ Largest |timeutil - astropy| over n times spread across 1990-2040, in milliseconds. """
+
+    import numpy as np
+    from astropy.time import Time
+    from ovro_alert import timeutil
+
+    unix = np.linspace(631152000.0, 2208988800.0, n)
+    error = np.abs(timeutil.unix_to_mjd(unix) - Time(unix, format='unix').utc.mjd)
+    return float(error.max() * 86400e3)
+
+
+def run(number=10000):
+    """ Return a report dict of per-call times in microseconds (astropy entries skipped if missing). """
+
+    from datetime import datetime
+    from ovro_alert import timeutil
+
+    report = {
+        'now_mjd_us': _us(timeutil.now_mjd, number),
+        'parse_iso_us': _us(lambda: timeutil.parse_iso(SAMPLE_ISO), number),
+        'strptime_us': _us(lambda: datetime.strptime(SAMPLE_ISO, '%Y-%m-%dT%H:%M:%S.%fZ'), number),
+    }
+    try:
+        from astropy.time import Time
+    except ImportError:
+        return report
+    # astropy is ~1000x slower per call; fewer iterations keep the run short.
+    report['astropy_now_mjd_us'] = _us(lambda: Time.now().mjd, max(1, number // 100))
+    report['astropy_parse_us'] = _us(lambda: Time(SAMPLE_ISO[:-1], format='isot').mjd, max(1, number // 100))
+    report['max_error_ms'] = max_error_ms()
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--number', type=int, default=10000, help='calls per timing')
+    args = parser.parse_args(argv)
+    print(json.dumps(run(args.number), indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
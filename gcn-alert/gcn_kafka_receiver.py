@@ -1,5 +1,5 @@
 import os
-from ovro_alert import alert_client
+from ovro_alert import alert_client, notify, outbox, timeutil, trace
 from gcn_kafka import Consumer
 from datetime import datetime, timedelta
 from os import environ
@@ -8,9 +8,8 @@ import logging
 import json
 from xml.etree import ElementTree
 from slack_sdk import WebClient
-from slack_sdk.errors import SlackApiError
 
-gc = alert_client.AlertClient('gcn')
+gc = alert_client.AlertClient('gcn', outbox=outbox.path_from_env('gcn_kafka_receiver'))
 
 logger = logging.getLogger(__name__)
 logHandler = logging.StreamHandler(sys.stdout)
@@ -208,35 +207,37 @@ def parse_alert_payload(message_bytes):
 
 
 def parse_event_time(event_time_str):
-    """Convert an ISO-like timestamp to a datetime, returning None on failure."""
-    if not event_time_str:
-        return None
-    candidates = [
-        '%Y-%m-%dT%H:%M:%S.%fZ',
-        '%Y-%m-%dT%H:%M:%S.%f',
-        '%Y-%m-%dT%H:%M:%SZ',
-        '%Y-%m-%dT%H:%M:%S',
-    ]
-    for fmt in candidates:
-        try:
-            return datetime.strptime(event_time_str, fmt)
-        except ValueError:
-            continue
-    try:
-        # Fall back to fromisoformat for odd-but-valid strings.
-        clean = event_time_str.replace('Z', '+00:00')
-        return datetime.fromisoformat(clean)
-    except ValueError:
+    """Convert an ISO-like timestamp to a naive UTC datetime, returning None on failure."""
+    event_time = timeutil.parse_iso(event_time_str)
+    if event_time is None and event_time_str:
         logger.debug(f"Could not parse event_time: {event_time_str}")
-        return None
+    return event_time
+
+def _start_trace(args, message):
+    """Start a latency trace in args at the Kafka message timestamp, marking parse done now."""
+    timestamp_type, timestamp_ms = message.timestamp()
+    if timestamp_type and timestamp_ms > 0:  # TIMESTAMP_NOT_AVAILABLE is 0
+        trace.start(args, 'gcn_kafka_receiver', 'kafka', ts=timestamp_ms / 1000)
+    else:
+        trace.start(args, 'gcn_kafka_receiver', 'received')
+    trace.mark(args, 'gcn_kafka_receiver', 'parsed')
+
+
+def consume_batch(consumer, timeout=5, max_messages=100):
+    """Wait up to timeout s for the next message, then take whatever else is already queued.
+    A single alert is returned as soon as it arrives; a backlog after a reconnect comes back
+    together (up to max_messages) so it goes to the relay in one bulk PUT.
+    """
+    messages = consumer.consume(timeout=timeout)
+    if messages:
+        messages += consumer.consume(num_messages=max_messages - len(messages), timeout=0)
+    return messages
+
 
 def post_to_slack(channel, message, slack_client):
-    """Post a message to a Slack channel."""
-    try:
-        response = slack_client.chat_postMessage(channel=channel, text=message)
-        print(message)
-    except SlackApiError as e:
-        logger.error(f"Error sending to Slack: {e.response['error']}")
+    """Queue a message for a Slack channel (slack_client is a notify.SlackNotifier)."""
+    slack_client.post(channel, message)
+    print(message)
 
 
 if __name__ == "__main__":
@@ -254,7 +255,7 @@ if __name__ == "__main__":
     send_to_slack = bool(slack_token)
 
     if slack_token:
-        slack_client = WebClient(token=slack_token)
+        slack_client = notify.SlackNotifier(WebClient(token=slack_token))
         logger.debug("Created Slack client")
     else:
         slack_client = None
@@ -269,7 +270,9 @@ if __name__ == "__main__":
                         'gcn.classic.voevent.SWIFT_BAT_GRB_POS_ACK'])
 
     while True:
-        for message in consumer.consume(timeout=5):
+        # After a reconnect consume() returns a backlog; forward it to the relay in one bulk PUT.
+        commands = []
+        for message in consume_batch(consumer):
             if message.error():
                 logger.error(message.error())
                 continue
@@ -297,14 +300,19 @@ if __name__ == "__main__":
                     logger.info(f"Alert has no coordinates; format={alert_format}; keys={list(alert.keys())}")
                 elif mission == 'CHIME':
                     args, slack_msg = handle_chime_frb(alert, mission, instrument)
+                    _start_trace(args, message)
                     logger.info(f'Event at {event_time_str}: {slack_msg}')
-                    gc.set('observation', args, route=mission.lower())
+                    commands.append({'command': 'observation', 'args': args, 'route': mission.lower(),
+                                     'command_mjd': timeutil.now_mjd()})
                     if send_to_slack:
                         post_to_slack(slack_channel, slack_msg, slack_client)
                 else:
                     args, slack_msg = handle_default(alert, mission, instrument)
+                    _start_trace(args, message)
                     logger.info(f'Event at {event_time_str}: {slack_msg}')
-                    gc.set('observation', args, route=mission.lower().replace(' ', '_'))
+                    commands.append({'command': 'observation', 'args': args,
+                                     'route': mission.lower().replace(' ', '_'),
+                                     'command_mjd': timeutil.now_mjd()})
                     if send_to_slack:
                         post_to_slack(slack_channel, slack_msg, slack_client)
 
@@ -312,3 +320,11 @@ if __name__ == "__main__":
                 logger.error(f'Error processing message: {e}')
                 logger.error(f'Error processing message: {e}')
 
+        if commands:
+            for command in commands:
+                trace.mark(command['args'], 'gcn_kafka_receiver', 'relay_put')
+            try:
+                gc.set_many(commands)
+            except Exception as e:
+                logger.error(f'Error sending {len(commands)} commands to relay: {e}')
+
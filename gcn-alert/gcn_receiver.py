@@ -1,9 +1,9 @@
 #!/usr/bin/env python
 import gcn
-from ovro_alert import alert_client
+from ovro_alert import alert_client, outbox
 import voeventparse
 
-gc = alert_client.AlertClient('gcn')
+gc = alert_client.AlertClient('gcn', outbox=outbox.path_from_env('gcn_receiver'))
 
 # Define your custom handler here.
 @gcn.include_notice_types(
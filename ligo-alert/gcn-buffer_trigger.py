@@ -1,9 +1,8 @@
 import gcn
 import datetime
-from ovro_alert import alert_client
+from ovro_alert import alert_client, notify, outbox
 #import ligo.skymap.io
 from slack_sdk import WebClient
-from slack_sdk.errors import SlackApiError
 from os import environ
 import sys
 import logging
@@ -20,14 +19,14 @@ slack_token = None
 if "SLACK_TOKEN_CR" in environ:
     slack_token = environ["SLACK_TOKEN_CR"]
     slack_channel = "#alert-driven-astro"  # use your actual Slack channel (TBD)
-    client = WebClient(token=slack_token)
+    client = notify.SlackNotifier(WebClient(token=slack_token))
     logger.debug("Created slack client")
 else:
     logger.debug("Have not created slack client")
 
 send_to_slack = bool(slack_token) # global variable to control whether to send to Slack
 
-ligoc = alert_client.AlertClient('ligo')
+ligoc = alert_client.AlertClient('ligo', outbox=outbox.path_from_env('gcn-buffer_trigger'))
 
 # Define thresholds
 FAR_THRESH = 3.17e-9  # 1 event per decade
@@ -39,11 +38,8 @@ BNS_NSBH_THRESH = 0  # Either BNS or NSBH probability
 recent_graceids = collections.deque(maxlen=10)
 
 def post_to_slack(channel, message):
-    """Post a message to a Slack channel."""
-    try:
-        response = client.chat_postMessage(channel=channel, text=message)
-    except SlackApiError as e:
-        logger.error(f"Error sending to Slack: {e.response['error']}")
+    """Queue a message for a Slack channel."""
+    client.post(channel, message)
 
 # Function to call every time a GCN is received.
 # Run only for notices of type
@@ -104,9 +100,12 @@ def process_gcn(payload, root, write=True):
         msg_start = "sending EarlyWarning type of alert" if condition1 else "sending alert"
 
         logger.info(f'{msg_start} to ligo relay server with role {role}')
-        ligoc.set(role, args={'FAR': params['FAR'], 'BNS': params['BNS'],
-                              'HasNS': params['HasNS'], 'Terrestrial': params['Terrestrial'],
-                              'GraceID': params['GraceID'], 'AlertType': params['AlertType']})
+        try:
+            ligoc.set(role, args={'FAR': params['FAR'], 'BNS': params['BNS'],
+                                  'HasNS': params['HasNS'], 'Terrestrial': params['Terrestrial'],
+                                  'GraceID': params['GraceID'], 'AlertType': params['AlertType']})
+        except Exception as e:  # keep the pygcn handler alive; set OVRO_ALERT_OUTBOX_DIR to keep the alert
+            logger.error(f'Error sending alert to relay: {type(e).__name__} - {e}')
 
         message = f"LIGO {params['AlertType']} alert with GraceID: {params['GraceID']}" \
                         f", Parameters: FAR {params['FAR']}, BNS {params['BNS']}, HasNS {params['HasNS']}" \
@@ -1,12 +1,18 @@
+"""Client for the relay API, used by receivers and observing clients.
+
+Importing this module is cheap: requests is imported and the HTTP session built on the first
+request (``session()``), and RELAY_KEY is read from the environment or prompted for on first use
+(``relay_key()``), so an observing client restarts straight into its first poll.
+"""
 import sys
 import logging
-from requests import Session
-from requests.adapters import HTTPAdapter
-from urllib3.util import Retry
-from urllib3.exceptions import IncompleteRead
 import json
+import queue
+import threading
+import uuid
 from os import environ
-from astropy import time
+from time import sleep
+from ovro_alert import timeutil, trace
 
 logger = logging.getLogger(__name__)
 logHandler = logging.StreamHandler(sys.stdout)
@@ -15,31 +21,91 @@ logHandler.setFormatter(logFormat)
 logger.addHandler(logHandler)
 logger.setLevel(logging.DEBUG)
 
+# Set by session() on first use (tests may assign s directly).
+s = None
+retry = None
+IncompleteRead = ()  # urllib3's, once session() has imported it; () matches nothing until then
+_session_lock = threading.Lock()
+
+RELAY_KEY = None  # set by relay_key() on first use
+HOST = 'ovro.caltech.edu'  # Host header sent to the relay
+
+
+def session():
+    """ Shared requests Session with retries, created on first call. """
+
+    global s, retry, IncompleteRead
+    if s is None:
+        with _session_lock:
+            if s is None:
+                from requests import Session
+                from requests.adapters import HTTPAdapter
+                from urllib3.util import Retry
+                from urllib3.exceptions import IncompleteRead
+
+                sess = Session()
+                sess.headers.update({"Accept": "application/json", 'Content-Type': 'application/json',
+                                     "Host": HOST})
+                retry = Retry(total=5, backoff_factor=0.5, allowed_methods={'GET', 'PUT'})
+                adapter = HTTPAdapter(max_retries=retry)
+                sess.mount("http://", adapter)
+                sess.mount("https://", adapter)
+                s = sess
+    return s
+
+
+def relay_key(password=None):
+    """ Key for relay requests: password if given, else RELAY_KEY from the environment,
+    prompting for it (once) if unset.
+    """
+
+    global RELAY_KEY
+    if password is not None:
+        return password
+    if RELAY_KEY is None:
+        RELAY_KEY = environ["RELAY_KEY"] if "RELAY_KEY" in environ else input("enter RELAY_KEY")
+    return RELAY_KEY
+
+
+def parse_retry_after(value):
+    """ Seconds from a Retry-After header value (delay-seconds form), or None. """
 
-s = Session()
-s.headers.update({"Accept": "application/json", 'Content-Type': 'application/json', "Host": "ovro.caltech.edu"})
+    if not isinstance(value, str):
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
 
-retry = Retry(total=5, backoff_factor=0.5, allowed_methods={'GET', 'PUT'})
-adapter = HTTPAdapter(max_retries=retry)
-s.mount("http://", adapter)
-s.mount("https://", adapter)
 
-if "RELAY_KEY" in environ:
-    RELAY_KEY = environ["RELAY_KEY"]
-else:
-    RELAY_KEY = input("enter RELAY_KEY")
+def revalidated(dd):
+    """ Copy of a cached body the relay confirmed unchanged (304), read now. """
+
+    dd = dict(dd)
+    if 'read_mjd' in dd:
+        dd['read_mjd'] = timeutil.now_mjd()
+    return dd
 
 
 class AlertClient():
-    def __init__(self, route, ip='131.215.200.144', port='8001'):
+    def __init__(self, route, ip='131.215.200.144', port='8001', outbox=None):
         """ Client for communicating via relay API.
         route defines channel for commuincation (e.g., sending to OVRO-LWA via "lwa")
         Default ip:port are for server on major.
+        With outbox (path to a SQLite file), set and set_many write commands to that durable
+        outbox and return 202 once they are on disk; a background thread sends them to the relay.
         """
 
         self.ip = ip
         self.port = port
         self.route = route
+        self._etags = {}  # request key -> (ETag, last 200 body), for If-None-Match
+        self.retry_after = None  # seconds, from the Retry-After header of the last get/get_many
+        self.outbox = None
+        if outbox is not None:
+            from ovro_alert.outbox import Outbox
+
+            self.outbox = Outbox(outbox, self).start()
 
     def fullroute(self, route=None):
         """ Get full route as a string with option to overload route at end
@@ -48,13 +114,41 @@ class AlertClient():
         route = route if route is not None else self.route
         return f'http://{self.ip}:{self.port}/{route}'
 
-    def get(self, password=RELAY_KEY, route=None):
+    def _conditional_get(self, cache_key, url, params, timeout):
+        """ GET with If-None-Match from the last response for cache_key.
+        Returns the parsed body, reusing the cached one on 304 with read_mjd set to now.
+        """
+
+        cached = self._etags.get(cache_key)
+        headers = {'If-None-Match': cached[0]} if cached is not None else None
+        self.retry_after = None
+        resp = session().get(url=url, params=params, headers=headers, timeout=timeout)
+        self.retry_after = parse_retry_after(resp.headers.get('Retry-After'))
+        if resp.status_code == 304 and cached is not None:
+            return resp, revalidated(cached[1])
+
+        dd = resp.json()
+        etag = resp.headers.get('ETag')
+        if resp.status_code == 200 and isinstance(etag, str):
+            self._etags[cache_key] = (etag, dd)
+        return resp, dd
+
+    def get(self, password=None, route=None, since_mjd=None, wait=None):
         """ Get command from relay server.
+        With since_mjd (last seen command_mjd) and wait (seconds), the relay holds the request
+        until the command changes or wait expires (long-poll).
+        Unchanged state is revalidated by ETag, so the relay can answer 304 with no body.
         """
 
+        params = {'key': relay_key(password)}
+        timeout = 9.05
+        if since_mjd is not None and wait:
+            params.update({'since_mjd': repr(since_mjd), 'wait': wait})
+            timeout += wait
+
+        url = self.fullroute(route=route)
         try:
-            resp = s.get(url=self.fullroute(route=route), params={'key': RELAY_KEY},
-                         timeout=9.05)
+            resp, dd = self._conditional_get(url, url, params, timeout)
         except IncompleteRead:
             logger.error('IncompleteRead during get. Continuing...')
             return {}
@@ -62,20 +156,284 @@ class AlertClient():
             logger.error(f'An unexpected error occurred during get: {type(e).__name__} - {e}')
             return {}
 
+        if resp.status_code not in (200, 304):
+            logger.error(f'oops: {resp}')
+
+        if isinstance(dd, dict):
+            trace.mark(dd.get('args'), 'alert_client', 'read', once=True)
+        return dd
+
+    def get_many(self, routes, password=None):
+        """ Get commands for several routes in one request.
+        Returns dict with "read_mjd" and one entry per route, or {} on error.
+        """
+
+        routes = ','.join(routes)
+        try:
+            resp, dd = self._conditional_get(('commands', routes), self.fullroute(route='commands'),
+                                             {'key': relay_key(password), 'routes': routes}, 9.05)
+        except IncompleteRead:
+            logger.error('IncompleteRead during get_many. Continuing...')
+            return {}
+        except Exception as e:
+            logger.error(f'An unexpected error occurred during get_many: {type(e).__name__} - {e}')
+            return {}
+
+        if resp.status_code not in (200, 304):
+            logger.error(f'oops: {resp}')
+            return {}
+
+        if not isinstance(dd, dict):
+            logger.error(f'Unexpected response from get_many: {dd}')
+            return {}
+        for state in dd.values():
+            if isinstance(state, dict):
+                trace.mark(state.get('args'), 'alert_client', 'read', once=True)
+        return dd
+
+    def get_events(self, route=None, after=0, after_mjd=None, limit=100, password=None):
+        """ Get one page of commands logged on route after cursor seq (and after_mjd, for
+        commands older than the relay's in-memory buffer). Returns dict or {} on error.
+        """
+
+        params = {'key': relay_key(password), 'after': after, 'limit': limit}
+        if after_mjd is not None:
+            params['after_mjd'] = repr(after_mjd)
+        route = route if route is not None else self.route
+        try:
+            resp = session().get(url=self.fullroute(route=f'{route}/events'), params=params, timeout=9.05)
+        except Exception as e:
+            logger.error(f'An unexpected error occurred during get_events: {type(e).__name__} - {e}')
+            return {}
+
         if resp.status_code != 200:
             logger.error(f'oops: {resp}')
+            return {}
+
+        dd = resp.json()
+        return dd if isinstance(dd, dict) else {}
 
-        return resp.json()
+    def iter_events(self, route=None, after=0, after_mjd=None, limit=100, loop=5):
+        """ Yield every command logged on route after the cursor, forever.
+        Pages back-to-back while behind and sleeps loop seconds once caught up.
+        Each event has "seq" (None if read from the relay database), "command", "command_mjd", "args".
+        """
 
-    def set(self, command, args={}, password=RELAY_KEY, route=None):
+        while True:
+            page = self.get_events(route=route, after=after, after_mjd=after_mjd, limit=limit)
+            events = page.get('events', [])
+            if page.get('gap') and after_mjd is None:
+                logger.warning(f'Relay event buffer no longer covers seq {after}; some events were missed.')
+            for event in events:
+                if event['seq'] is not None:
+                    after = event['seq']
+                after_mjd = event['command_mjd']
+                yield event
+            if len(events) < limit:
+                sleep(loop)
+
+    def set(self, command, args={}, password=None, route=None):
         """ Put command to relay.
         """
 
-        mjd = time.Time.now().mjd
+        mjd = timeutil.now_mjd()
         dd = {"instrument": route if route else self.route, "command": command, "command_mjd": mjd, "args": args}
+        if self.outbox is not None:
+            logger.debug(f"Queued in outbox: {dd}")
+            self.outbox.put([dd])
+            return 202
         logger.debug(f"Sending PUT request with data: {dd}")
 
-        resp = s.put(url=self.fullroute(route=route), data=json.dumps(dd),
-                            params={'key': RELAY_KEY}, timeout=9.05)
+        # One key per logical set, reused by urllib3 retries, so the relay applies it only once.
+        resp = session().put(url=self.fullroute(route=route), data=json.dumps(dd),
+                            params={'key': relay_key(password)}, headers={'Idempotency-Key': str(uuid.uuid4())},
+                            timeout=9.05)
+
+        return resp.status_code
+
+    def set_many(self, commands, password=None, chunk=500):
+        """ Put a list of commands to relay with PUT /bulk, chunk at a time.
+        Each command is a dict with "command" and optional "args", "route" (default self.route)
+        and "command_mjd" (default now). Returns status code of the last request (202 if queued
+        in the outbox).
+        """
+
+        mjd = timeutil.now_mjd()
+        dd = [{"instrument": cmd.get("route") or self.route, "command": cmd["command"],
+               "command_mjd": cmd.get("command_mjd", mjd), "args": cmd.get("args", {})}
+              for cmd in commands]
+        if self.outbox is not None:
+            logger.debug(f"Queued {len(dd)} commands in outbox")
+            self.outbox.put(dd)
+            return 202
+        return self.put_bulk(dd, password=password, chunk=chunk)
+
+    def put_bulk(self, dd, password=None, chunk=500, idempotency_key=None):
+        """ PUT /bulk the command dicts in dd (with "instrument", "command", "command_mjd", "args"),
+        chunk at a time. idempotency_key (default random) names the chunks, for callers that resend
+        the same commands. Returns status code of the last request.
+        """
+
+        logger.debug(f"Sending bulk PUT request with {len(dd)} commands")
+        idempotency_key = idempotency_key or str(uuid.uuid4())
+        status = None
+        for i in range(0, len(dd), chunk):
+            resp = session().put(url=self.fullroute(route='bulk'), data=json.dumps(dd[i:i + chunk]),
+                                 params={'key': relay_key(password)},
+                                 headers={'Idempotency-Key': f'{idempotency_key}-{i}'}, timeout=9.05)
+            status = resp.status_code
+            if status == 200 and resp.text == '"Bad key"':  # the relay answers a bad key with 200
+                status = 401
+            if status != 200:
+                logger.error(f'oops: {resp}')
+                break
+
+        return status
+
+    def report_trace(self, args, password=None):
+        """ Send the latency marks of a traced command (args["_trace"]) back to the relay.
+        Returns status code, or None if args is not traced or the request failed.
+        """
 
+        ctx = trace.get(args)
+        if ctx is None:
+            return None
+        try:
+            resp = session().put(url=self.fullroute(route='traces'), data=json.dumps(ctx),
+                         params={'key': relay_key(password)}, timeout=9.05)
+        except Exception as e:
+            logger.error(f'An unexpected error occurred during report_trace: {type(e).__name__} - {e}')
+            return None
         return resp.status_code
+
+
+class TraceReporter():
+    def __init__(self, client, maxsize=100):
+        """ Sends trace marks with client.report_trace from a background thread, so the relay
+        round trip never holds up an observation. Traces are dropped (and logged) if maxsize
+        are already waiting.
+        """
+
+        self.client = client
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._done = threading.Condition(self._lock)
+        self._pending = 0
+        self._thread = None
+
+    def post(self, args):
+        """ Enqueue the trace in args (if any) and return immediately. Returns False if not queued.
+        """
+
+        ctx = trace.get(args)
+        if ctx is None:
+            return False
+        ctx = {'id': ctx['id'], 'marks': list(ctx['marks'])}  # marks added later go in the next report
+        self._start()
+        with self._lock:
+            try:
+                self._queue.put_nowait(ctx)
+            except queue.Full:
+                logger.warning(f"Dropping trace {ctx['id']}: {self._queue.maxsize} reports already queued")
+                return False
+            self._pending += 1
+        return True
+
+    def flush(self, timeout=10):
+        """ Wait until queued traces are sent. Returns False on timeout.
+        """
+
+        with self._done:
+            return self._done.wait_for(lambda: self._pending == 0, timeout)
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='trace-reporter', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            ctx = self._queue.get()
+            try:
+                self.client.report_trace({trace.KEY: ctx})
+            finally:
+                with self._done:
+                    self._pending -= 1
+                    self._done.notify_all()
+
+
+class AlertStream(AlertClient):
+    def __init__(self, routes, ip='131.215.200.144', port='8001', since_mjd=None,
+                 reconnect_delay=1, max_reconnect_delay=30, read_timeout=45):
+        """ Subscriber for the relay /stream endpoint (server-sent events).
+        routes is a list of channels to follow (e.g., ['chime', 'casm', 'ligo']).
+        Reconnects with backoff and resumes after the last event seen on each route (cursor),
+        so updates made while disconnected are delivered too. A command no newer than the last
+        one yielded for its route (e.g. state resent by a restarted relay) is skipped. since_mjd
+        only applies to the first connect. read_timeout should exceed the relay heartbeat
+        interval (15 s).
+        """
+
+        super().__init__('stream', ip=ip, port=port)
+        self.routes = list(routes)
+        self.since_mjd = since_mjd
+        self.cursor = {}  # route -> seq of the last event received
+        self.last_mjd = {}  # route -> command_mjd of the last event yielded
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.read_timeout = read_timeout
+
+    def events(self, password=None):
+        """ Yield (route, command dict) for each update, forever.
+        On first connect (since_mjd=None) the current state of every route is yielded.
+        """
+
+        delay = self.reconnect_delay
+        while True:
+            params = {'key': relay_key(password), 'routes': ','.join(self.routes)}
+            if self.cursor:
+                params['since'] = ','.join(f'{route}:{seq}' for route, seq in self.cursor.items())
+            elif self.since_mjd is not None:
+                params['since_mjd'] = repr(self.since_mjd)
+            try:
+                with session().get(url=self.fullroute(), params=params, stream=True,
+                           timeout=(9.05, self.read_timeout)) as resp:
+                    if not resp.headers.get('Content-Type', '').startswith('text/event-stream'):
+                        logger.error(f'Stream not available: {resp.status_code} {resp.text[:200]}')
+                    else:
+                        delay = self.reconnect_delay
+                        for route, dd in self._parse(resp.iter_lines(decode_unicode=True)):
+                            if dd.get('seq') is not None:
+                                self.cursor[route] = dd['seq']
+                            mjd, last = dd.get('command_mjd'), self.last_mjd.get(route)
+                            if last is not None and (mjd is None or mjd <= last):
+                                logger.info(f'Skipping {route} command at {mjd}: already seen {last}')
+                                continue
+                            if mjd is not None:
+                                self.last_mjd[route] = mjd
+                            yield route, dd
+            except Exception as e:
+                logger.error(f'Stream interrupted: {type(e).__name__} - {e}')
+
+            logger.info(f'Reconnecting to stream in {delay} s')
+            sleep(delay)
+            delay = min(2 * delay, self.max_reconnect_delay)
+
+    @staticmethod
+    def _parse(lines):
+        """ Parse server-sent event lines into (event, data dict) pairs.
+        """
+
+        event, data = None, []
+        for line in lines:
+            if not line:
+                if data:
+                    yield event, json.loads('\n'.join(data))
+                event, data = None, []
+            elif line.startswith(':'):
+                continue
+            elif line.startswith('event:'):
+                event = line[6:].strip()
+            elif line.startswith('data:'):
+                data.append(line[5:].strip())
@@ -0,0 +1,316 @@
+"""asyncio client for the relay API, for pollers that follow several routes at once.
+
+Requests go over a small pool of HTTP/1.1 keep-alive connections (stdlib asyncio streams, no
+extra dependencies), each with its own deadline, so one slow route costs a poll round max(route)
+rather than sum(route) as with the blocking ``AlertClient``. Methods return what the
+``AlertClient`` methods of the same name return ({} or None on errors, status codes for PUTs).
+
+    client = AsyncAlertClient('lwa')
+    async for route, dd in client.poll(['chime', 'casm', 'ligo', 'gcn', 'dsa']):
+        ...
+"""
+import asyncio
+import json
+import logging
+import uuid
+from urllib.parse import urlencode
+
+from ovro_alert import timeutil, trace
+from ovro_alert.alert_client import HOST, parse_retry_after, relay_key, revalidated
+from ovro_alert.poll_scheduler import PollScheduler
+
+logger = logging.getLogger(__name__)
+
+
+class HTTPError(Exception):
+    """ Malformed or truncated response from the relay. """
+
+
+class _Connection():
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    def close(self):
+        self.writer.close()
+
+
+class AsyncAlertClient():
+    def __init__(self, route, ip='131.215.200.144', port='8001', pool_size=4, timeout=9.05, retries=2):
+        """ asyncio client for the relay API.
+        route is the default channel (as for AlertClient). At most pool_size connections are open
+        at once; timeout is the deadline in seconds for each request (long-polls add their wait).
+        Connection failures are retried up to retries times; PUTs reuse their Idempotency-Key.
+        """
+
+        self.ip = ip
+        self.port = port
+        self.route = route
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retries = retries
+        self._etags = {}  # request key -> (ETag, last 200 body), for If-None-Match
+        self.retry_after = None  # seconds, the longest Retry-After seen since poll() last reset it
+        self._idle = []  # open keep-alive connections
+        self._slots = None  # asyncio.Semaphore(pool_size), created in the running loop
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """ Close idle connections. """
+
+        while self._idle:
+            self._idle.pop().close()
+
+    def fullroute(self, route=None):
+        """ Get full route as a string with option to overload route at end
+        """
+
+        route = route if route is not None else self.route
+        return f'http://{self.ip}:{self.port}/{route}'
+
+    async def request(self, method, path, params=None, body=None, headers=None, timeout=None):
+        """ Send one request and return (status, headers dict, body bytes).
+        Raises asyncio.TimeoutError after timeout (default self.timeout) seconds and
+        OSError/HTTPError if the relay cannot be reached after retries.
+        """
+
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.pool_size)
+        target = '/' + path.lstrip('/') + ('?' + urlencode(params) if params else '')
+        lines = [f'{method} {target} HTTP/1.1', f'Host: {HOST}', 'Accept: application/json']
+        if body is not None:
+            lines += ['Content-Type: application/json', f'Content-Length: {len(body)}']
+        lines += [f'{name}: {value}' for name, value in (headers or {}).items()]
+        raw = ('\r\n'.join(lines) + '\r\n\r\n').encode() + (body or b'')
+
+        async with self._slots:
+            return await asyncio.wait_for(self._send(raw, method), self.timeout if timeout is None else timeout)
+
+    async def _send(self, raw, method):
+        for attempt in range(self.retries + 1):
+            reused = bool(self._idle)
+            conn = self._idle.pop() if reused else None
+            try:
+                if conn is None:
+                    conn = _Connection(*await asyncio.open_connection(self.ip, int(self.port)))
+                conn.writer.write(raw)
+                await conn.writer.drain()
+                status, headers, body, keep_alive = await self._read_response(conn.reader, method)
+            except asyncio.CancelledError:  # deadline passed: the connection is mid-response
+                if conn is not None:
+                    conn.close()
+                raise
+            except (OSError, HTTPError, asyncio.IncompleteReadError) as e:
+                if conn is not None:
+                    conn.close()
+                # A reused connection may have been closed by the relay while idle; retry at once.
+                if attempt == self.retries:
+                    raise
+                if not reused:
+                    await asyncio.sleep(0.5 * 2 ** attempt)
+                logger.debug(f'Retrying {method} after {type(e).__name__} - {e}')
+                continue
+            if keep_alive:
+                self._idle.append(conn)
+            else:
+                conn.close()
+            return status, headers, body
+
+    @staticmethod
+    async def _read_response(reader, method):
+        line = await reader.readline()
+        if not line:
+            raise HTTPError('connection closed before response')
+        parts = line.decode('latin-1').split(None, 2)
+        if len(parts) < 2 or not parts[0].startswith('HTTP/'):
+            raise HTTPError(f'bad status line {line!r}')
+        status = int(parts[1])
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n'):
+                break
+            if not line:
+                raise HTTPError('connection closed in headers')
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        keep_alive = headers.get('connection', '').lower() != 'close'
+        if method == 'HEAD' or status in (204, 304) or 100 <= status < 200:
+            body = b''
+        elif headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass  # trailers
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            body = b''.join(chunks)
+        elif 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        else:
+            body = await reader.read()
+            keep_alive = False
+        return status, headers, body, keep_alive
+
+    async def _conditional_get(self, cache_key, path, params, timeout):
+        """ GET with If-None-Match from the last response for cache_key.
+        Returns (status, parsed body), reusing the cached body on 304 with read_mjd set to now.
+        """
+
+        cached = self._etags.get(cache_key)
+        headers = {'If-None-Match': cached[0]} if cached is not None else None
+        status, resp_headers, body = await self.request('GET', path, params, headers=headers, timeout=timeout)
+        hint = parse_retry_after(resp_headers.get('retry-after'))
+        if hint is not None:
+            self.retry_after = max(self.retry_after or 0.0, hint)
+        if status == 304 and cached is not None:
+            return status, revalidated(cached[1])
+
+        dd = json.loads(body.decode())
+        etag = resp_headers.get('etag')
+        if status == 200 and etag:
+            self._etags[cache_key] = (etag, dd)
+        return status, dd
+
+    async def get(self, password=None, route=None, since_mjd=None, wait=None):
+        """ Get command from relay server (see AlertClient.get). Returns {} on error or timeout.
+        """
+
+        route = route if route is not None else self.route
+        params = {'key': relay_key(password)}
+        timeout = self.timeout
+        if since_mjd is not None and wait:
+            params.update({'since_mjd': repr(since_mjd), 'wait': wait})
+            timeout += wait
+
+        try:
+            status, dd = await self._conditional_get(route, route, params, timeout)
+        except asyncio.TimeoutError:
+            logger.error(f'Timed out after {timeout} s getting {route}')
+            return {}
+        except Exception as e:
+            logger.error(f'An unexpected error occurred during get: {type(e).__name__} - {e}')
+            return {}
+
+        if status not in (200, 304):
+            logger.error(f'oops: {status} from {route}')
+
+        if isinstance(dd, dict):
+            trace.mark(dd.get('args'), 'alert_client', 'read', once=True)
+        return dd
+
+    async def get_routes(self, routes, password=None):
+        """ Get several routes concurrently, one request each.
+        Returns {route: command dict}, with {} for any route that failed or timed out.
+        """
+
+        results = await asyncio.gather(*(self.get(password=password, route=route) for route in routes))
+        return dict(zip(routes, results))
+
+    async def get_many(self, routes, password=None):
+        """ Get commands for several routes in one request (see AlertClient.get_many).
+        Returns dict with "read_mjd" and one entry per route, or {} on error.
+        """
+
+        routes = ','.join(routes)
+        try:
+            status, dd = await self._conditional_get(('commands', routes), 'commands',
+                                                     {'key': relay_key(password), 'routes': routes}, self.timeout)
+        except asyncio.TimeoutError:
+            logger.error(f'Timed out after {self.timeout} s getting {routes}')
+            return {}
+        except Exception as e:
+            logger.error(f'An unexpected error occurred during get_many: {type(e).__name__} - {e}')
+            return {}
+
+        if status not in (200, 304) or not isinstance(dd, dict):
+            logger.error(f'Unexpected response from get_many: {status} {dd}')
+            return {}
+        for state in dd.values():
+            if isinstance(state, dict):
+                trace.mark(state.get('args'), 'alert_client', 'read', once=True)
+        return dd
+
+    async def set(self, command, args={}, password=None, route=None):
+        """ Put command to relay. Returns status code, or None if the relay could not be reached.
+        """
+
+        route = route if route else self.route
+        dd = {"instrument": route, "command": command, "command_mjd": timeutil.now_mjd(), "args": args}
+        logger.debug(f"Sending PUT request with data: {dd}")
+        return await self._put(route, dd, password)
+
+    async def set_many(self, commands, password=None, chunk=500):
+        """ Put a list of commands with PUT /bulk (see AlertClient.set_many).
+        Returns status code of the last request.
+        """
+
+        mjd = timeutil.now_mjd()
+        dd = [{"instrument": cmd.get("route") or self.route, "command": cmd["command"],
+               "command_mjd": cmd.get("command_mjd", mjd), "args": cmd.get("args", {})}
+              for cmd in commands]
+
+        status = None
+        for i in range(0, len(dd), chunk):
+            status = await self._put('bulk', dd[i:i + chunk], password)
+            if status != 200:
+                break
+        return status
+
+    async def report_trace(self, args, password=None):
+        """ Send the latency marks of a traced command back to the relay (see AlertClient.report_trace).
+        """
+
+        ctx = trace.get(args)
+        if ctx is None:
+            return None
+        return await self._put('traces', ctx, password, idempotent=False)
+
+    async def _put(self, path, dd, password, idempotent=True):
+        # One key per logical set, reused by retries, so the relay applies it only once.
+        headers = {'Idempotency-Key': str(uuid.uuid4())} if idempotent else None
+        try:
+            status, _, body = await self.request('PUT', path, {'key': relay_key(password)},
+                                                 body=json.dumps(dd).encode(), headers=headers)
+        except asyncio.TimeoutError:
+            logger.error(f'Timed out after {self.timeout} s putting to {path}')
+            return None
+        except Exception as e:
+            logger.error(f'An unexpected error occurred during PUT to {path}: {type(e).__name__} - {e}')
+            return None
+        if status != 200:
+            logger.error(f'oops: {status} {body[:200]!r}')
+        return status
+
+    async def poll(self, routes, loop=5, min_loop=0.5, password=None):
+        """ Yield (route, command dict) whenever a route's command_mjd changes, forever.
+        Each round gets every route concurrently, then waits min_loop to loop seconds (shorter
+        after a change, see PollScheduler). The first round only records the current commands
+        (as LWAAlertClient.poll does), as does the first successful get of a route that failed before.
+        """
+
+        scheduler = PollScheduler(min_interval=min(min_loop, loop), max_interval=loop)
+        seen = {}
+        while True:
+            self.retry_after = None
+            changed = False
+            for route, dd in (await self.get_routes(routes, password=password)).items():
+                if 'command_mjd' not in dd:
+                    continue
+                if route in seen and dd['command_mjd'] != seen[route]:
+                    changed = True
+                    yield route, dd
+                seen[route] = dd['command_mjd']
+            scheduler.hint(self.retry_after)
+            scheduler.activity() if changed else scheduler.idle()
+            await asyncio.sleep(scheduler.next_delay())
@@ -0,0 +1,113 @@
+"""Table-driven dispatch of relay commands for observing clients.
+
+Each poll round, ``Dispatcher.diff`` compares the state of every route with the last one seen
+and returns an ``Event`` for each route whose command_mjd changed; ``Dispatcher.dispatch`` runs
+them all in priority order, so simultaneous alerts are handled in the same round instead of one
+per poll. A ``Rule`` per route names its handler and how urgent it is::
+
+    dispatcher = Dispatcher({'ligo': Rule(client.on_ligo, urgency=0, rank=4),
+                             'chime': Rule(client.on_chime, urgency=1, rank=0, required=('dm', 'position'))})
+    dispatcher.diff(client.get_many(routes))  # first call only records the current commands
+    while True:
+        dispatcher.dispatch(dispatcher.diff(client.get_many(routes)))
+
+Events are ordered by (urgency, rank, command_mjd): lower urgency first, then lower rank (the
+source), then oldest. "test" commands always sort after observations. An observation missing a
+required arg, or a handler that raises, is logged and skipped without holding up other events.
+"""
+import heapq
+import logging
+
+logger = logging.getLogger(__name__)
+
+TEST_URGENCY = 100  # after every observation
+
+
+class Rule():
+    def __init__(self, handler, urgency=1, rank=0, required=(), on_test=None):
+        """ How to dispatch commands from one route.
+        handler(event) runs for "observation" commands that have every arg in required;
+        on_test(event) (default: log) runs for "test" commands. Other commands are logged.
+        """
+
+        self.handler = handler
+        self.urgency = urgency
+        self.rank = rank
+        self.required = tuple(required)
+        self.on_test = on_test
+
+
+class Event():
+    def __init__(self, route, state, rule):
+        """ New command state (dict with command, command_mjd, args) on route. """
+
+        self.route = route
+        self.state = state
+        self.rule = rule
+        self.command = state.get('command')
+        self.args = state.get('args') or {}
+        self.command_mjd = state['command_mjd']
+
+    def priority(self):
+        urgency = self.rule.urgency if self.command == 'observation' else TEST_URGENCY
+        return (urgency, self.rule.rank, self.command_mjd if self.command_mjd is not None else 0.0)
+
+    def __repr__(self):
+        return f'Event({self.route!r}, {self.command!r}, {self.command_mjd!r})'
+
+
+class Dispatcher():
+    def __init__(self, rules):
+        """ Dispatcher for routes in rules ({route: Rule}). """
+
+        self.rules = dict(rules)
+        self.seen = {}  # route -> last command_mjd seen
+        self.missing = []  # routes without a usable state in the last diff
+
+    def diff(self, states):
+        """ Events for routes in states ({route: state}) whose command_mjd changed since the last call.
+        A route's first usable state is only recorded, so restarts do not replay old commands.
+        """
+
+        events = []
+        self.missing = []
+        for route, rule in self.rules.items():
+            state = states.get(route) if isinstance(states, dict) else None
+            if not isinstance(state, dict) or 'command_mjd' not in state:
+                self.missing.append(route)
+                continue
+            if route in self.seen and state['command_mjd'] != self.seen[route]:
+                events.append(Event(route, state, rule))
+            self.seen[route] = state['command_mjd']
+        return events
+
+    def dispatch(self, events):
+        """ Run the handler for each event, most urgent first. Returns the events in the order run. """
+
+        queue = [(event.priority(), i, event) for i, event in enumerate(events)]
+        heapq.heapify(queue)
+        done = []
+        while queue:
+            event = heapq.heappop(queue)[2]
+            done.append(event)
+            try:
+                self._run(event)
+            except Exception as e:
+                logger.error(f'Error handling {event}: {type(e).__name__} - {e}')
+        return done
+
+    def _run(self, event):
+        rule = event.rule
+        if event.command == 'observation':
+            missing = [key for key in rule.required if key not in event.args]
+            if missing:
+                logger.warning(f'{event.route} args ({event.args}) do not include {missing}. Skipping...')
+                return
+            rule.handler(event)
+        elif event.command == 'test':
+            if rule.on_test is not None:
+                rule.on_test(event)
+            else:
+                logger.info(f'Received {event.route} test')
+        else:
+            logger.info(f'Ignoring {event.route} command {event.command}')
@@ -1,23 +1,12 @@
-from time import sleep
-
 from ovro_alert.alert_client import AlertClient
-
-import pandas as pd
+from ovro_alert.notify import SlackNotifier
+from ovro_alert.poll_scheduler import PollScheduler
 
 import json
 
-from astropy import time
-from astropy.coordinates import SkyCoord
-import astropy.units as u
-
-from slack_sdk import WebClient
-from slack_sdk.errors import SlackApiError
-
 import sys
-from os import environ
 
-if "SLACK_TOKEN_DSA" in environ:
-    cl = WebClient(token=environ["SLACK_TOKEN_DSA"])
+slack = SlackNotifier.from_env("SLACK_TOKEN_DSA")
 
 class DSAAlertClient(AlertClient):
 
@@ -29,6 +18,9 @@ class DSAAlertClient(AlertClient):
         print(f'Setting up with {self.fullroute()} compared to events in {file_path}')
 
     def compare_voevent_with_frbs(self, voevent_dm, voevent_ra, voevent_dec):
+        from astropy.coordinates import SkyCoord  # heavy; only needed once an event arrives
+        import astropy.units as u
+
         matched_frbs = []
         
         voevent_coord = SkyCoord(ra=voevent_ra*u.deg, dec=voevent_dec*u.deg)
@@ -58,14 +50,18 @@ class DSAAlertClient(AlertClient):
         
         return matched_frbs
 
-    def poll(self, loop=5):
+    def poll(self, loop=5, min_loop=0.5):
         """ Poll the relay API for commands.
+        Polls every min_loop seconds after a new event, backing off to every loop seconds when quiet.
         """
+        scheduler = PollScheduler(min_interval=min(min_loop, loop), max_interval=loop)
         dd = self.get()
         while True:
-            mjd = time.Time.now().mjd
+            scheduler.wait()
             dd2 = self.get()
-            if dd2["command_mjd"] != dd["command_mjd"] and dd2['command'] == 'observation':
+            scheduler.hint(self.retry_after)
+            if "command_mjd" in dd2 and dd2["command_mjd"] != dd.get("command_mjd") and dd2['command'] == 'observation':
+                scheduler.activity()
                 dd = dd2.copy()
                 #print(f"DD ARGS: {dd['args']}")
                 event_no = dd['args'].get('event_no', None)
@@ -83,17 +79,13 @@ class DSAAlertClient(AlertClient):
                 # If repeater association is confirmed, post to slack
                 if len(repeater_of) > 1:
                     message = f"CHIME/FRB event {event_no}: \n is associated with repeater {repeater_of[1]}"
-                    try:
-                        response = cl.chat_postMessage(channel="#candidates", text=message, icon_emoji = ":zap:")
-                    except Exception as e: # SlackApiError as e:
-                        print(e)
+                    slack.post("#candidates", message, icon_emoji = ":zap:")
                 else:
                     print(f"{event_no} not matched to known repeater")
 
             else:
-                sleep(loop)
-                continue
-        
+                scheduler.idle()
+
     def slew(self):
         """ Slew to new elevation
         """
@@ -3,13 +3,13 @@ import logging
 import subprocess
 import time
 from pathlib import Path
-from time import sleep
 import threading
-from slack_sdk import WebClient
-from slack_sdk.errors import SlackApiError
 from os import environ
-from astropy.time import Time
-from ovro_alert.alert_client import AlertClient
+from ovro_alert.alert_client import AlertClient, TraceReporter
+from ovro_alert.notify import SlackNotifier
+from ovro_alert import trace
+from ovro_alert.poll_scheduler import PollScheduler
+from ovro_alert.dispatch import Dispatcher, Rule
 from ovro_alert.voltage_beam_selection import (
     parse_sbatch_job_id,
     resolve_voltage_pipeline_begin,
@@ -19,11 +19,21 @@ from ovro_alert.voltage_beam_selection import (
     voltage_beam_search_dir,
 )
 from frb_search_pipeline.slurm_schedule import dispersion_delay_s
-from mnc import control
-from observing import makesdf
-from dsautils import dsa_store
 
-ls = dsa_store.DsaStore()
+# mnc, observing and dsautils are imported on first use: DsaStore connects to etcd, and an
+# observing client restarting after a crash should reach its first poll without waiting on them.
+_ls = None
+
+
+def _store():
+    """ DsaStore for submitting SDFs, connected on first use. """
+
+    global _ls
+    if _ls is None:
+        from dsautils import dsa_store
+
+        _ls = dsa_store.DsaStore()
+    return _ls
 
 
 logger = logging.getLogger(__name__)
@@ -34,10 +44,13 @@ logger.addHandler(logHandler)
 logger.setLevel(logging.DEBUG)
 
 if "SLACK_TOKEN_LWA" in environ:
+    from slack_sdk import WebClient
+
     cl = WebClient(token=environ["SLACK_TOKEN_LWA"])
 else:
     cl = None
     logging.warning("No SLACK_TOKEN_LWA found. No slack updates.")
+slack = SlackNotifier(cl)
 
 delay = dispersion_delay_s
 
@@ -53,122 +66,94 @@ class LWAAlertClient(AlertClient):
     def __init__(self, con):
         super().__init__('lwa')
         self.con = con
+        self.traces = TraceReporter(self)
         self.pipelines = [p for p in con.pipelines if p.pipeline_id in [2, 3]]
         self.con.configure_xengine(recorders=[RECORDER], full=False, calibratebeams=True, force=True)
 
-    def poll(self, loop=5):
+    def rules(self):
+        """ Dispatch table for poll: route -> Rule (see ovro_alert.dispatch).
+        The LIGO voltage dump comes first, since the ring buffer only holds the last few seconds;
+        beam observations then follow in CHIME, CASM, DSA-110 order.
+        """
+
+        return {
+            'ligo': Rule(self.on_ligo, urgency=0, rank=4, on_test=self.on_ligo_test),
+            'chime': Rule(self.on_frb, urgency=1, rank=0, required=('dm', 'position')),
+            'casm': Rule(self.on_frb, urgency=1, rank=1, required=('dm', 'position')),
+            'dsa': Rule(self.on_dsa, urgency=1, rank=3, required=('dm', 'ra', 'dec')),
+            'gcn': Rule(self.on_gcn, urgency=2, rank=2, required=('duration', 'position')),
+        }
+
+    def poll(self, loop=5, min_loop=0.5):
         """ Poll the relay API for commands.
+        Every route that changed since the last poll is dispatched in the same round, most urgent
+        first (see rules). Polls every min_loop seconds after a new command, backing off to every
+        loop seconds when quiet (see PollScheduler).
         """
 
-        ddc0 = self.get(route='chime')
-        ddcasm0 = self.get(route='casm')
-        ddl0 = self.get(route='ligo')
-        ddg0 = self.get(route='gcn')
-        ddd0 = self.get(route='dsa')
+        routes = ['chime', 'casm', 'ligo', 'gcn', 'dsa']
+        scheduler = PollScheduler(min_interval=min(min_loop, loop), max_interval=loop)
+        dispatcher = Dispatcher(self.rules())
+        dispatcher.diff(self.get_many(routes))
         while True:
-            mjd = Time.now().mjd
-            ddc = self.get(route='chime')
-            ddcasm = self.get(route='casm')
-            ddl = self.get(route='ligo')
-            ddg = self.get(route='gcn')
-            ddd = self.get(route='dsa')
+            scheduler.wait()
+            dd = self.get_many(routes)
+            scheduler.hint(self.retry_after)
             print(".", end="")
 
-            # TODO: validate ddc and ddl have correct fields (and maybe reject malicious content?)
-            if (
-                ("command_mjd" not in ddc)
-                or ("command_mjd" not in ddcasm)
-                or ("command_mjd" not in ddl)
-                or ("command_mjd" not in ddg)
-                or ("command_mjd" not in ddd)
-            ):
-                print(f"Could not get complete dict from relay: {ddc}, {ddcasm}, {ddl}, {ddg}, {ddd}.")
-                sleep(loop)
-                continue
-
-            if ddc["command_mjd"] != ddc0["command_mjd"]:
-                ddc0 = ddc.copy()
-
-                if ddc["command"] == "observation":   # chime/ligo have command="observation" or "test"
-                    logger.info("Received CHIME event")
-                    if not all(key in ddc["args"] for key in ["dm", "position"]):
-                        logger.warning(f"CHIME args ({ddc['args']}) do not include 'dm' and 'position'. Skipping...")
-                        continue
-#                    if ddc["args"]["known"]:   # TODO: check for sources we want to observe (e.g., by name or properties)
-                    if cl is not None:
-                        response = cl.chat_postMessage(channel="#observing",
-                                                       text=f"Starting drt1 beam on CHIME event {ddc['args']['id']} with DM={ddc['args']['dm']}",
-                                                       icon_emoji = ":robot_face::")
-#                    self.submit_powerbeam(ddc["args"])
-                    self.submit_voltagebeam(ddc["args"])
-                elif ddc["command"] == "test":
-                    logger.info("Received CHIME test")
-
-            elif ddcasm["command_mjd"] != ddcasm0["command_mjd"]:
-                ddcasm0 = ddcasm.copy()
-
-                if ddcasm["command"] == "observation":
-                    logger.info("Received CASM event")
-                    if not all(key in ddcasm["args"] for key in ["dm", "position"]):
-                        logger.warning(
-                            f"CASM args ({ddcasm['args']}) do not include 'dm' and 'position'. Skipping..."
-                        )
-                        continue
-                    if cl is not None:
-                        response = cl.chat_postMessage(
-                            channel="#observing",
-                            text=(
-                                f"Starting drt1 beam on CASM event {ddcasm['args'].get('id', 'unknown')}"
-                                f" with DM={ddcasm['args']['dm']}"
-                            ),
-                            icon_emoji=":robot_face::",
-                        )
-                    self.submit_voltagebeam(ddcasm["args"])
-                elif ddcasm["command"] == "test":
-                    logger.info("Received CASM test")
-
-            elif ddg["command_mjd"] != ddg0["command_mjd"]:
-                ddg0 = ddg.copy()
-
-                if ddg["command"] == "observation":   # TODO; check on types
-                    logger.info("Received GCN event. Not observing yet")  # TODO: test
-                    if not all(key in ddg["args"] for key in ["duration", "position"]):
-                        logger.warning(f"GCN args ({ddg['args']}) do not include 'duration' and 'position'. Skipping...")
-                        continue
-# TO DO: decide on respnonse
-#                    self.powerbeam(ddg["args"])
-                elif ddg["command"] == "test":
-                    logger.info("Received GCN test")
-            elif ddd["command_mjd"] != ddd0["command_mjd"]:
-                ddd0 = ddd.copy()
-
-                if ddd["command"] == "observation":   # TODO; check on types
-                    logger.info("Received DSA-110 event.")
-                    assert all(key in ddd["args"] for key in ["dm", "ra", "dec"])
-                    if cl is not None:
-                        response = cl.chat_postMessage(channel="#observing",
-                                                       text=f"Starting drt1 beam on DSA-110 event: DM={ddd['args']['dm']}, RA={ddd['args']['ra']}, DEC={ddd['args']['dec']}",
-                                                       icon_emoji = ":robot_face::")
-                    self.submit_voltagebeam({'dm': ddd['args']['dm'], 'position': f"{ddd['args']['ra']},{ddd['args']['dec']}"})
-                elif ddg["command"] == "test":
-                    logger.info("Received DSA-110 test")
-
-            elif ddl["command_mjd"] != ddl0["command_mjd"]:
-                ddl0 = ddl.copy()
-
-                if ddl["command"] == "observation":   # chime/ligo have command="observation" or "test"
-                    logger.info("Received LIGO event")
-                    nsamp = ddl["args"]["nsamp"] if "nsamp" in ddl["args"] else None
-                    if cl is not None:
-                        response = cl.chat_postMessage(channel="#observing", text=f"Starting voltage trigger on LIGO event: {ddl['args']}",
-                                                       icon_emoji = ":robot_face::")
-                    self.trigger(nsamp=nsamp)
-                elif ddl["command"] == "test":
-                    logger.info("Received LIGO test")
-                    if 'nsamp' in ddl:
-                        self.trigger(nsamp=ddl['nsamp'])
+            # TODO: validate args have correct fields (and maybe reject malicious content?)
+            events = dispatcher.diff(dd)
+            if dispatcher.missing:
+                print(f"Could not get complete dict from relay for {dispatcher.missing}: {dd}.")
+            if events:
+                scheduler.activity()
             else:
-                sleep(loop)
+                scheduler.idle()
+            dispatcher.dispatch(events)
+
+    def on_frb(self, event):
+        """ Voltage beam on a CHIME or CASM event. """
+
+        name = event.route.upper()
+        args = event.args
+        logger.info(f"Received {name} event")
+#        if args["known"]:   # TODO: check for sources we want to observe (e.g., by name or properties)
+        if cl is not None:
+            slack.post("#observing",
+                       f"Starting drt1 beam on {name} event {args.get('id', 'unknown')} with DM={args['dm']}",
+                       icon_emoji = ":robot_face::")
+#        self.submit_powerbeam(args)
+        trace.mark(args, 'lwa_alert_client', 'dispatch')
+        self.submit_voltagebeam(args)
+
+    def on_gcn(self, event):
+        logger.info("Received GCN event. Not observing yet")  # TODO: test
+# TO DO: decide on respnonse
+#        self.powerbeam(event.args)
+
+    def on_dsa(self, event):
+        args = event.args
+        logger.info("Received DSA-110 event.")
+        if cl is not None:
+            slack.post("#observing",
+                       f"Starting drt1 beam on DSA-110 event: DM={args['dm']}, RA={args['ra']}, DEC={args['dec']}",
+                       icon_emoji = ":robot_face::")
+        trace.mark(args, 'lwa_alert_client', 'dispatch')
+        self.submit_voltagebeam(trace.carry(args, {'dm': args['dm'], 'position': f"{args['ra']},{args['dec']}"}))
+
+    def on_ligo(self, event):
+        args = event.args
+        logger.info("Received LIGO event")
+        nsamp = args["nsamp"] if "nsamp" in args else None
+        if cl is not None:
+            slack.post("#observing", f"Starting voltage trigger on LIGO event: {args}",
+                       icon_emoji = ":robot_face::")
+        self.trigger(nsamp=nsamp)
+
+    def on_ligo_test(self, event):
+        logger.info("Received LIGO test")
+        if 'nsamp' in event.args:
+            self.trigger(nsamp=event.args['nsamp'])
 
     def trigger(self, nsamp=None):
         """ Trigger voltage dump
@@ -208,13 +193,18 @@ class LWAAlertClient(AlertClient):
             dm = float(dd["dm"])
             d0 = delay(dm, 1e9, 50) + 10  # Observe for the delay plus a bit more
 
+        from observing import makesdf
+
         sdffile = '/tmp/trigger_voltagebeam.sdf'
         makesdf.create(sdffile, n_obs=1, sess_mode='VOLT', obs_mode='TRK_RADEC', beam_num=int(RECORDER[-1:]),
                        obs_start='now', obs_dur=int(d0*1e3), int_time=0, ra=ra, dec=dec)
+        trace.mark(dd, 'lwa_alert_client', 'makesdf')
         # TODO: test required parameters for voltage beam from SDF
 
-        ls.put_dict('/cmd/observing/submitsdf', {'filename': sdffile, 'mode': 'asap'})
+        _store().put_dict('/cmd/observing/submitsdf', {'filename': sdffile, 'mode': 'asap'})
+        trace.mark(dd, 'lwa_alert_client', 'put_dict')
         self._schedule_voltage_beam_pipeline(dd, d0)
+        self.traces.post(dd)
 
     def _schedule_voltage_beam_pipeline(self, dd, duration_sec):
         """Queue Slurm FRB pipeline after observation completes (+ post-obs buffer).
@@ -307,6 +297,7 @@ class LWAAlertClient(AlertClient):
             )
             return
 
+        trace.mark(dd, 'lwa_alert_client', 'sbatch')
         job_id = parse_sbatch_job_id(out)
         logger.info(
             "Voltage beam sbatch: job_id=%s dm=%s duration_sec=%s begin=%s "
@@ -326,16 +317,11 @@ class LWAAlertClient(AlertClient):
             logger.debug("sbatch stderr: %s", err)
 
     def _slack_voltage_beam_failure(self, message):
-        if cl is None:
-            return
-        try:
-            cl.chat_postMessage(
-                channel="#observing",
-                text=f"Voltage beam pipeline scheduling failed: {message}",
-                icon_emoji=":warning:",
-            )
-        except SlackApiError as e:
-            logger.debug("Slack notify failed: %s", e)
+        slack.post(
+            "#observing",
+            f"Voltage beam pipeline scheduling failed: {message}",
+            icon_emoji=":warning:",
+        )
 
     def submit_powerbeam(self, dd):
         """ Submit an ASAP voltage beam observation
@@ -351,11 +337,13 @@ class LWAAlertClient(AlertClient):
             dm = float(dd["dm"])
             d0 = delay(dm, 1e9, 50) + 10  # Observe for the delay plus a bit more
 
+        from observing import makesdf
+
         sdffile = '/tmp/trigger_powerbeam.sdf'
         makesdf.create(sdffile, n_obs=1, sess_mode='POWER', obs_mode='TRK_RADEC', beam_num=int(RECORDER[-1:]),
                        obs_start='now', obs_dur=d0*1e3, ra=ra, dec=dec, int_time=128)
 
-        ls.put_dict('/cmd/observing/submitsdf', {'filename': sdffile, 'mode': 'asap'})
+        _store().put_dict('/cmd/observing/submitsdf', {'filename': sdffile, 'mode': 'asap'})
 
     def powerbeam(self, dd):
         """ Observe with power beam
@@ -384,6 +372,8 @@ class LWAAlertClient(AlertClient):
         self.con.control_bf(num=int(RECORDER[-1:]), coord=(RAh, Dec), track=True, duration=d0)  # RA must be in decimal hours
 
 if __name__ == '__main__':
+    from mnc import control
+
 #    xhosts = [f'lxdlwagpu0{i}' for i in [3,4,5,6,7,8]]  # remove bad gpus
     con = control.Controller()  # xhosts=xhosts)
     client = LWAAlertClient(con)
@@ -0,0 +1,195 @@
+"""In-process metrics in the Prometheus text format, with fixed memory per series.
+
+Histograms keep counts in fixed buckets, so memory does not grow with traffic. Label sets are
+expected to be small (route templates, methods, database operations). ``REGISTRY`` is shared by
+the relay, relay_db and the Slack notifier; ``relay_api`` serves it at ``/metrics``.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+# Seconds; spans a fast cached GET up to a held long-poll or a slow Slack call.
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class Histogram():
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """ Counts of observations per bucket (upper bounds in buckets, plus +Inf). """
+
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """ Estimate the q quantile by linear interpolation within its bucket. """
+
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+
+class Registry():
+    def __init__(self):
+        """ Named histograms and counters, each keyed by a tuple of (label, value) pairs. """
+
+        self._lock = threading.Lock()
+        self._histograms = {}  # name -> (help, {labels: Histogram})
+        self._counters = {}  # name -> (help, {labels: value})
+        self._collectors = []
+        self.started = time.time()
+
+    def observe(self, name, value, help='', **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, (help, {}))[1]
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name, value=1, help='', **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, (help, {}))[1]
+            series[key] = series.get(key, 0) + value
+
+    @contextmanager
+    def time(self, name, help='', **labels):
+        """ Context manager observing the duration of its block in seconds. """
+
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t0, help, **labels)
+
+    def timed(self, name, help='', **labels):
+        """ Decorator observing the duration of each call in seconds. """
+
+        def decorator(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.time(name, help, **labels):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def add_collector(self, fn):
+        """ Register fn() -> iterable of exposition lines, called on each render (e.g. gauges). """
+
+        self._collectors.append(fn)
+
+    def get(self, name, **labels):
+        """ Histogram or counter value for labels, or None. """
+
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            if name in self._histograms:
+                return self._histograms[name][1].get(key)
+            if name in self._counters:
+                return self._counters[name][1].get(key)
+        return None
+
+    def render(self):
+        """ Prometheus text exposition of every metric. """
+
+        lines = ['# TYPE process_uptime_seconds gauge',
+                 f'process_uptime_seconds {time.time() - self.started:.3f}']
+        with self._lock:
+            for name, (help, series) in sorted(self._counters.items()):
+                lines.extend(_header(name, help, 'counter'))
+                for key, value in sorted(series.items()):
+                    lines.append(f'{name}{_labels(key)} {value}')
+            for name, (help, series) in sorted(self._histograms.items()):
+                lines.extend(_header(name, help, 'histogram'))
+                quantiles = []
+                for key, histogram in sorted(series.items()):
+                    cumulative = 0
+                    for bound, n in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                        cumulative += n
+                        lines.append(f'{name}_bucket{_labels(key + (("le", bound),))} {cumulative}')
+                    lines.append(f'{name}_sum{_labels(key)} {histogram.sum:.6f}')
+                    lines.append(f'{name}_count{_labels(key)} {histogram.count}')
+                    for q in QUANTILES:
+                        quantiles.append(f'{name}_quantile{_labels(key + (("quantile", q),))} '
+                                         f'{histogram.quantile(q) or 0:.6f}')
+                # Estimated from buckets, for reading percentiles without a Prometheus server.
+                lines.extend(_header(f'{name}_quantile', f'{help} (estimated percentile)', 'gauge'))
+                lines.extend(quantiles)
+        for collector in self._collectors:
+            lines.extend(collector())
+        return '\n'.join(lines) + '\n'
+
+
+def _header(name, help, kind):
+    return ([f'# HELP {name} {help}'] if help else []) + [f'# TYPE {name} {kind}']
+
+
+def _labels(key):
+    if not key:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                          for k, v in key) + '}'
+
+
+class MetricsMiddleware():
+    def __init__(self, app, registry=None, prefix='relay'):
+        """ ASGI middleware recording request count and time to response start per route and method.
+
+        Routes are labeled by their template (e.g. /{instrument}), so label sets stay bounded.
+        For long-polls and streams the time includes the wait before the response starts.
+        """
+
+        self.app = app
+        self.registry = registry if registry is not None else REGISTRY
+        self.prefix = prefix
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        t0 = time.perf_counter()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+                self._record(scope, status[0], time.perf_counter() - t0)
+                status[0] = None
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if status[0] is not None:  # no response started (e.g. unhandled error)
+                self._record(scope, status[0], time.perf_counter() - t0)
+
+    def _record(self, scope, status, elapsed):
+        route = getattr(scope.get('route'), 'path', None) or 'unmatched'
+        self.registry.observe(f'{self.prefix}_request_seconds', elapsed, 'Time to response start',
+                              route=route, method=scope['method'])
+        self.registry.inc(f'{self.prefix}_requests_total', 1, 'Requests by route, method and status',
+                          route=route, method=scope['method'], status=status)
+
+
+REGISTRY = Registry()
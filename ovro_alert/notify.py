@@ -0,0 +1,134 @@
+"""Background Slack notifier shared by the relay, receivers and observing clients.
+
+``post`` only enqueues, so a slow Slack API never delays a relay response or a telescope
+trigger. A worker thread drains the queue, joining messages queued close together for the
+same channel into one post, sleeping through rate limits (HTTP 429 Retry-After), and
+dropping new messages when the queue is full (a count of drops is posted later).
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+from os import environ
+
+from ovro_alert.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+
+class SlackNotifier():
+    def __init__(self, client=None, maxsize=1000, coalesce_window=0.5, max_batch=20, max_retries=3):
+        """ Queue-backed Slack poster.
+        client is a slack_sdk WebClient (or anything with chat_postMessage). With client=None,
+        post() is a no-op, matching the "no token, no slack" behavior of callers.
+        """
+
+        self.client = client
+        self.coalesce_window = coalesce_window
+        self.max_batch = max_batch
+        self.max_retries = max_retries
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._done = threading.Condition(self._lock)
+        self._pending = 0
+        self._thread = None
+
+    @classmethod
+    def from_env(cls, name, **kwargs):
+        """ Notifier using the token in environment variable name, or a no-op one if unset.
+        """
+
+        if name not in environ:
+            return cls(None, **kwargs)
+        from slack_sdk import WebClient
+
+        return cls(WebClient(token=environ[name]), **kwargs)
+
+    def post(self, channel, text, icon_emoji=None):
+        """ Enqueue a message and return immediately. Returns False if not queued.
+        """
+
+        if self.client is None:
+            return False
+
+        self._start()
+        with self._lock:
+            try:
+                self._queue.put_nowait((channel, text, icon_emoji))
+            except queue.Full:
+                self.dropped += 1
+                REGISTRY.inc('slack_dropped_total', 1, 'Slack messages dropped with the queue full')
+                return False
+            self._pending += 1
+        return True
+
+    def flush(self, timeout=5):
+        """ Wait until queued messages are sent. Returns False on timeout.
+        """
+
+        with self._done:
+            return self._done.wait_for(lambda: self._pending == 0, timeout)
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='slack-notifier', daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.coalesce_window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            groups = OrderedDict()
+            for channel, text, icon_emoji in batch:
+                groups.setdefault((channel, icon_emoji), []).append(text)
+
+            with self._lock:
+                dropped, self.dropped = self.dropped, 0
+            if dropped:
+                channel, icon_emoji = next(iter(groups))
+                groups[(channel, icon_emoji)].append(f'({dropped} Slack messages dropped: notifier queue full)')
+
+            for (channel, icon_emoji), texts in groups.items():
+                self._send(channel, '\n'.join(texts), icon_emoji)
+
+            with self._done:
+                self._pending -= len(batch)
+                self._done.notify_all()
+
+    def _send(self, channel, text, icon_emoji):
+        from slack_sdk.errors import SlackApiError  # imported once a client exists, not at startup
+
+        kwargs = {'channel': channel, 'text': text}
+        if icon_emoji is not None:
+            kwargs['icon_emoji'] = icon_emoji
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                with REGISTRY.time('slack_post_seconds', 'Slack chat_postMessage duration'):
+                    self.client.chat_postMessage(**kwargs)
+                return
+            except SlackApiError as e:
+                if e.response.status_code == 429 and attempt < self.max_retries:
+                    delay = float(e.response.headers.get('Retry-After', 1))
+                    logger.warning(f'Slack rate limited; retrying in {delay} s')
+                    time.sleep(delay)
+                    continue
+                logger.error(f"Error sending to Slack: {e.response['error']}")
+                return
+            except Exception as e:
+                logger.error(f'Error sending to Slack: {type(e).__name__} - {e}')
+                return
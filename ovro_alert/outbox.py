@@ -0,0 +1,210 @@
+"""Durable local outbox for commands sent to the relay by receivers.
+
+``Outbox.put`` appends commands to a small SQLite file and returns once they are on disk
+(``synchronous=FULL``, so the commit is fsynced). A background thread sends them to the relay in
+order with ``PUT /bulk``, in batches, backing off while the relay is slow or down, and deletes
+them only once the relay has accepted them. A batch the relay rejects (a 4xx other than 401, 408
+or 429) is moved to the ``outbox_dead`` table instead of being retried forever. Commands left in
+the file when a receiver stops are sent when it starts again.
+
+Enable it for an ``AlertClient`` with ``AlertClient(route, outbox=path)``; receivers take the
+directory from the environment::
+
+    OVRO_ALERT_OUTBOX_DIR=/home/ubuntu/outbox   (one <name>.db per receiver)
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import uuid
+from os import environ
+
+from ovro_alert.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = (401, 408, 429)  # 4xx worth retrying: bad key (fixed by config), timeout, rate limit
+
+
+def _rejected(status):
+    return status is not None and 400 <= status < 500 and status not in RETRY_STATUSES
+
+
+class Outbox():
+    def __init__(self, path, client, batch=100, backoff=1.0, max_backoff=60.0):
+        """ Outbox in the SQLite file at path, flushed to the relay through client (an AlertClient).
+        Sends at most batch commands per request; waits backoff seconds after a failed send,
+        doubling up to max_backoff. Call start() to begin flushing.
+        """
+
+        self.path = path
+        self.client = client
+        self.batch = batch
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closing = threading.Event()
+        self._thread = None
+
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        with self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS outbox (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                               "instrument TEXT NOT NULL, command TEXT NOT NULL, command_mjd REAL NOT NULL, "
+                               "args TEXT NOT NULL)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS outbox_dead (id INTEGER PRIMARY KEY, "
+                               "instrument TEXT NOT NULL, command TEXT NOT NULL, command_mjd REAL NOT NULL, "
+                               "args TEXT NOT NULL, status INTEGER NOT NULL)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS outbox_meta (id TEXT NOT NULL, "
+                               "inflight_first INTEGER, inflight_last INTEGER)")
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(outbox_meta)")]
+            if 'inflight_first' not in columns:  # file from an older version
+                self._conn.execute("ALTER TABLE outbox_meta ADD COLUMN inflight_first INTEGER")
+                self._conn.execute("ALTER TABLE outbox_meta ADD COLUMN inflight_last INTEGER")
+            self._conn.execute("INSERT INTO outbox_meta (id) SELECT ? WHERE NOT EXISTS (SELECT 1 FROM outbox_meta)",
+                               (uuid.uuid4().hex,))
+        # id names this file in Idempotency-Keys. The id range of a batch is recorded before it is
+        # sent and cleared once the relay accepts it, so after a failure (or a restart) exactly the
+        # same batch is resent with the same key and the relay applies it once.
+        self.id, first, last = self._conn.execute(
+            "SELECT id, inflight_first, inflight_last FROM outbox_meta").fetchone()
+        self._inflight = (first, last) if first is not None else None
+
+    def put(self, commands):
+        """ Append commands (dicts with instrument, command, command_mjd, args) and fsync.
+        Returns the number of commands waiting to be sent.
+        """
+
+        rows = [(cmd["instrument"], cmd["command"], cmd["command_mjd"], json.dumps(cmd["args"])) for cmd in commands]
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT INTO outbox (instrument, command, command_mjd, args) VALUES (?, ?, ?, ?)",
+                                   rows)
+            pending = self._conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+        self._wake.set()
+        return pending
+
+    def pending(self):
+        """ Number of commands not yet accepted by the relay. """
+
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def dead(self):
+        """ Number of commands the relay rejected, kept in outbox_dead. """
+
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM outbox_dead").fetchone()[0]
+
+    def flush_once(self):
+        """ Send the oldest batch to the relay. Returns number sent or dead-lettered (0 if empty), or
+        None on a failure worth retrying.
+        """
+
+        with self._lock, self._conn:
+            rows = []
+            if self._inflight is not None:
+                rows = self._conn.execute("SELECT id, instrument, command, command_mjd, args FROM outbox "
+                                          "WHERE id BETWEEN ? AND ? ORDER BY id", self._inflight).fetchall()
+            if not rows:
+                rows = self._conn.execute("SELECT id, instrument, command, command_mjd, args FROM outbox "
+                                          "ORDER BY id LIMIT ?", (self.batch,)).fetchall()
+                self._set_inflight((rows[0][0], rows[-1][0]) if rows else None)
+        if not rows:
+            return 0
+
+        commands = [{"instrument": instrument, "command": command, "command_mjd": command_mjd,
+                     "args": json.loads(args)} for _, instrument, command, command_mjd, args in rows]
+        key = f'outbox-{self.id}-{rows[0][0]}-{rows[-1][0]}'
+        try:
+            status = self.client.put_bulk(commands, chunk=len(commands), idempotency_key=key)
+        except Exception as e:
+            logger.warning(f'Outbox could not reach relay: {type(e).__name__} - {e}')
+            status = None
+        if status != 200 and not _rejected(status):
+            REGISTRY.inc('outbox_send_failures_total', 1, 'Failed outbox sends to the relay')
+            return None
+
+        with self._lock, self._conn:
+            if status != 200:
+                self._conn.execute("INSERT OR REPLACE INTO outbox_dead (id, instrument, command, command_mjd, args, "
+                                   "status) SELECT id, instrument, command, command_mjd, args, ? FROM outbox "
+                                   "WHERE id <= ?", (status, rows[-1][0]))
+            self._conn.execute("DELETE FROM outbox WHERE id <= ?", (rows[-1][0],))
+            self._set_inflight(None)
+        if status != 200:
+            logger.error(f'Relay rejected {len(rows)} outbox commands with {status}; '
+                         f'moved to outbox_dead in {self.path}')
+            REGISTRY.inc('outbox_rejected_total', len(rows), 'Outbox commands rejected by the relay')
+        else:
+            REGISTRY.inc('outbox_sent_total', len(rows), 'Commands sent to the relay from the outbox')
+        return len(rows)
+
+    def _set_inflight(self, inflight):
+        # Caller holds _lock and commits.
+        self._inflight = inflight
+        self._conn.execute("UPDATE outbox_meta SET inflight_first = ?, inflight_last = ?", inflight or (None, None))
+
+    def flush(self):
+        """ Send until empty or a send fails. Returns True if the outbox is empty. """
+
+        while True:
+            sent = self.flush_once()
+            if sent is None:
+                return False
+            if sent == 0:
+                return True
+
+    def start(self):
+        """ Start the background flusher (idempotent). """
+
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='alert-outbox', daemon=True)
+            self._thread.start()
+            self._wake.set()  # send anything left from a previous run
+        return self
+
+    def _run(self):
+        delay = self.backoff
+        while not self._closing.is_set():
+            self._wake.wait()
+            self._wake.clear()
+            while not self._closing.is_set():
+                sent = self.flush_once()
+                if sent == 0:
+                    delay = self.backoff
+                    break
+                if sent is None:
+                    logger.warning(f'Outbox has {self.pending()} commands waiting; retrying in {delay} s')
+                    self._closing.wait(delay)
+                    delay = min(2 * delay, self.max_backoff)
+        self.flush()  # last attempt, for close()
+
+    def close(self, timeout=5):
+        """ Stop the flusher after a last attempt to send, waiting at most timeout seconds, and
+        close the file. Unsent commands stay on disk for the next run.
+        """
+
+        self._closing.set()
+        self._wake.set()
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self.flush, name='alert-outbox', daemon=True)
+            self._thread.start()
+        self._thread.join(timeout)
+        if self._thread.is_alive():  # relay slow or down; leave the file open for the sender
+            logger.warning(f'Outbox still sending after {timeout} s; unsent commands stay in {self.path}')
+            return
+        with self._lock:
+            self._conn.close()
+
+
+def path_from_env(name):
+    """ Outbox file for receiver name in OVRO_ALERT_OUTBOX_DIR, or None if that is unset. """
+
+    directory = environ.get('OVRO_ALERT_OUTBOX_DIR')
+    if not directory:
+        return None
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, name + '.db')
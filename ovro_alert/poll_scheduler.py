@@ -0,0 +1,67 @@
+"""Adaptive intervals for clients that poll the relay.
+
+After a poll that saw a new command the interval drops to ``min_interval``, so follow-ups in a
+burst (e.g. a LIGO preliminary then initial notice) are seen quickly; each quiet or failed poll
+multiplies it by ``decay`` up to ``max_interval``. Every delay is jittered by up to
+``jitter`` (a fraction), so clients started together do not poll the relay in lockstep, and a
+server hint (HTTP Retry-After) is never undercut::
+
+    scheduler = PollScheduler(min_interval=0.5, max_interval=5)
+    while True:
+        dd = client.get_many(routes)
+        scheduler.hint(client.retry_after)
+        scheduler.activity() if changed(dd) else scheduler.idle()
+        scheduler.wait()
+"""
+import random
+import time
+
+
+class PollScheduler():
+    def __init__(self, min_interval=0.5, max_interval=5.0, decay=2.0, jitter=0.1, rng=None, sleep=None):
+        """ Poll interval between min_interval and max_interval seconds (starting idle at max_interval).
+        rng (a random.Random) and sleep can be replaced in tests.
+        """
+
+        if not 0 < min_interval <= max_interval:
+            raise ValueError(f'Need 0 < min_interval <= max_interval; got {min_interval}, {max_interval}')
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.decay = decay
+        self.jitter = jitter
+        self.interval = max_interval
+        self._rng = rng or random.Random()
+        self._sleep = sleep or time.sleep
+        self._hint = None
+
+    def activity(self):
+        """ The last poll saw a new command: poll again soon. """
+
+        self.interval = self.min_interval
+
+    def idle(self):
+        """ The last poll saw nothing new (or failed): back off toward max_interval. """
+
+        self.interval = min(self.interval * self.decay, self.max_interval)
+
+    def hint(self, seconds):
+        """ Server-suggested delay (e.g. Retry-After) for the next wait only; None is ignored. """
+
+        if seconds is not None and seconds >= 0:
+            self._hint = seconds if self._hint is None else max(self._hint, seconds)
+
+    def next_delay(self):
+        """ Seconds until the next poll: the jittered interval, or the pending hint if longer. """
+
+        delay = self.interval * (1 + self._rng.uniform(-self.jitter, self.jitter))
+        if self._hint is not None:
+            delay = max(delay, self._hint)
+            self._hint = None
+        return delay
+
+    def wait(self):
+        """ Sleep for next_delay() and return the delay. """
+
+        delay = self.next_delay()
+        self._sleep(delay)
+        return delay
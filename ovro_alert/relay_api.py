@@ -1,17 +1,35 @@
 from os import environ
-from typing import Union
+from pathlib import Path
+from typing import List, Optional, Union
+from urllib.parse import urlencode
+import asyncio
+import functools
+import hashlib
+import json
 import logging
+import re
+import string
 import sys
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 
-from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, Header, Request, Response
+from fastapi.responses import HTMLResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from pydantic import BaseModel
 from fastapi.templating import Jinja2Templates
 
-from astropy import time
 from slack_sdk import WebClient
-from ovro_alert import relay_db
+from ovro_alert import metrics, notify, relay_db, relay_state, timeutil, trace
+
+try:
+    import orjson
+
+    _dumps = orjson.dumps
+except ImportError:
+    def _dumps(obj):
+        return json.dumps(obj, separators=(',', ':')).encode()
 
 
 logger = logging.getLogger('fastapi')
@@ -26,6 +44,7 @@ if "SLACK_TOKEN_CR" in environ:
 else:
     logger.warning("No slack token found. Will not push to slack.")
     cl = None
+slack = notify.SlackNotifier(cl)
 
 if "RELAY_KEY" in environ:
     RELAY_KEY = environ["RELAY_KEY"]
@@ -33,199 +52,822 @@ else:
     RELAY_KEY = input("enter RELAY_KEY")
 
 app = FastAPI()
+app.add_middleware(metrics.MetricsMiddleware)
 #app.add_middleware(TrustedHostMiddleware, allowed_hosts=["*.caltech.edu"])
-templates = Jinja2Templates(directory="templates")
-
-dd = {"dsa": {"command": None, "command_mjd": None},
-      "lwa": {"command": None, "command_mjd": None},
-      "ligo": {"command": None, "command_mjd": None},
-      "chime": {"command": None, "command_mjd": None},
-      "casm": {"command": None, "command_mjd": None},
-      "gcn": {"command": None, "command_mjd": None}}
+templates = Jinja2Templates(directory=str(Path(__file__).parent / "templates"))
+
+
+DEFAULT_SLACK_MESSAGE = "{instrument} event with args: {args}"
+
+
+class Instrument(BaseModel):
+    """How PUTs to /{name} are persisted and announced.
+
+    persist is "all", "observation" (only command == 'observation') or "none". Slack posts are
+    made for observation commands when slack_channel is set (off by default, so auto-registered
+    routes stay quiet until enabled with PUT /instruments); slack_message is formatted with the
+    command args plus {instrument} and {args}, falling back to slack_fallback (then the default)
+    if an arg is missing or does not fit the format spec.
+    """
+    name: str
+    persist: str = "observation"
+    slack_channel: Optional[str] = None
+    slack_message: str = DEFAULT_SLACK_MESSAGE
+    slack_fallback: Optional[str] = None
+    response: Optional[str] = None
+
+
+PERSIST_POLICIES = ("all", "observation", "none")
+INSTRUMENT_NAME = re.compile(r'^[a-z0-9_-]{1,32}$')
+
+# Instruments known at startup. Others are registered by PUT /instruments or on their first PUT.
+SLACK_CHANNEL = "#alert-driven-astro"
+DEFAULT_INSTRUMENTS = [
+    Instrument(name="dsa", slack_channel=SLACK_CHANNEL, slack_message="DSA-110 event {trigname} received",
+               slack_fallback="DSA-110 event received", response="Set dsa command"),
+    Instrument(name="lwa", persist="all", response="Set lwa command"),
+    Instrument(name="ligo", slack_channel=SLACK_CHANNEL, slack_message="LIGO event {GraceID} received",  # more verbose logging by receiver script
+               slack_fallback="LIGO event received", response="Set LIGO event"),
+    Instrument(name="chime", slack_channel=SLACK_CHANNEL, slack_message="CHIME/FRB event {event_no} received",  # more detail may be posted by reader client
+               slack_fallback="CHIME/FRB event received: {args}", response="Set CHIME event"),
+    Instrument(name="casm", slack_channel=SLACK_CHANNEL, slack_message="CASM event {event_no} received",
+               slack_fallback="CASM event received: {args}", response="Set CASM event"),
+    Instrument(name="gcn", slack_channel=SLACK_CHANNEL, slack_message="GCN event with args: {args}",  # TODO: parse this for clarity
+               response="Set GCN event"),
+]
+
+instruments = {instrument.name: instrument for instrument in DEFAULT_INSTRUMENTS}
+dd = {name: {"command": None, "command_mjd": None} for name in instruments}
+
+MAX_HISTORY_PAGE = 1000
+MAX_BULK = 1000
+
+# Long-poll GETs (?since_mjd=...&wait=...) and /stream park a future here until a PUT sets that instrument.
+MAX_WAIT = 60
+STREAM_HEARTBEAT = 15
+_waiters = {instrument: set() for instrument in dd}
+# Each /stream connection has a queue here that _apply feeds with every event for its routes.
+STREAM_QUEUE_SIZE = 1024
+_subscribers = {instrument: set() for instrument in dd}
+
+
+# Every PUT gets a per-instrument sequence number and is kept in a ring buffer for /{instrument}/events.
+# Handlers run on the event loop. State changes go through _state_executor, a single thread, so
+# they are applied in order without blocking the loop on store I/O. _lock only keeps readers from
+# seeing dd/_seq/_events half-updated and is never held during store I/O, so the loop can take it.
+# SQLite reads for /history, /home and /events run in _db_executor.
+EVENT_BUFFER_SIZE = 1024
+DB_READERS = 4
+_lock = threading.Lock()
+_state_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='relay-state')
+_db_executor = ThreadPoolExecutor(max_workers=DB_READERS, thread_name_prefix='relay-db')
+_seq = {instrument: 0 for instrument in dd}
+_events = {instrument: deque(maxlen=EVENT_BUFFER_SIZE) for instrument in dd}
+
+# dd/_seq/_events are this worker's copy of the state store (relay_state), which is shared between
+# workers when RELAY_STATE is sqlite or shm. Changes made by other workers are pulled in by
+# _sync_state, on each read and every STATE_POLL_INTERVAL seconds, which also wakes long-polls.
+STATE_POLL_INTERVAL = 0.05
+store = relay_state.from_env()
+_store_version = None
+_watcher = None
+
+# GETs serve pre-serialized state, rebuilt only when it changes. ETags are weak (read_mjd differs
+# per response) and include the store id so a restarted in-memory relay never matches an old tag.
+
+
+def _render(instrument):
+    """Return (etag, serialized state) for instrument. Call with _lock held."""
+    return f'W/"{store.id}-{instrument}-{_seq[instrument]}"', _dumps(dd[instrument])
+
+
+_cache = {instrument: _render(instrument) for instrument in dd}
+
+
+def _apply(instrument, seq, state):
+    """Make state (numbered seq in the store) current in this worker. Call with _lock held."""
+    if seq != _seq[instrument] + 1:
+        _events[instrument].clear()  # set by another worker in between; /events reports the gap
+    dd[instrument] = state
+    _seq[instrument] = seq
+    if seq:
+        event = {"seq": seq}
+        event.update(state)
+        _events[instrument].append(event)
+        for loop, queue in list(_subscribers[instrument]):
+            loop.call_soon_threadsafe(_offer, queue, (instrument, event))
+    _cache[instrument] = _render(instrument)
+
+
+def _offer(queue, item):
+    """Queue a stream event; a subscriber too slow to keep up is marked to be disconnected."""
+    try:
+        queue.put_nowait(item)
+    except asyncio.QueueFull:
+        queue.overflowed = True
+
+
+def _register(instrument):
+    """Add or replace a registry entry, creating state for a new instrument. Call with _lock held."""
+    name = instrument.name
+    if name not in dd:
+        dd[name] = {"command": None, "command_mjd": None}
+        _seq[name] = 0
+        _events[name] = deque(maxlen=EVENT_BUFFER_SIZE)
+        _waiters[name] = set()
+        _subscribers[name] = set()
+        _cache[name] = _render(name)
+    instruments[name] = instrument
+    return instrument
+
+
+def _bad_name(name):
+    """Reason name cannot be an instrument route, or None if it can."""
+    if not INSTRUMENT_NAME.match(name):
+        return f"Bad instrument name: {name}"
+    if any(route.path == f"/{name}" for route in app.routes):
+        return f"Reserved route: {name}"
+    return None
+
+
+def _bad_template(template):
+    """Reason template cannot be a slack_message, or None if it can be formatted with named args."""
+    try:
+        fields = [field for _, field, _, _ in string.Formatter().parse(template) if field is not None]
+    except ValueError as e:
+        return f"Bad Slack message {template!r}: {e}"
+    for field in fields:
+        if not field.isidentifier():  # positional, attribute or index lookups
+            return f"Bad Slack message {template!r}: use {{name}} fields only, not {{{field}}}"
+    return None
+
+
+def _slack_message(instrument, command):
+    """Slack text for command. Never raises: the command is already applied when this runs."""
+    args = {k: v for k, v in command.args.items() if k != trace.KEY}
+    fields = dict(args, instrument=instrument.name, args=args)
+    for template in (instrument.slack_message, instrument.slack_fallback):
+        if template is None:
+            continue
+        try:
+            return template.format_map(fields)
+        except KeyError:
+            continue
+        except Exception as e:
+            logger.warning(f"Cannot format {instrument.name} Slack message {template!r}: {type(e).__name__} - {e}")
+    return DEFAULT_SLACK_MESSAGE.format_map(fields)
+
+
+def _set_states(updates):
+    numbered = [(instrument, store.set(instrument, state), state) for instrument, state in updates]
+    with _lock:
+        for instrument, seq, state in numbered:
+            _apply(instrument, seq, state)
+
+
+async def _update(instrument, command):
+    """Set current state for instrument, log it as the next event and wake waiters."""
+    await _update_many([(instrument, command)])
+
+
+async def _update_many(updates):
+    """Apply (instrument, command) updates in order in one hop to the state thread."""
+    states = [(instrument, {"command": command.command, "command_mjd": command.command_mjd,
+                            "args": command.args})
+              for instrument, command in updates]
+    await asyncio.get_running_loop().run_in_executor(_state_executor, _set_states, states)
+    for instrument in dict.fromkeys(instrument for instrument, _ in updates):
+        _notify(instrument)
+
+
+async def _read_db(fn, *args):
+    """Run a blocking relay_db query in the bounded reader pool."""
+    return await asyncio.get_running_loop().run_in_executor(_db_executor, fn, *args)
+
+
+def _sync_state(force=False):
+    """Pull in commands set by other workers since the last call and wake their waiters."""
+    global _store_version
+    if not (store.shared or force):
+        return
+    version = store.version()
+    if version == _store_version and not force:
+        return
+    snapshot = store.snapshot()
+    changed = []
+    with _lock:
+        _store_version = version
+        for instrument, (seq, state) in snapshot.items():
+            if instrument not in instruments:
+                _register(Instrument(name=instrument))  # first seen by another worker
+            if force or seq != _seq[instrument]:
+                _apply(instrument, seq, state)
+                changed.append(instrument)
+    for instrument in changed:
+        _notify(instrument)
+
+
+async def _refresh():
+    """Sync with a shared store before a read, off the event loop."""
+    if store.shared:
+        await asyncio.get_running_loop().run_in_executor(_state_executor, _sync_state)
+
+
+async def _watch_state():
+    """Poll the shared store so long-polls and streams wake for PUTs handled by other workers."""
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(STATE_POLL_INTERVAL)
+        try:
+            await loop.run_in_executor(_state_executor, _sync_state)
+        except Exception as e:
+            logger.error(f"Error reading relay state: {type(e).__name__} - {e}")
+
+
+# A PUT replayed by client retries (same Idempotency-Key header, or identical body when there is
+# no header) returns the first response without touching state, the database or Slack. A replay
+# whose original failed runs the PUT itself; one whose original is still running after
+# IDEMPOTENCY_WAIT seconds gets a 503 so the client retries later.
+IDEMPOTENCY_CACHE_SIZE = 4096
+IDEMPOTENCY_WAIT = 30
+_idempotency = OrderedDict()  # (instrument, token) -> [asyncio.Event set when done, response]
+_FAILED = object()
+
+
+def _content_key(*commands):
+    body = json.dumps([[command.instrument, command.command, command.command_mjd, command.args]
+                       for command in commands], sort_keys=True, default=str)
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+def _in_progress(token):
+    logger.warning(f"Replayed PUT {token} is still in progress after {IDEMPOTENCY_WAIT} s")
+    return Response(content=_dumps("PUT with this key is still in progress; retry"), status_code=503,
+                    media_type="application/json", headers={"Retry-After": "1"})
+
+
+async def _once(token, run):
+    """Await run() once per token; later calls with the same token get the first result.
+
+    With a shared store the keys live in store.keys, so a retry that reaches another worker is
+    also answered from the first response; otherwise they are cached in this process.
+    """
+    if store.keys is not None:
+        return await _once_shared(json.dumps(token), run)
+
+    entry = _idempotency.get(token)
+    while entry is not None:
+        _idempotency.move_to_end(token)
+        try:
+            await asyncio.wait_for(entry[0].wait(), timeout=IDEMPOTENCY_WAIT)
+        except asyncio.TimeoutError:
+            return _in_progress(token)
+        if entry[1] is not _FAILED:
+            logger.info(f"Replayed {token[0]} PUT; returning original response")
+            return entry[1]
+        entry = _idempotency.get(token)  # original failed: run it here unless another replay took over
+
+    entry = _idempotency[token] = [asyncio.Event(), None]
+    while len(_idempotency) > IDEMPOTENCY_CACHE_SIZE:
+        _idempotency.popitem(last=False)
+    try:
+        entry[1] = await run()
+    except BaseException:
+        entry[1] = _FAILED
+        if _idempotency.get(token) is entry:
+            del _idempotency[token]
+        raise
+    finally:
+        entry[0].set()
+    return entry[1]
+
+
+async def _once_shared(token, run):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + IDEMPOTENCY_WAIT
+    while True:
+        owner, response = await loop.run_in_executor(_db_executor, store.keys.claim, token)
+        if owner:
+            break
+        if response is not None:
+            logger.info(f"Replayed PUT {token}; returning original response")
+            return response
+        if loop.time() >= deadline:  # original still in flight on some worker
+            return _in_progress(token)
+        await asyncio.sleep(0.05)  # claimed again once a failed original releases the key
+
+    try:
+        response = await run()
+    except BaseException:
+        await loop.run_in_executor(_db_executor, store.keys.release, token)
+        raise
+    await loop.run_in_executor(_db_executor, store.keys.finish, token, response)
+    return response
+
+
+def _idempotent(handler):
+    """Decorate a PUT handler so it runs at most once per (instrument, idempotency key)."""
+    @functools.wraps(handler)
+    async def wrapper(instrument, command, key, idempotency_key=None):
+        if key != RELAY_KEY:
+            return await handler(instrument, command, key, idempotency_key)
+
+        token = (instrument, idempotency_key or _content_key(command))
+        return await _once(token, lambda: handler(instrument, command, key, idempotency_key))
+    return wrapper
+
+
+def _restore_state():
+    """Load each instrument's latest persisted command into the store (one indexed query per instrument).
+
+    Restored state keeps seq 0 and is not logged as an event, so pollers see the same
+    command_mjd as before the restart rather than a spurious change. A shared store that already
+    has state (another worker started first) is left alone.
+    """
+    for name in relay_db.get_instruments():
+        if name not in instruments and _bad_name(name) is None:
+            with _lock:
+                _register(Instrument(name=name))
+    for instrument in list(instruments):
+        command = relay_db.get_latest(instrument)
+        if command is None:
+            continue
+        state = {"command": command.command, "command_mjd": command.command_mjd, "args": command.args}
+        if store.restore(instrument, state):
+            logger.info(f"Restored {instrument} state from {command.command} at {command.command_mjd}")
+    _sync_state(force=True)
+
+
+def _json_response(etag, body, if_none_match):
+    """Wrap a serialized {...} body with a fresh read_mjd, or 304 if the client has etag."""
+    if if_none_match is not None and etag in (tag.strip() for tag in if_none_match.split(',')):
+        return Response(status_code=304, headers={"ETag": etag})
+    content = b'{"read_mjd":' + _dumps(timeutil.now_mjd()) + b',' + body[1:]
+    return Response(content=content, media_type="application/json", headers={"ETag": etag})
+
+
+def _wake(fut):
+    if not fut.done():
+        fut.set_result(None)
+
+
+def _notify(instrument):
+    """Wake long-poll requests waiting on instrument. Safe to call from threadpool handlers."""
+    for loop, fut in list(_waiters[instrument]):
+        loop.call_soon_threadsafe(_wake, fut)
+
+
+async def _wait_for_any(instruments, changed, timeout):
+    """Wait until changed() is true, re-checking each time one of instruments is set.
+
+    Returns changed() at exit, so False means the timeout expired with nothing new.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not changed():
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            return False
+        entry = (loop, loop.create_future())
+        for instrument in instruments:
+            _waiters[instrument].add(entry)
+        try:
+            if not changed():
+                await asyncio.wait_for(entry[1], timeout=remaining)
+        except asyncio.TimeoutError:
+            return changed()
+        finally:
+            for instrument in instruments:
+                _waiters[instrument].discard(entry)
+    return True
+
+
+async def _wait_for_change(instrument, since_mjd, wait):
+    """Return once dd[instrument] no longer has command_mjd == since_mjd or wait seconds pass."""
+    if since_mjd is None or wait <= 0:
+        return
+    await _wait_for_any([instrument], lambda: dd[instrument]["command_mjd"] != since_mjd,
+                        min(wait, MAX_WAIT))
+
+
+async def _read_state(instrument, since_mjd=None, wait=0, if_none_match=None):
+    await _refresh()
+    await _wait_for_change(instrument, since_mjd, wait)
+    etag, body = _cache[instrument]
+    return _json_response(etag, body, if_none_match)
+
+
+def _parse_cursor(text):
+    """{instrument: seq} from a stream cursor like "chime:5,gcn:2" (unparseable parts are ignored)."""
+    cursor = {}
+    for part in (text or '').split(','):
+        instrument, _, seq = part.partition(':')
+        try:
+            cursor[instrument.strip()] = int(seq)
+        except ValueError:
+            continue
+    return cursor
+
+
+def _stream_backlog(instrument, buffered, last_seq, state, after, since_mjd):
+    """Events to send on connect for one instrument: those after the client's seq cursor, or
+    newer than since_mjd, or (for a new client) the current state."""
+    if after is not None and after <= last_seq:
+        missed = [event for event in buffered if event["seq"] > after]
+        if after < last_seq and (not missed or missed[0]["seq"] != after + 1):
+            # Older than the buffer: send what is left (or the current state), marked as a gap.
+            missed = missed or [dict(state, seq=last_seq)]
+            missed[0] = dict(missed[0], gap=True)
+        return missed
+    if since_mjd is not None and after is None:
+        missed = [event for event in buffered if event["command_mjd"] > since_mjd]
+        if not missed and state["command_mjd"] is not None and state["command_mjd"] > since_mjd:
+            missed = [dict(state, seq=last_seq)]
+        return missed
+    return [dict(state, seq=last_seq)]  # new client, or a cursor from before a relay restart
+
+
+async def _stream_events(request, instruments, since_mjd=None, cursor=None):
+    """Yield a server-sent event for every change to instruments, in order.
+
+    On connect, sends what the client has not seen: with cursor ({instrument: seq} from the last
+    event id), the buffered events after it; with only since_mjd, the buffered events newer than
+    it; otherwise the current state of each instrument. Then every event as it is applied. The
+    event id is the cursor after that event ("chime:5,gcn:2"); pass it back as Last-Event-ID or
+    ?since= to resume. A client too slow to keep up is disconnected and can resume the same way.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+    queue.overflowed = False
+    entry = (loop, queue)
+    cursor = cursor or {}
+    backlog = []
+    sent = {}  # instrument -> seq of the last event the client has
+    with _lock:  # subscribe and snapshot together, so no event falls between them
+        for instrument in instruments:
+            _subscribers[instrument].add(entry)
+            after = cursor.get(instrument)
+            sent[instrument] = after if after is not None and after <= _seq[instrument] else 0
+            backlog += [(instrument, event) for event in
+                        _stream_backlog(instrument, list(_events[instrument]), _seq[instrument],
+                                        dd[instrument], after, since_mjd)]
+
+    def message(instrument, event):
+        sent[instrument] = event["seq"]
+        data = {"instrument": instrument, "read_mjd": timeutil.now_mjd()}
+        data.update(event)
+        event_id = ','.join(f'{name}:{seq}' for name, seq in sent.items())
+        return f"id: {event_id}\nevent: {instrument}\ndata: {json.dumps(data)}\n\n"
+
+    try:
+        for instrument, event in backlog:
+            yield message(instrument, event)
+        while not await request.is_disconnected():
+            if queue.overflowed:
+                logger.warning(f"Stream for {instruments} fell {STREAM_QUEUE_SIZE} events behind; disconnecting")
+                return
+            try:
+                instrument, event = await asyncio.wait_for(queue.get(), STREAM_HEARTBEAT)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if event["seq"] <= sent[instrument]:
+                continue  # already sent from the backlog
+            yield message(instrument, event)
+    finally:
+        for instrument in instruments:
+            _subscribers[instrument].discard(entry)
 
 
 @app.on_event("startup")
 async def startup_event():
-    """Create database on startup."""
+    """Create database on startup and restore the last persisted command per instrument."""
+    global _watcher
     relay_db.create_db()
+    _restore_state()
+    if store.shared:
+        _watcher = asyncio.get_running_loop().create_task(_watch_state())
 
 
-@app.get("/home", response_class=HTMLResponse)
-async def get_root(request: Request, key: str):
-    if key == RELAY_KEY:
-        commands = relay_db.get_commands()
-        return templates.TemplateResponse("index.html", context={"request": request, "commands": commands})
-    else:
-        return "Bad key"
+@app.on_event("shutdown")
+def shutdown_event():
+    """Commit queued database writes and close connections."""
+    if _watcher is not None:
+        _watcher.cancel()
+    relay_db.close()
+    store.close()
 
-@app.get("/lwa")
-def get_lwa(key):
+
+def _history_json(rows, next_cursor):
+    """Stream a history page as JSON. Stored args are already JSON text and are passed through."""
+    yield b'{"commands":['
+    for i, (row_id, instrument, command, command_mjd, args) in enumerate(rows):
+        head = _dumps({"id": row_id, "instrument": instrument, "command": command, "command_mjd": command_mjd})
+        yield (b',' if i else b'') + head[:-1] + b',"args":' + args.encode() + b'}'
+    yield b'],"next_cursor":' + _dumps(next_cursor) + b'}'
+
+
+@app.get("/history")
+async def get_history(key: str, instrument: Optional[str] = None, from_mjd: Optional[float] = None,
+                to_mjd: Optional[float] = None, limit: int = 100, cursor: Optional[str] = None):
+    """One page of persisted commands, newest first. Pass next_cursor back as cursor for the next page."""
     if key == RELAY_KEY:
-        dd2 = {"read_mjd": time.Time.now().mjd}
-        dd2.update(dd["lwa"])
-        return dd2
+        try:
+            rows, next_cursor = await _read_db(relay_db.get_history, instrument, from_mjd, to_mjd,
+                                               max(1, min(limit, MAX_HISTORY_PAGE)), cursor)
+        except ValueError:
+            return "Bad cursor"
+        return StreamingResponse(_history_json(rows, next_cursor), media_type="application/json")
     else:
         return "Bad key"
 
 
-@app.put("/lwa")
-def set_lwa(command: relay_db.Command, key: str):
+@app.get("/home", response_class=HTMLResponse)
+async def get_root(request: Request, key: str, instrument: Optional[str] = None, from_mjd: Optional[float] = None,
+             to_mjd: Optional[float] = None, limit: int = 100, cursor: Optional[str] = None):
     if key == RELAY_KEY:
-        dd['lwa'] = {"command": command.command, "command_mjd": command.command_mjd,
-                     "args": command.args}
-        relay_db.set_command(command)
-        return f"Set lwa command: {command.command} with {command.args}"
-
+        try:
+            rows, next_cursor = await _read_db(relay_db.get_history, instrument, from_mjd, to_mjd,
+                                               max(1, min(limit, MAX_HISTORY_PAGE)), cursor)
+        except ValueError:
+            return "Bad cursor"
+        commands = relay_db.history_commands(rows)
+        next_url = None
+        if next_cursor is not None:
+            params = {"key": key, "instrument": instrument, "from_mjd": from_mjd, "to_mjd": to_mjd,
+                      "limit": limit, "cursor": next_cursor}
+            next_url = "/home?" + urlencode({k: v for k, v in params.items() if v is not None})
+        return templates.TemplateResponse(request, "index.html", context={"commands": commands, "next_url": next_url})
     else:
         return "Bad key"
 
 
-@app.get("/dsa")
-def get_dsa(key):
+@app.get("/stream")
+async def get_stream(request: Request, key: str, routes: str, since_mjd: Optional[float] = None,
+                     since: Optional[str] = None, last_event_id: Optional[str] = Header(None)):
+    """Server-sent event stream of every update to a comma-separated list of routes.
+
+    Resume with the last event id as Last-Event-ID or since (per-route seqs); since_mjd is
+    accepted from older clients.
+    """
     if key == RELAY_KEY:
-        dd2 = {"read_mjd": time.Time.now().mjd}
-        dd2.update(dd["dsa"])
-        return dd2
+        instruments = [route for route in routes.split(',') if route]
+        unknown = [instrument for instrument in instruments if instrument not in dd]
+        if unknown or not instruments:
+            return f"Unknown routes: {unknown}"
+        cursor = _parse_cursor(last_event_id or since)
+        return StreamingResponse(_stream_events(request, instruments, since_mjd, cursor),
+                                 media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache"})
     else:
         return "Bad key"
 
 
-@app.put("/dsa")
-def set_dsa(command: relay_db.Command, key: str):
+@app.get("/commands")
+async def get_commands(key: str, routes: str, if_none_match: Optional[str] = Header(None)):
+    """Current state of a comma-separated list of routes, read at one instant."""
     if key == RELAY_KEY:
-        dd['dsa'] = {"command": command.command, "command_mjd": command.command_mjd,
-                     "args": command.args}
-
-        if command.command == 'observation':
-            relay_db.set_command(command)
-            if cl is not None:
-                if "trigname" in command.args:
-                    message = f'DSA-110 event {command.args["trigname"]} received'
-                else:
-                    message = f'DSA-110 event received'
-                res = cl.chat_postMessage(channel='#alert-driven-astro', text=message)
-
-        return f"Set dsa command: {command.command} with {command.args}"
+        instruments = [route for route in routes.split(',') if route]
+        unknown = [instrument for instrument in instruments if instrument not in dd]
+        if unknown or not instruments:
+            return f"Unknown routes: {unknown}"
+        await _refresh()
+        cached = [_cache[instrument] for instrument in instruments]
+        etag = 'W/"' + '+'.join(tag[3:-1] for tag, _ in cached) + '"'
+        body = b'{' + b','.join(_dumps(instrument) + b':' + state
+                                for instrument, (_, state) in zip(instruments, cached)) + b'}'
+        return _json_response(etag, body, if_none_match)
     else:
         return "Bad key"
 
 
-@app.get("/ligo")
-def get_ligo(key):
+@app.get("/{instrument}/events")
+async def get_events(instrument: str, key: str, after: int = 0, after_mjd: Optional[float] = None, limit: int = 100):
+    """Commands for instrument with seq > after, oldest first.
+
+    Served from the in-memory ring buffer. If the cursor is older than the buffer (or from before
+    a relay restart), persisted commands newer than after_mjd are read from relay_db first; those
+    have seq None. gap is True when events may be missing from the response.
+    """
     if key == RELAY_KEY:
-        dd2 = {"read_mjd": time.Time.now().mjd}
-        dd2.update(dd["ligo"])
-        return dd2
+        if instrument not in dd:
+            return f"Unknown route: {instrument}"
+        await _refresh()
+        with _lock:
+            buffered = list(_events[instrument])
+            last_seq = _seq[instrument]
+
+        restarted = after > last_seq
+        if restarted:
+            after = 0
+        events = [event for event in buffered if event["seq"] > after]
+        oldest = buffered[0]["seq"] if buffered else last_seq + 1
+        gap = restarted or after + 1 < oldest
+        if gap and after_mjd is not None:
+            before_mjd = buffered[0]["command_mjd"] if buffered else None
+            older = [{"seq": None, "command": command.command, "command_mjd": command.command_mjd,
+                      "args": command.args}
+                     for command in await _read_db(relay_db.get_commands_since, instrument, after_mjd,
+                                                   before_mjd, limit)]
+            events = older + events
+            gap = len(older) == limit
+
+        return {"instrument": instrument, "last_seq": last_seq, "gap": gap, "events": events[:limit]}
     else:
         return "Bad key"
 
 
-@app.put("/ligo")
-def set_ligo(command: relay_db.Command, key: str):
-    if key == RELAY_KEY:
-        dd["ligo"] = {"command": command.command, "command_mjd": command.command_mjd,
-                      "args": command.args}
+def _state_metrics():
+    """Gauges for /metrics: age of each instrument's current command and its seq."""
+    now_mjd = timeutil.now_mjd()
+    lines = ['# HELP relay_state_age_seconds Time since the current command_mjd of each instrument',
+             '# TYPE relay_state_age_seconds gauge']
+    seqs = ['# TYPE relay_state_seq gauge']
+    for instrument, state in list(dd.items()):
+        if state["command_mjd"] is not None:
+            lines.append(f'relay_state_age_seconds{{instrument="{instrument}"}} '
+                         f'{(now_mjd - state["command_mjd"]) * 86400:.3f}')
+        seqs.append(f'relay_state_seq{{instrument="{instrument}"}} {_seq.get(instrument, 0)}')
+    return lines + seqs
 
-        if command.command == 'observation':
-            relay_db.set_command(command)
 
-            if cl is not None:
-                if "GraceID" in command.args:
-                    message = f'LIGO event {command.args["GraceID"]} received'  # more verbose logging by receiver script
-                else:
-                    message = f'LIGO event received'
-                res = cl.chat_postMessage(channel='#alert-driven-astro', text=message)
+metrics.REGISTRY.add_collector(_state_metrics)
+
 
-        return f"Set LIGO event: {command.command} with {command.args}"
+@app.get("/metrics")
+async def get_metrics(key: str):
+    """Request, relay_db and Slack timings plus state age, in the Prometheus text format."""
+    if key == RELAY_KEY:
+        return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
     else:
         return "Bad key"
 
 
-@app.get("/chime")
-def get_chime(key):
+@app.put("/traces")
+async def set_trace_marks(marks: relay_db.TraceMarks, key: str):
+    """Add latency marks reported by a component downstream of the relay (AlertClient.report_trace)."""
     if key == RELAY_KEY:
-        dd2 = {"read_mjd": time.Time.now().mjd}
-        dd2.update(dd["chime"])
-        return dd2
+        relay_db.add_trace_marks(marks.id, marks.marks)
+        return f"Added {len(marks.marks)} marks to trace {marks.id}"
     else:
         return "Bad key"
 
 
-@app.put("/chime")
-def set_chime(command: relay_db.Command, key: str):
+@app.get("/traces")
+async def get_traces(key: str, limit: int = 20):
+    """Most recent traces with their end-to-end latency, newest first."""
     if key == RELAY_KEY:
-        dd['chime'] = {"command": command.command, "command_mjd": command.command_mjd,
-                       "args": command.args}
-
-        if command.command == 'observation':
-            relay_db.set_command(command)
+        rows = await _read_db(relay_db.get_traces, max(1, min(limit, MAX_HISTORY_PAGE)))
+        return [{"id": trace_id, "start": start, "total_ms": round((end - start) * 1e3, 3), "marks": count}
+                for trace_id, start, end, count in rows]
+    else:
+        return "Bad key"
 
-            if cl is not None:
-                if "event_no" in command.args:
-                    message = f'CHIME/FRB event {command.args["event_no"]} received'  # more detail may be posted by reader client
-                else:
-                    message = f'CHIME/FRB event received: {command.args}'
-                res = cl.chat_postMessage(channel='#alert-driven-astro', text=message)
 
-        return f"Set CHIME event: {command.command} with {command.args}"
+@app.get("/traces/{trace_id}")
+async def get_trace(trace_id: str, key: str):
+    """Per-hop latency breakdown of one trace."""
+    if key == RELAY_KEY:
+        marks = await _read_db(relay_db.get_trace, trace_id)
+        if not marks:
+            return f"Unknown trace: {trace_id}"
+        result = {"id": trace_id}
+        result.update(trace.breakdown(marks))
+        return result
     else:
         return "Bad key"
 
 
-@app.get("/casm")
-def get_casm(key):
+@app.get("/instruments")
+async def get_instruments(key: str):
+    """Registered instruments and their persistence/Slack policies."""
     if key == RELAY_KEY:
-        dd2 = {"read_mjd": time.Time.now().mjd}
-        dd2.update(dd["casm"])
-        return dd2
+        return list(instruments.values())
     else:
         return "Bad key"
 
 
-@app.put("/casm")
-def set_casm(command: relay_db.Command, key: str):
+@app.put("/instruments")
+async def set_instrument_policy(instrument: Instrument, key: str):
+    """Register a new instrument route or change the policy of an existing one, without a restart."""
     if key == RELAY_KEY:
-        dd['casm'] = {"command": command.command, "command_mjd": command.command_mjd,
-                      "args": command.args}
-
-        if command.command == 'observation':
-            relay_db.set_command(command)
+        bad = _bad_name(instrument.name)
+        if bad is not None:
+            return bad
+        if instrument.persist not in PERSIST_POLICIES:
+            return f"Bad persist policy: {instrument.persist}"
+        for template in (instrument.slack_message, instrument.slack_fallback):
+            bad = _bad_template(template) if template is not None else None
+            if bad is not None:
+                return bad
+        with _lock:
+            new = instrument.name not in instruments
+            _register(instrument)
+        logger.info(f"{'Registered' if new else 'Updated'} instrument {instrument.name}")
+        return f"{'Registered' if new else 'Updated'} instrument {instrument.name}"
+    else:
+        return "Bad key"
 
-            if cl is not None:
-                if "event_no" in command.args:
-                    message = f'CASM event {command.args["event_no"]} received'
-                else:
-                    message = f'CASM event received: {command.args}'
-                res = cl.chat_postMessage(channel='#alert-driven-astro', text=message)
 
-        return f"Set CASM event: {command.command} with {command.args}"
+@app.get("/{instrument}")
+async def get_instrument(instrument: str, key: str, since_mjd: Optional[float] = None, wait: float = 0,
+                         if_none_match: Optional[str] = Header(None)):
+    if key == RELAY_KEY:
+        if instrument not in instruments:
+            return f"Unknown route: {instrument}"
+        return await _read_state(instrument, since_mjd, wait, if_none_match)
     else:
         return "Bad key"
 
 
-@app.get("/gcn")
-def get_gcn(key):
+@app.put("/bulk")
+async def set_bulk(commands: List[relay_db.Command], key: str, idempotency_key: Optional[str] = Header(None)):
+    """Set a list of commands in order (e.g., a receiver catching up after a reconnect).
+
+    Each command goes to its own instrument route, with that route's policy; persisted commands
+    are inserted in one transaction. Returns one response string per command.
+    """
     if key == RELAY_KEY:
-        dd2 = {"read_mjd": time.Time.now().mjd}
-        dd2.update(dd["gcn"])
-        return dd2
+        if len(commands) > MAX_BULK:
+            return f"Too many commands: {len(commands)} > {MAX_BULK}"
+        token = ("bulk", idempotency_key or _content_key(*commands))
+        return await _once(token, lambda: _set_bulk(commands))
     else:
         return "Bad key"
 
 
-@app.put("/gcn")
-def set_gcn(command: relay_db.Command, key: str):
-    if key == RELAY_KEY:
-        dd['gcn'] = {"command": command.command, "command_mjd": command.command_mjd,
-                       "args": command.args}
+async def _set_bulk(commands):
+    responses, accepted = [], []
+    for command in commands:
+        policy, bad = _policy_for(command.instrument)
+        if bad is not None:
+            responses.append(bad)
+            continue
+        trace.mark(command.args, 'relay_api', 'received')
+        accepted.append((policy, command))
+        responses.append(_response(policy, command))
 
-        if command.command == 'observation':
-            relay_db.set_command(command)
+    await _update_many([(policy.name, command) for policy, command in accepted])
+    relay_db.set_commands([command for policy, command in accepted if _persists(policy, command)])
+    for policy, command in accepted:
+        _record_trace(command, _persists(policy, command))
+        _announce(policy, command)
+    return responses
 
-            if cl is not None:
-                message = f'GCN event with args: {command.args}'  # TODO: parse this for clarity
-                res = cl.chat_postMessage(channel='#alert-driven-astro', text=message)
 
-        return f"Set GCN event: {command.command} with {command.args}"
+def _policy_for(instrument):
+    """Return (registry entry, None), registering instrument with default policy if new, or (None, error)."""
+    policy = instruments.get(instrument)
+    if policy is None:
+        bad = _bad_name(instrument)
+        if bad is not None:
+            return None, bad
+        with _lock:
+            policy = _register(Instrument(name=instrument))
+        logger.info(f"Registered new instrument {instrument} with default policy")
+    return policy, None
+
+
+def _persists(policy, command):
+    return policy.persist == "all" or (policy.persist == "observation" and command.command == 'observation')
+
+
+def _record_trace(command, persisted):
+    """Store the marks of a traced command (plus a persisted mark if it was written to relay_db)."""
+    ctx = trace.get(command.args)
+    if ctx is not None:
+        try:
+            relay_db.add_trace_marks(ctx['id'], ctx['marks'], persisted=persisted)
+        except (TypeError, ValueError):
+            logger.warning(f"Ignoring malformed trace in {command.instrument} command")
+
+
+def _announce(policy, command):
+    if command.command == 'observation' and policy.slack_channel is not None and cl is not None:
+        slack.post(policy.slack_channel, _slack_message(policy, command))
+
+
+def _response(policy, command):
+    return f"{policy.response or f'Set {policy.name} event'}: {command.command} with {command.args}"
+
+
+@app.put("/{instrument}")
+@_idempotent
+async def set_instrument(instrument: str, command: relay_db.Command, key: str,
+                         idempotency_key: Optional[str] = Header(None)):
+    """Set the current command for instrument, registering it with default policy if new."""
+    if key == RELAY_KEY:
+        policy, bad = _policy_for(instrument)
+        if bad is not None:
+            return bad
+
+        trace.mark(command.args, 'relay_api', 'received')
+        await _update(instrument, command)
+        persist = _persists(policy, command)
+        if persist:
+            relay_db.set_command(command)
+        _record_trace(command, persist)
+        _announce(policy, command)
+        return _response(policy, command)
     else:
         return "Bad key"
@@ -0,0 +1,182 @@
+"""Archive old relay commands out of SQLite into monthly compressed partitions.
+
+Rows older than a retention window are moved into ``commands-YYYY-MM.npz`` files (one per
+calendar month of command_mjd) and deleted from the hot ``commands`` table, so the live
+database stays small. ``query_commands`` reads hot rows plus only the partitions whose month
+overlaps the requested range.
+
+The same job deletes latency trace marks older than ``--trace-days`` (see relay_db.prune_traces).
+Run it periodically on the relay host::
+
+    python -m ovro_alert.relay_archive --days 90 --trace-days 30
+"""
+import argparse
+import datetime
+import logging
+import os
+import re
+import sys
+
+import numpy as np
+
+from ovro_alert import relay_db
+
+logger = logging.getLogger(__name__)
+
+MJD_EPOCH = datetime.datetime(1858, 11, 17)
+COLUMNS = ('id', 'instrument', 'command', 'command_mjd', 'args')
+_PARTITION = re.compile(r'^commands-(\d{4})-(\d{2})\.npz$')
+
+
+def default_archive_dir():
+    """Archive directory next to relay_db.DBPATH."""
+    return os.path.join(os.path.dirname(os.path.abspath(relay_db.DBPATH)), 'archive')
+
+
+def _mjd(dt):
+    return (dt - MJD_EPOCH).total_seconds() / 86400
+
+
+def _month_start(mjd):
+    dt = MJD_EPOCH + datetime.timedelta(days=mjd)
+    return datetime.datetime(dt.year, dt.month, 1)
+
+
+def _next_month(dt):
+    return datetime.datetime(dt.year + dt.month // 12, dt.month % 12 + 1, 1)
+
+
+def _partition_path(archive_dir, month):
+    return os.path.join(archive_dir, f'commands-{month.year:04d}-{month.month:02d}.npz')
+
+
+def _to_arrays(rows):
+    ids, instruments, commands, mjds, args = zip(*rows) if rows else ((), (), (), (), ())
+    return {'id': np.array(ids, dtype=np.int64),
+            'instrument': np.array(instruments, dtype=str),
+            'command': np.array(commands, dtype=str),
+            'command_mjd': np.array(mjds, dtype=np.float64),
+            'args': np.array(args, dtype=str)}
+
+
+def _load(path):
+    with np.load(path, allow_pickle=False) as npz:
+        return {name: npz[name] for name in COLUMNS}
+
+
+def _key(row):
+    """Identity of an archived row. Databases from before relay_db schema 3 could reuse the id of
+    a deleted row, so the id alone does not identify it.
+    """
+    row_id, instrument, _, command_mjd, _ = row
+    return (int(row_id), str(instrument), float(command_mjd))
+
+
+def _write_partition(path, rows):
+    """Merge rows into the partition at path (deduplicating by _key) and replace it atomically."""
+    arrays = _to_arrays(rows)
+    if os.path.exists(path):
+        old = _load(path)
+        new_keys = {_key(row) for row in rows}
+        keep = np.ones(len(old['id']), dtype=bool)
+        for i in np.flatnonzero(np.isin(old['id'], arrays['id'])):
+            keep[i] = _key(tuple(old[name][i] for name in COLUMNS)) not in new_keys
+        arrays = {name: np.concatenate([old[name][keep], arrays[name]]) for name in COLUMNS}
+    order = np.lexsort((arrays['id'], arrays['command_mjd']))
+    tmp = path + '.tmp.npz'
+    np.savez_compressed(tmp, **{name: arrays[name][order] for name in COLUMNS})
+    os.replace(tmp, path)
+
+
+def archive_commands(older_than_days=90, archive_dir=None, now_mjd=None, vacuum=False):
+    """Move commands older than older_than_days into monthly partitions. Returns rows moved.
+
+    Works one month at a time, so memory is bounded by a month of rows. Each month's partition is
+    written before its rows are deleted; if the job dies in between, rows exist in both tiers and
+    are deduplicated (by id, instrument and command_mjd) on the next run and in query_commands. Freed pages are reused by new
+    inserts; vacuum=True also shrinks the database file.
+    """
+    archive_dir = archive_dir or default_archive_dir()
+    os.makedirs(archive_dir, exist_ok=True)
+    if now_mjd is None:
+        now_mjd = _mjd(datetime.datetime.utcnow())
+    cutoff = now_mjd - older_than_days
+
+    relay_db.flush()
+    oldest = relay_db.manager().reader().execute('SELECT MIN(command_mjd) FROM commands').fetchone()[0]
+    if oldest is None or oldest >= cutoff:
+        return 0
+
+    moved = 0
+    month = _month_start(oldest)
+    while _mjd(month) < cutoff:
+        start, end = _mjd(month), min(_mjd(_next_month(month)), cutoff)
+        rows = relay_db.get_range(from_mjd=start, to_mjd=end)
+        if rows:
+            _write_partition(_partition_path(archive_dir, month), rows)
+            relay_db.manager().write('DELETE FROM commands WHERE command_mjd >= ? AND command_mjd < ?',
+                                     (start, end)).wait()
+            moved += len(rows)
+            logger.info(f"Archived {len(rows)} commands for {month:%Y-%m}")
+        month = _next_month(month)
+
+    if vacuum and moved:
+        relay_db.manager().write('VACUUM').wait()
+    return moved
+
+
+def query_commands(instrument=None, from_mjd=None, to_mjd=None, archive_dir=None):
+    """Get commands with from_mjd <= command_mjd < to_mjd from the hot table and the archive.
+
+    Only partitions whose month overlaps the range are opened. Returns rows
+    (id, instrument, command, command_mjd, args JSON text), oldest first.
+    """
+    archive_dir = archive_dir or default_archive_dir()
+    rows = {_key(row): row for row in relay_db.get_range(instrument, from_mjd, to_mjd)}
+
+    names = sorted(os.listdir(archive_dir)) if os.path.isdir(archive_dir) else []
+    for name in names:
+        match = _PARTITION.match(name)
+        if match is None:
+            continue
+        month = datetime.datetime(int(match.group(1)), int(match.group(2)), 1)
+        if (to_mjd is not None and _mjd(month) >= to_mjd) or (from_mjd is not None and _mjd(_next_month(month)) <= from_mjd):
+            continue
+
+        part = _load(os.path.join(archive_dir, name))
+        mask = np.ones(len(part['id']), dtype=bool)
+        if instrument:
+            mask &= part['instrument'] == instrument
+        if from_mjd is not None:
+            mask &= part['command_mjd'] >= from_mjd
+        if to_mjd is not None:
+            mask &= part['command_mjd'] < to_mjd
+        for i in np.flatnonzero(mask):
+            row = (int(part['id'][i]), str(part['instrument'][i]), str(part['command'][i]),
+                   float(part['command_mjd'][i]), str(part['args'][i]))
+            rows.setdefault(_key(row), row)
+
+    return sorted(rows.values(), key=lambda row: (row[3], row[0]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Move old relay commands into monthly archive partitions.')
+    parser.add_argument('--days', type=float, default=90, help='keep this many days in the hot table')
+    parser.add_argument('--db', default=relay_db.DBPATH, help='relay database path')
+    parser.add_argument('--archive-dir', default=None, help='partition directory (default: archive/ next to db)')
+    parser.add_argument('--vacuum', action='store_true', help='shrink the database file afterwards')
+    parser.add_argument('--trace-days', type=float, default=relay_db.TRACE_RETENTION_DAYS,
+                        help='delete latency trace marks older than this many days')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+    relay_db.DBPATH = args.db
+    relay_db.create_db()
+    relay_db.prune_traces(args.trace_days).wait()
+    moved = archive_commands(args.days, args.archive_dir, vacuum=args.vacuum)
+    relay_db.close()
+    print(f'Archived {moved} commands')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,30 @@
+from typing import List, Tuple
+
 from pydantic import BaseModel
+import ast
+import json
+import queue
 import sqlite3
 import logging
+import threading
+import time
+
+from ovro_alert.metrics import REGISTRY
 
 logger = logging.getLogger(__name__)
 
+
+def _timed(op):
+    return REGISTRY.timed('relay_db_seconds', 'relay_db call duration', op=op)
+
+
 DBPATH = '/home/claw/code/relay.db'
+# PRAGMA user_version. 0: args stored as str(dict). 1: args as JSON, (instrument, command_mjd) index.
+# 2: command_mjd index for history pages across all instruments.
+# 3: AUTOINCREMENT ids, so ids of rows moved out by relay_archive are never reused.
+SCHEMA_VERSION = 3
+MIGRATION_CHUNK = 5000
+TRACE_RETENTION_DAYS = 30
 
 class Command(BaseModel):
     instrument: str
@@ -12,67 +32,482 @@ class Command(BaseModel):
     command_mjd: float
     args: dict
 
+
+class TraceMarks(BaseModel):
+    """Marks ([component, stage, unix time]) reported for one trace (see ovro_alert.trace)."""
+    id: str
+    marks: List[Tuple[str, str, float]]
+
+def connect(path):
+    """Open a connection to the SQLite file at path in WAL mode (relay_db and relay_state files)."""
+    conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
 def connection_factory():
     """Create a connection to the database."""
-    return sqlite3.connect(DBPATH)
+    return connect(DBPATH)
+
+
+class _PendingWrite():
+    """Handle for a queued write; wait() blocks until it is committed and re-raises any error."""
+
+    def __init__(self):
+        self._done = threading.Event()
+        self.error = None
+
+    def wait(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise TimeoutError('relay_db write not committed in time')
+        if self.error is not None:
+            raise self.error
+
+
+class ConnectionManager():
+    """Persistent connections to one SQLite file in WAL mode.
+
+    Each thread gets its own read connection, reused across calls. All writes go through a
+    single writer thread that commits queued statements in groups (up to batch_size per
+    transaction), so request handlers never wait on a commit.
+    """
+
+    def __init__(self, path, batch_size=100):
+        self.path = path
+        self.batch_size = batch_size
+        self._local = threading.local()
+        self._readers = []
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name='relay-db-writer', daemon=True)
+        self._writer.start()
+
+    def reader(self):
+        """Return this thread's read connection."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = connect(self.path)
+            self._local.conn = conn
+            with self._lock:
+                self._readers.append(conn)
+        return conn
+
+    def write(self, sql, params=()):
+        """Queue one statement for the writer thread. Returns a _PendingWrite."""
+        pending = _PendingWrite()
+        self._queue.put(('execute', sql, params, pending))
+        return pending
+
+    def write_many(self, sql, seq_of_params):
+        """Queue one statement run for each params in seq_of_params, committed together."""
+        pending = _PendingWrite()
+        self._queue.put(('executemany', sql, list(seq_of_params), pending))
+        return pending
+
+    def flush(self, timeout=10):
+        """Block until everything queued so far is committed."""
+        self.write('SELECT 1').wait(timeout)
+
+    def close(self):
+        """Commit queued writes, stop the writer and close all connections."""
+        self._queue.put(None)
+        self._writer.join(timeout=10)
+        with self._lock:
+            for conn in self._readers:
+                conn.close()
+            self._readers = []
+
+    def _write_loop(self):
+        conn = connect(self.path)
+        running = True
+        while running:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                running = False
+                batch = [op for op in batch if op is not None]
+
+            t0 = time.perf_counter()
+            try:
+                with conn:
+                    for method, sql, params, _ in batch:
+                        getattr(conn, method)(sql, params)
+            except sqlite3.Error:
+                # Retry one at a time so one bad statement does not drop the whole group.
+                for method, sql, params, pending in batch:
+                    try:
+                        with conn:
+                            getattr(conn, method)(sql, params)
+                    except sqlite3.Error as e:
+                        logger.error(f"relay_db write failed: {e} ({sql})")
+                        pending.error = e
+            REGISTRY.observe('relay_db_seconds', time.perf_counter() - t0, 'relay_db call duration', op='commit')
+            for _, _, _, pending in batch:
+                pending._done.set()
+        conn.close()
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def manager():
+    """Return the ConnectionManager for the current DBPATH, creating it on first use."""
+    global _manager
+    with _manager_lock:
+        if _manager is None or _manager.path != DBPATH:
+            if _manager is not None:
+                _manager.close()
+            _manager = ConnectionManager(DBPATH)
+        return _manager
+
+
+def flush():
+    """Block until queued writes are committed."""
+    manager().flush()
+
+
+def close():
+    """Commit queued writes and close connections (e.g. at relay shutdown)."""
+    global _manager
+    with _manager_lock:
+        if _manager is not None:
+            _manager.close()
+            _manager = None
 
 
 def create_db():
-    """Create database if it doesn't exist."""
-    with connection_factory() as conn:
+    """Create database if it doesn't exist and migrate it to SCHEMA_VERSION."""
+    conn = connection_factory()
+    with conn:
         c = conn.cursor()
         c.executescript('''
             CREATE TABLE IF NOT EXISTS commands
-            (id INTEGER PRIMARY KEY,
+            (id INTEGER PRIMARY KEY AUTOINCREMENT,
                 instrument TEXT,
                 command TEXT,
                 command_mjd REAL,
                 args TEXT);
+            CREATE TABLE IF NOT EXISTS traces
+            (trace_id TEXT NOT NULL,
+                component TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                ts REAL NOT NULL,
+                PRIMARY KEY (trace_id, component, stage));
+            CREATE INDEX IF NOT EXISTS idx_traces_ts ON traces (ts);
             ''')
+    migrate(conn)
+    conn.close()
+
+
+def _args_to_json(args: str):
+    """Convert a stored args value (JSON or a Python dict repr) to JSON text."""
+    try:
+        json.loads(args)
+        return args
+    except (TypeError, ValueError):
+        pass
+    try:
+        return json.dumps(ast.literal_eval(args))
+    except (ValueError, SyntaxError, TypeError):
+        logger.warning(f"Could not parse stored args; keeping as raw text: {args!r}")
+        return json.dumps({"raw": args})
+
+
+def migrate(conn):
+    """Upgrade the commands table in place to SCHEMA_VERSION.
+
+    Version 0 -> 1 rewrites args to JSON in chunks of MIGRATION_CHUNK rows (each chunk is its
+    own transaction, so an interrupted migration resumes where it stopped) and adds the
+    (instrument, command_mjd) index. Version 1 -> 2 adds the command_mjd index. Version 2 -> 3
+    copies the table into one with AUTOINCREMENT ids, also in chunks (resuming from the last id
+    copied), then swaps the tables in one transaction.
+    """
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        return
+
+    if version < 1:
+        last_id, converted = 0, 0
+        while True:
+            rows = conn.execute('SELECT id, args FROM commands WHERE id > ? ORDER BY id LIMIT ?',
+                                (last_id, MIGRATION_CHUNK)).fetchall()
+            if not rows:
+                break
+            updates = [(_args_to_json(args), row_id) for row_id, args in rows]
+            with conn:
+                conn.executemany('UPDATE commands SET args = ? WHERE id = ?', updates)
+            last_id = rows[-1][0]
+            converted += len(rows)
+        with conn:
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_commands_instrument_mjd ON commands (instrument, command_mjd)')
+        logger.info(f"Migrated {converted} commands to JSON args")
+
+    if version < 2:
+        with conn:
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_commands_mjd ON commands (command_mjd)')
+
+    if version < 3:
+        sql = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'commands'").fetchone()[0]
+        if 'AUTOINCREMENT' not in sql.upper():
+            with conn:
+                conn.execute('CREATE TABLE IF NOT EXISTS commands_v3 (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                             'instrument TEXT, command TEXT, command_mjd REAL, args TEXT)')
+            last_id = conn.execute('SELECT coalesce(MAX(id), 0) FROM commands_v3').fetchone()[0]
+            while True:
+                with conn:
+                    copied = conn.execute('INSERT INTO commands_v3 (id, instrument, command, command_mjd, args) '
+                                          'SELECT id, instrument, command, command_mjd, args FROM commands '
+                                          'WHERE id > ? ORDER BY id LIMIT ?', (last_id, MIGRATION_CHUNK)).rowcount
+                if copied == 0:
+                    break
+                last_id = conn.execute('SELECT MAX(id) FROM commands_v3').fetchone()[0]
+            with conn:
+                conn.execute('DROP TABLE commands')
+                conn.execute('ALTER TABLE commands_v3 RENAME TO commands')
+                conn.execute('CREATE INDEX idx_commands_instrument_mjd ON commands (instrument, command_mjd)')
+                conn.execute('CREATE INDEX idx_commands_mjd ON commands (command_mjd)')
+            logger.info("Migrated commands table to AUTOINCREMENT ids")
+
+    with conn:
+        conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
 
 
 def reset_table(table='commands'):
     """Reset the sessions table."""
-    with connection_factory() as conn:
+    flush()
+    conn = connection_factory()
+    with conn:
         c = conn.cursor()
         c.execute(f"DROP TABLE IF EXISTS {table}")
-        conn.commit()
-        create_db()
+        c.execute('PRAGMA user_version = 0')  # recreate indexes too
+    conn.close()
+    create_db()
+
+
+def _row_to_command(row):
+    instrument, command, command_mjd, args = row
+    return Command(instrument=instrument, command=command, command_mjd=command_mjd, args=json.loads(args))
+
+
+@_timed('get_latest')
+def get_latest(instrument: str):
+    """Get the most recent command for an instrument (indexed lookup)."""
+    c = manager().reader().cursor()
+    c.execute('SELECT instrument, command, command_mjd, args FROM commands WHERE instrument = ? '
+              'ORDER BY command_mjd DESC, id DESC LIMIT 1', (instrument,))
+    row = c.fetchone()
+    return _row_to_command(row) if row is not None else None
+
+
+@_timed('get_instruments')
+def get_instruments():
+    """Distinct instruments with persisted commands (index skip-scan, one seek per instrument)."""
+    c = manager().reader().cursor()
+    c.execute('WITH RECURSIVE t(instrument) AS ('
+              'SELECT MIN(instrument) FROM commands UNION ALL '
+              'SELECT (SELECT MIN(instrument) FROM commands WHERE instrument > t.instrument) '
+              'FROM t WHERE t.instrument IS NOT NULL) '
+              'SELECT instrument FROM t WHERE instrument IS NOT NULL')
+    return [row[0] for row in c.fetchall()]
 
 
 def get_command(instrument: str):
     """Get the current command for an instrument."""
-    with connection_factory() as conn:
-        c = conn.cursor()
-        c.execute('SELECT instrument, command, command_mjd, args FROM commands WHERE instrument = ?', (instrument,))
-        row = c.fetchone()
-        if row is None:
-            return None
-        instrument, command, command_mjd, args = row
-        return Command(instrument=instrument, command=command, command_mjd=command_mjd, args=eval(args))
+    return get_latest(instrument)
 
 
-def set_command(command: Command):
-    """Set the current command for an instrument."""
-    with connection_factory() as conn:
-        c = conn.cursor()
-        c.execute('INSERT INTO commands (instrument, command, command_mjd, args) VALUES (?, ?, ?, ?)',
-                  (command.instrument, command.command, command.command_mjd, str(command.args)))
-        conn.commit()
-        logger.info(f"Set {command.instrument} command: {command.command} with {command.args}")
-        return f"Set {command.instrument} command: {command.command} with {command.args}"
+def set_command(command: Command, wait: bool = False):
+    """Set the current command for an instrument.
+
+    The insert is queued for the writer thread; wait=True blocks until it is committed.
+    """
+    pending = manager().write('INSERT INTO commands (instrument, command, command_mjd, args) VALUES (?, ?, ?, ?)',
+                              (command.instrument, command.command, command.command_mjd, json.dumps(command.args)))
+    if wait:
+        pending.wait()
+    logger.info(f"Set {command.instrument} command: {command.command} with {command.args}")
+    return f"Set {command.instrument} command: {command.command} with {command.args}"
+
+
+def set_commands(commands, wait: bool = False):
+    """Persist a list of commands in one transaction, in order.
+
+    Like set_command, the insert is queued for the writer thread; wait=True blocks until committed.
+    """
+    pending = manager().write_many('INSERT INTO commands (instrument, command, command_mjd, args) VALUES (?, ?, ?, ?)',
+                                   [(command.instrument, command.command, command.command_mjd, json.dumps(command.args))
+                                    for command in commands])
+    if wait:
+        pending.wait()
+    logger.info(f"Set {len(commands)} commands")
+    return f"Set {len(commands)} commands"
+
+
+def add_trace_marks(trace_id: str, marks, persisted: bool = False):
+    """Queue trace marks for insert; a mark already stored for (component, stage) is kept.
+
+    With persisted=True, a ("relay_api", "persisted") mark is added with the time the writer
+    commits it, so call it after set_command for the traced command. julianday('now') has only
+    millisecond resolution, so the mark is kept no earlier than the trace's latest mark.
+    """
+    rows = [(trace_id, component, stage, ts) for component, stage, ts in marks]
+    pending = manager().write_many('INSERT OR IGNORE INTO traces (trace_id, component, stage, ts) '
+                                   'VALUES (?, ?, ?, ?)', rows)
+    if persisted:
+        pending = manager().write("INSERT OR IGNORE INTO traces (trace_id, component, stage, ts) "
+                                  "SELECT ?, 'relay_api', 'persisted', max((julianday('now') - 2440587.5) * 86400.0, "
+                                  "coalesce((SELECT MAX(ts) FROM traces WHERE trace_id = ?), 0))",
+                                  (trace_id, trace_id))
+    return pending
+
+
+@_timed('get_trace')
+def get_trace(trace_id: str):
+    """Marks [component, stage, ts] stored for trace_id, oldest first."""
+    c = manager().reader().cursor()
+    c.execute('SELECT component, stage, ts FROM traces WHERE trace_id = ? ORDER BY ts, rowid', (trace_id,))
+    return [list(row) for row in c.fetchall()]
+
+
+@_timed('get_traces')
+def get_traces(limit: int = 20):
+    """Most recent traces as (trace_id, first ts, last ts, mark count), newest first.
+
+    Walks the ts index from the newest mark until limit traces are found, then summarizes only
+    those by primary key, instead of grouping the whole table.
+    """
+    c = manager().reader().cursor()
+    recent = {}
+    for (trace_id,) in c.execute('SELECT trace_id FROM traces ORDER BY ts DESC'):
+        recent.setdefault(trace_id, len(recent))
+        if len(recent) >= limit:
+            break
+    c.close()  # release the read snapshot of the unfinished scan
+    if not recent:
+        return []
+    rows = manager().reader().execute(
+        f'SELECT trace_id, MIN(ts), MAX(ts), COUNT(*) FROM traces WHERE trace_id IN '
+        f'({",".join("?" * len(recent))}) GROUP BY trace_id', list(recent)).fetchall()
+    return sorted(rows, key=lambda row: recent[row[0]])
+
+
+def prune_traces(older_than_days: float = TRACE_RETENTION_DAYS, now: float = None):
+    """Queue deleting trace marks older than older_than_days (unix time now). Returns a _PendingWrite."""
+    cutoff = (time.time() if now is None else now) - older_than_days * 86400
+    return manager().write('DELETE FROM traces WHERE ts < ?', (cutoff,))
+
 
+@_timed('get_commands_since')
+def get_commands_since(instrument: str, after_mjd: float, before_mjd: float = None, limit: int = 100):
+    """Get persisted commands for an instrument with after_mjd < command_mjd < before_mjd, oldest first."""
 
+    query = 'SELECT instrument, command, command_mjd, args FROM commands WHERE instrument = ? AND command_mjd > ?'
+    params = [instrument, after_mjd]
+    if before_mjd is not None:
+        query += ' AND command_mjd < ?'
+        params.append(before_mjd)
+    query += ' ORDER BY command_mjd LIMIT ?'
+    params.append(limit)
+
+    commands = []
+    c = manager().reader().cursor()
+    c.execute(query, params)
+    for row in c.fetchall():
+        commands.append(_row_to_command(row))
+
+    return commands
+
+
+@_timed('get_commands')
 def get_commands():
     """Get the current commands for all instruments."""
 
     commands = []
-    with connection_factory() as conn:
-        c = conn.cursor()
-        c.execute('SELECT instrument, command, command_mjd, args FROM commands')
-        rows = c.fetchall()
-        for row in rows:
-            instrument, command, command_mjd, args = row
-            commands.append(Command(instrument=instrument, command=command, command_mjd=command_mjd, args=eval(args)))
+    c = manager().reader().cursor()
+    c.execute('SELECT instrument, command, command_mjd, args FROM commands')
+    rows = c.fetchall()
+    for row in rows:
+        commands.append(_row_to_command(row))
 
     return commands
+
+
+@_timed('get_history')
+def get_history(instrument: str = None, from_mjd: float = None, to_mjd: float = None, limit: int = 100,
+                cursor: str = None):
+    """Get one page of commands, newest first, with from_mjd <= command_mjd < to_mjd.
+
+    Keyset pagination: cursor is the next_cursor of the previous page, so each page is an
+    index range scan no matter how deep it is. Returns (rows, next_cursor), where rows are
+    (id, instrument, command, command_mjd, args JSON text) and next_cursor is None on the last page.
+    Raises ValueError for a malformed cursor.
+    """
+
+    where, params = [], []
+    if instrument:
+        where.append('instrument = ?')
+        params.append(instrument)
+    if from_mjd is not None:
+        where.append('command_mjd >= ?')
+        params.append(from_mjd)
+    if to_mjd is not None:
+        where.append('command_mjd < ?')
+        params.append(to_mjd)
+    if cursor:
+        cursor_mjd, _, cursor_id = cursor.partition(':')
+        where.append('(command_mjd, id) < (?, ?)')
+        params.extend([float(cursor_mjd), int(cursor_id)])
+
+    query = 'SELECT id, instrument, command, command_mjd, args FROM commands'
+    if where:
+        query += ' WHERE ' + ' AND '.join(where)
+    query += ' ORDER BY command_mjd DESC, id DESC LIMIT ?'
+    params.append(limit + 1)
+
+    c = manager().reader().cursor()
+    c.execute(query, params)
+    rows = c.fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = f'{rows[-1][3]!r}:{rows[-1][0]}'
+    return rows, next_cursor
+
+
+def history_commands(rows):
+    """Commands for the rows of a get_history page, in the same order."""
+    return [_row_to_command(row[1:]) for row in rows]
+
+
+@_timed('get_range')
+def get_range(instrument: str = None, from_mjd: float = None, to_mjd: float = None):
+    """Get all commands with from_mjd <= command_mjd < to_mjd, oldest first.
+
+    Returns rows (id, instrument, command, command_mjd, args JSON text), like get_history.
+    """
+
+    where, params = [], []
+    if instrument:
+        where.append('instrument = ?')
+        params.append(instrument)
+    if from_mjd is not None:
+        where.append('command_mjd >= ?')
+        params.append(from_mjd)
+    if to_mjd is not None:
+        where.append('command_mjd < ?')
+        params.append(to_mjd)
+
+    query = 'SELECT id, instrument, command, command_mjd, args FROM commands'
+    if where:
+        query += ' WHERE ' + ' AND '.join(where)
+    query += ' ORDER BY command_mjd, id'
+
+    c = manager().reader().cursor()
+    c.execute(query, params)
+    return c.fetchall()
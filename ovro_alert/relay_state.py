@@ -0,0 +1,388 @@
+"""Current relay state (latest command and sequence number per instrument), shared by workers.
+
+The relay keeps a per-process copy of this state for serving GETs. A store is the source of
+truth behind that copy:
+
+- ``MemoryStateStore``: a dict in this process. Single-worker relay (the default).
+- ``SQLiteStateStore``: a WAL table any number of processes on the host can open.
+- ``SharedMemoryStateStore``: fixed-size slots in a POSIX shared-memory segment, with an
+  ``flock`` for writers. Fastest cross-process option on one host; states that do not fit
+  spill into a SQLite table.
+
+Every store exposes ``version()``, a cheap token that changes whenever any process sets a
+command. Workers poll it to notice PUTs made elsewhere and wake their long-polls. Shared stores
+also have ``keys``, an ``IdempotencyKeys`` table, so a retried PUT that lands on another worker
+is still applied once (``MemoryStateStore.keys`` is None; the relay keeps them in process).
+
+Choose with environment variables::
+
+    RELAY_STATE=memory|sqlite|shm
+    RELAY_STATE_PATH=/path/to/relay_state.db   (sqlite)
+    RELAY_STATE_NAME=ovro_alert_relay          (shm segment name)
+"""
+import contextlib
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import uuid
+from os import environ
+
+from ovro_alert import relay_db
+
+logger = logging.getLogger(__name__)
+
+
+class _SQLiteFile():
+    """ One WAL connection to path per thread. """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = relay_db.connect(self.path)
+        return conn
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class IdempotencyKeys(_SQLiteFile):
+    """ PUT idempotency keys and their responses in a SQLite table shared by relay workers.
+
+    claim() inserts a key for the worker that handles the PUT; others see it pending until
+    finish() stores the response. A claim left pending for stale seconds (its worker died) can be
+    taken over. Only the newest size keys are kept.
+    """
+
+    def __init__(self, path, size=4096, stale=60.0):
+        super().__init__(path)
+        self.size = size
+        self.stale = stale
+        with self._conn() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS relay_idempotency (token TEXT PRIMARY KEY, "
+                         "claimed REAL NOT NULL, response TEXT)")
+
+    def claim(self, token, now=None):
+        """ Return (True, None) if the caller now owns token, else (False, response or None if pending). """
+        now = time.time() if now is None else now
+        with self._conn() as conn:
+            if conn.execute("INSERT OR IGNORE INTO relay_idempotency (token, claimed) VALUES (?, ?)",
+                            (token, now)).rowcount == 1:
+                conn.execute("DELETE FROM relay_idempotency WHERE rowid <= "
+                             "(SELECT MAX(rowid) FROM relay_idempotency) - ?", (self.size,))
+                return True, None
+            if conn.execute("UPDATE relay_idempotency SET claimed = ? WHERE token = ? AND response IS NULL "
+                            "AND claimed < ?", (now, token, now - self.stale)).rowcount == 1:
+                return True, None
+        return False, self.response(token)
+
+    def response(self, token):
+        """ Stored response for token, or None if it is pending or unknown. """
+        row = self._conn().execute("SELECT response FROM relay_idempotency WHERE token = ?", (token,)).fetchone()
+        return json.loads(row[0]) if row is not None and row[0] is not None else None
+
+    def finish(self, token, response):
+        with self._conn() as conn:
+            conn.execute("UPDATE relay_idempotency SET response = ? WHERE token = ?", (json.dumps(response), token))
+
+    def release(self, token):
+        """ Drop a claim whose PUT failed, so a retry runs it again. """
+        with self._conn() as conn:
+            conn.execute("DELETE FROM relay_idempotency WHERE token = ? AND response IS NULL", (token,))
+
+
+class MemoryStateStore():
+    """ State held in this process only. """
+
+    shared = False
+    keys = None
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex[:8]
+        self._lock = threading.Lock()
+        self._state = {}  # instrument -> (seq, state dict)
+        self._version = 0
+
+    def version(self):
+        return self._version
+
+    def snapshot(self):
+        """ Return {instrument: (seq, state)} for every instrument with a stored state. """
+        with self._lock:
+            return dict(self._state)
+
+    def set(self, instrument, state):
+        """ Store state as the next command for instrument and return its seq. """
+        with self._lock:
+            seq = self._state.get(instrument, (0, None))[0] + 1
+            self._state[instrument] = (seq, state)
+            self._version += 1
+            return seq
+
+    def restore(self, instrument, state):
+        """ Store state with seq 0 unless instrument already has one. Returns True if stored. """
+        with self._lock:
+            if instrument in self._state:
+                return False
+            self._state[instrument] = (0, state)
+            self._version += 1
+            return True
+
+    def close(self):
+        pass
+
+
+class SQLiteStateStore(_SQLiteFile):
+    """ State in a small WAL-mode SQLite table, shared by every process that opens path. """
+
+    shared = True
+
+    def __init__(self, path):
+        super().__init__(path)
+        with self._conn() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS relay_state "
+                         "(instrument TEXT PRIMARY KEY, seq INTEGER NOT NULL, state TEXT NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS relay_state_meta (id TEXT NOT NULL)")
+            conn.execute("INSERT INTO relay_state_meta (id) SELECT ? WHERE NOT EXISTS "
+                         "(SELECT 1 FROM relay_state_meta)", (uuid.uuid4().hex[:8],))
+        self.id = self._conn().execute("SELECT id FROM relay_state_meta").fetchone()[0]
+        self.keys = IdempotencyKeys(path)
+
+    def version(self):
+        # seq only grows, so the total changes on every set; count catches new instruments.
+        return tuple(self._conn().execute("SELECT total(seq), count(*) FROM relay_state").fetchone())
+
+    def snapshot(self):
+        rows = self._conn().execute("SELECT instrument, seq, state FROM relay_state").fetchall()
+        return {instrument: (seq, json.loads(state)) for instrument, seq, state in rows}
+
+    def set(self, instrument, state):
+        with self._conn() as conn:
+            return conn.execute("INSERT INTO relay_state (instrument, seq, state) VALUES (?, 1, ?) "
+                                "ON CONFLICT (instrument) DO UPDATE SET seq = seq + 1, state = excluded.state "
+                                "RETURNING seq", (instrument, json.dumps(state))).fetchone()[0]
+
+    def restore(self, instrument, state):
+        with self._conn() as conn:
+            cursor = conn.execute("INSERT OR IGNORE INTO relay_state (instrument, seq, state) VALUES (?, 0, ?)",
+                                  (instrument, json.dumps(state)))
+            return cursor.rowcount == 1
+
+    def close(self):
+        super().close()
+        self.keys.close()
+
+
+class _Overflow(_SQLiteFile):
+    """ (seq, state) per instrument for states that do not fit in a shared-memory slot. """
+
+    def __init__(self, path):
+        super().__init__(path)
+        with self._conn() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS relay_state_overflow "
+                         "(instrument TEXT PRIMARY KEY, seq INTEGER NOT NULL, state TEXT NOT NULL)")
+
+    def get(self, instrument):
+        row = self._conn().execute("SELECT seq, state FROM relay_state_overflow WHERE instrument = ?",
+                                   (instrument,)).fetchone()
+        return (row[0], json.loads(row[1])) if row is not None else None
+
+    def put(self, instrument, seq, data):
+        with self._conn() as conn:
+            conn.execute("INSERT OR REPLACE INTO relay_state_overflow (instrument, seq, state) VALUES (?, ?, ?)",
+                         (instrument, seq, data))
+
+    def snapshot(self):
+        rows = self._conn().execute("SELECT instrument, seq, state FROM relay_state_overflow").fetchall()
+        return {instrument: (seq, json.loads(state)) for instrument, seq, state in rows}
+
+
+class SharedMemoryStateStore():
+    """ State in a named shared-memory segment of fixed-size slots, one per instrument.
+
+    Layout: header (version, id) then slots of (name, seq, length, JSON state). Writers and
+    snapshot readers take an exclusive/shared flock on a lock file next to the segment; version()
+    reads the header without locking. The segment outlives relay workers until unlink().
+    Idempotency keys are kept in a SQLite file next to the lock file. So are states larger than
+    slot_size (their slot keeps the seq, with length _SPILLED) and instruments registered after
+    every slot is taken: both are slower to read but never rejected.
+    """
+
+    shared = True
+    _HEADER = struct.Struct('<Q8s')
+    _SLOT = struct.Struct('<32sQI')
+    _SPILLED = 0xFFFFFFFF
+
+    def __init__(self, name='ovro_alert_relay', slots=64, slot_size=4096, lock_path=None):
+        import fcntl
+        from multiprocessing import shared_memory
+
+        self._fcntl = fcntl
+        self.name = name
+        self.slots = slots
+        self.slot_size = slot_size
+        self._stride = self._SLOT.size + slot_size
+        size = self._HEADER.size + slots * self._stride
+        try:
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            self._shm = shared_memory.SharedMemory(name=name)
+            # Every worker attaches; only unlink() should remove the segment.
+            try:
+                from multiprocessing import resource_tracker
+                resource_tracker.unregister(self._shm._name, 'shared_memory')
+            except Exception:
+                pass
+        if self._shm.size < size:
+            raise ValueError(f'Shared memory {name} is {self._shm.size} bytes; expected {size}')
+
+        self._thread_lock = threading.Lock()
+        lock_path = lock_path or os.path.join('/tmp', name + '.lock')
+        self._lock_fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        db_path = os.path.splitext(lock_path)[0] + '.keys.db'
+        self.keys = IdempotencyKeys(db_path)
+        self._overflow = _Overflow(db_path)
+        self._index = {}  # instrument -> slot number, cached per process
+        self._spilled = set()  # instruments this process has warned about
+        with self._locked(self._fcntl.LOCK_EX):
+            version, store_id = self._HEADER.unpack_from(self._shm.buf, 0)
+            if store_id == bytes(8):
+                store_id = uuid.uuid4().hex[:8].encode()
+                self._HEADER.pack_into(self._shm.buf, 0, version, store_id)
+        self.id = store_id.decode()
+
+    @contextlib.contextmanager
+    def _locked(self, operation):
+        with self._thread_lock:
+            self._fcntl.flock(self._lock_fd, operation)
+            try:
+                yield
+            finally:
+                self._fcntl.flock(self._lock_fd, self._fcntl.LOCK_UN)
+
+    def _offset(self, slot):
+        return self._HEADER.size + slot * self._stride
+
+    def _read_slot(self, slot, spilled=None):
+        """ (name, seq, state) in slot; spilled ({instrument: (seq, state)}) saves a query per spilled slot. """
+        name, seq, length = self._SLOT.unpack_from(self._shm.buf, self._offset(slot))
+        name = name.rstrip(b'\0').decode()
+        if not name:
+            return None, 0, None
+        if length == self._SPILLED:
+            entry = spilled.get(name) if spilled is not None else self._overflow.get(name)
+            return name, seq, entry[1] if entry is not None else None
+        start = self._offset(slot) + self._SLOT.size
+        return name, seq, json.loads(bytes(self._shm.buf[start:start + length]))
+
+    def _find(self, instrument, create):
+        """ Slot number for instrument, claiming an empty one if create (None if all are taken).
+        Call with the lock held.
+        """
+        slot = self._index.get(instrument)
+        if slot is not None:
+            return slot
+        for slot in range(self.slots):
+            name = self._SLOT.unpack_from(self._shm.buf, self._offset(slot))[0].rstrip(b'\0').decode()
+            if name == instrument or (not name and create):
+                self._index[instrument] = slot
+                return slot
+            if not name:
+                return None
+        return None
+
+    def _current_seq(self, instrument):
+        """ seq of instrument's state, or None if it has none. Call with the lock held. """
+        slot = self._find(instrument, create=False)
+        if slot is not None:
+            return self._read_slot(slot)[1]
+        entry = self._overflow.get(instrument)
+        return entry[0] if entry is not None else None
+
+    def _write(self, instrument, seq, state):
+        data = json.dumps(state)
+        encoded = instrument.encode()
+        if len(encoded) > 32:
+            raise ValueError(f'Instrument name too long for shared state: {instrument}')
+
+        slot = self._find(instrument, create=True)
+        if slot is None or len(data.encode()) > self.slot_size:
+            if instrument not in self._spilled:
+                self._spilled.add(instrument)
+                logger.warning(f'State for {instrument} does not fit in shared memory '
+                               f'(slots={self.slots}, slot_size={self.slot_size}); storing it in SQLite')
+            self._overflow.put(instrument, seq, data)
+            if slot is not None:
+                self._SLOT.pack_into(self._shm.buf, self._offset(slot), encoded, seq, self._SPILLED)
+        else:
+            data = data.encode()
+            offset = self._offset(slot)
+            self._SLOT.pack_into(self._shm.buf, offset, encoded, seq, len(data))
+            self._shm.buf[offset + self._SLOT.size:offset + self._SLOT.size + len(data)] = data
+        version, store_id = self._HEADER.unpack_from(self._shm.buf, 0)
+        self._HEADER.pack_into(self._shm.buf, 0, version + 1, store_id)
+
+    def version(self):
+        return self._HEADER.unpack_from(self._shm.buf, 0)[0]
+
+    def snapshot(self):
+        with self._locked(self._fcntl.LOCK_SH):
+            spilled = self._overflow.snapshot()
+            result = dict(spilled)
+            for slot in range(self.slots):
+                name, seq, state = self._read_slot(slot, spilled)
+                if name is None:
+                    break
+                result[name] = (seq, state)
+        return result
+
+    def set(self, instrument, state):
+        with self._locked(self._fcntl.LOCK_EX):
+            seq = (self._current_seq(instrument) or 0) + 1
+            self._write(instrument, seq, state)
+            return seq
+
+    def restore(self, instrument, state):
+        with self._locked(self._fcntl.LOCK_EX):
+            if self._current_seq(instrument) is not None:
+                return False
+            self._write(instrument, 0, state)
+            return True
+
+    def close(self):
+        self._shm.close()
+        os.close(self._lock_fd)
+        self.keys.close()
+        self._overflow.close()
+
+    def unlink(self):
+        """ Remove the segment (e.g., when the relay service is stopped for good). """
+        self._shm.unlink()
+
+
+def from_env():
+    """ Store selected by RELAY_STATE (memory, sqlite or shm). """
+
+    backend = environ.get('RELAY_STATE', 'memory')
+    if backend == 'memory':
+        return MemoryStateStore()
+    elif backend == 'sqlite':
+        path = environ.get('RELAY_STATE_PATH',
+                           os.path.join(os.path.dirname(relay_db.DBPATH), 'relay_state.db'))
+        logger.info(f'Using SQLite relay state at {path}')
+        return SQLiteStateStore(path)
+    elif backend == 'shm':
+        name = environ.get('RELAY_STATE_NAME', 'ovro_alert_relay')
+        logger.info(f'Using shared-memory relay state {name}')
+        return SharedMemoryStateStore(name)
+    else:
+        raise ValueError(f'Unknown RELAY_STATE {backend}; use memory, sqlite or shm')
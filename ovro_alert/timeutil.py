@@ -0,0 +1,102 @@
+"""Fast UTC time helpers for the alert path, in place of astropy.time on hot paths.
+
+MJD here is UTC MJD from POSIX time (which ignores leap seconds), matching
+``astropy.time.Time.now().mjd`` to well under a millisecond except during a day with a leap
+second, which astropy stretches to 86401 s (up to 1 s apart then).
+Conversions are plain arithmetic, so they also work elementwise on numpy arrays.
+"""
+import time
+from datetime import datetime, timedelta
+
+MJD_UNIX_EPOCH = 40587.0  # MJD of 1970-01-01T00:00:00 UTC
+SECONDS_PER_DAY = 86400.0
+UNIX_EPOCH = datetime(1970, 1, 1)
+
+
+def unix_to_mjd(t):
+    """ MJD for POSIX time t (float or array). """
+
+    return t / SECONDS_PER_DAY + MJD_UNIX_EPOCH
+
+
+def mjd_to_unix(mjd):
+    """ POSIX time for MJD (float or array). """
+
+    return (mjd - MJD_UNIX_EPOCH) * SECONDS_PER_DAY
+
+
+def now_mjd():
+    """ Current UTC MJD. """
+
+    return time.time() / SECONDS_PER_DAY + MJD_UNIX_EPOCH
+
+
+def datetime_to_mjd(dt):
+    """ MJD for a naive UTC datetime (as returned by parse_iso). """
+
+    return unix_to_mjd((dt - UNIX_EPOCH).total_seconds())
+
+
+# Layouts seen from GCN/LIGO/CHIME. The last one that parsed a string is tried first next time.
+_FORMATS = ['%Y-%m-%dT%H:%M:%S.%fZ', '%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%SZ', '%Y-%m-%dT%H:%M:%S',
+            '%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S']
+_last_format = [0]
+
+
+def parse_iso(text):
+    """ Naive UTC datetime for an ISO-8601 timestamp, or None if it cannot be parsed.
+
+    Handles 'YYYY-MM-DD[T ]HH:MM:SS[.fraction][Z|+HH:MM|-HH:MM]' by slicing (faster than strptime,
+    ~25x faster than astropy); anything else falls back to strptime, trying the last format that
+    worked first.
+    Offsets are applied so the result is always UTC.
+    """
+
+    if not text:
+        return None
+    try:
+        return _parse_fast(text)
+    except (ValueError, IndexError):
+        pass
+
+    for i in [_last_format[0]] + list(range(len(_FORMATS))):
+        try:
+            dt = datetime.strptime(text, _FORMATS[i])
+        except ValueError:
+            continue
+        _last_format[0] = i
+        return dt
+    return None
+
+
+def _parse_fast(text):
+    if len(text) < 19 or text[4] != '-' or text[7] != '-' or text[10] not in 'T ' or text[13] != ':' \
+            or text[16] != ':':
+        raise ValueError(text)
+    dt = datetime(int(text[0:4]), int(text[5:7]), int(text[8:10]),
+                  int(text[11:13]), int(text[14:16]), int(text[17:19]))
+
+    rest = text[19:]
+    if rest.startswith('.'):
+        end = 1
+        while end < len(rest) and rest[end].isdigit():
+            end += 1
+        digits = rest[1:end]
+        if not digits:
+            raise ValueError(text)
+        dt = dt.replace(microsecond=int((digits + '00000')[:6]))
+        rest = rest[end:]
+
+    if rest in ('', 'Z'):
+        return dt
+    if len(rest) == 6 and rest[0] in '+-' and rest[3] == ':':
+        offset = timedelta(hours=int(rest[1:3]), minutes=int(rest[4:6]))
+        return dt - offset if rest[0] == '+' else dt + offset
+    raise ValueError(text)
+
+
+def iso_to_mjd(text):
+    """ MJD for an ISO-8601 timestamp, or None if it cannot be parsed. """
+
+    dt = parse_iso(text)
+    return datetime_to_mjd(dt) if dt is not None else None
@@ -0,0 +1,75 @@
+"""Alert latency tracing across receiver, relay and observing client.
+
+A trace rides inside the command args as ``args["_trace"]``, so it passes through the relay,
+relay_db and every client without schema changes::
+
+    {"id": "<hex>", "marks": [["gcn_kafka_receiver", "kafka", 1700000000.123], ...]}
+
+Each component appends ``[component, stage, unix time]`` marks as the alert passes through.
+The relay stores every mark it sees in relay_db (``traces`` table); clients downstream of the
+relay send theirs back with ``AlertClient.report_trace``, or ``TraceReporter`` to send them from
+a background thread. ``breakdown`` turns the marks into per-hop latencies, as served by the
+relay at ``/traces/<id>``.
+"""
+import time
+import uuid
+
+KEY = '_trace'
+
+
+def start(args, component, stage, ts=None, trace_id=None):
+    """ Start a trace in args (a command args dict) with a first mark. Returns args. """
+
+    args[KEY] = {'id': trace_id or uuid.uuid4().hex, 'marks': []}
+    return mark(args, component, stage, ts)
+
+
+def get(args):
+    """ Trace dict in args, or None if the command is not traced. """
+
+    if not isinstance(args, dict):
+        return None
+    ctx = args.get(KEY)
+    if isinstance(ctx, dict) and isinstance(ctx.get('id'), str) and isinstance(ctx.get('marks'), list):
+        return ctx
+    return None
+
+
+def mark(args, component, stage, ts=None, once=False):
+    """ Append a mark to the trace in args, if any. Returns args.
+    With once=True the mark is skipped if component already marked stage (e.g. repeated polls).
+    """
+
+    ctx = get(args)
+    if ctx is None:
+        return args
+    if once and any(m[0] == component and m[1] == stage for m in ctx['marks']):
+        return args
+    ctx['marks'].append([component, stage, time.time() if ts is None else float(ts)])
+    return args
+
+
+def carry(src, dst):
+    """ Copy the trace from args src into dst (e.g. when a client builds new args). Returns dst. """
+
+    ctx = get(src)
+    if ctx is not None:
+        dst[KEY] = ctx
+    return dst
+
+
+def breakdown(marks):
+    """ Per-hop latency for a list of [component, stage, ts] marks, ordered by time.
+
+    Returns dict with "marks" (each with since_start_ms and since_prev_ms), "total_ms" and
+    "slowest" (the mark that ended the longest hop).
+    """
+
+    marks = sorted(marks, key=lambda m: m[2])
+    rows = []
+    for i, (component, stage, ts) in enumerate(marks):
+        rows.append({'component': component, 'stage': stage, 'ts': ts,
+                     'since_start_ms': round((ts - marks[0][2]) * 1e3, 3),
+                     'since_prev_ms': round((ts - marks[i - 1][2]) * 1e3, 3) if i else 0.0})
+    slowest = max(rows[1:], key=lambda row: row['since_prev_ms']) if len(rows) > 1 else None
+    return {'marks': rows, 'total_ms': rows[-1]['since_start_ms'] if rows else 0.0, 'slowest': slowest}
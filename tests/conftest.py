@@ -0,0 +1,66 @@
+"""Shared fixtures for relay API tests."""
+
+import os
+
+import pytest
+
+RELAY_KEY = "test-relay-key"
+
+
+@pytest.fixture
+def relay_key():
+    return RELAY_KEY
+
+
+@pytest.fixture
+def relay(tmp_path, monkeypatch):
+    """Relay API module with a temp DBPATH, no Slack client and fresh in-memory state."""
+    pytest.importorskip("fastapi")
+    pytest.importorskip("httpx")
+    os.environ.setdefault("RELAY_KEY", RELAY_KEY)
+    from ovro_alert import notify, relay_api, relay_db, relay_state
+
+    monkeypatch.setattr(relay_db, "DBPATH", str(tmp_path / "relay.db"))
+    monkeypatch.setattr(relay_api, "RELAY_KEY", RELAY_KEY)
+    monkeypatch.setattr(relay_api, "cl", None)
+    monkeypatch.setattr(relay_api, "slack", notify.SlackNotifier(None))
+    monkeypatch.setattr(relay_api, "_idempotency", relay_api.OrderedDict())
+    monkeypatch.setattr(relay_api, "store", relay_state.MemoryStateStore())
+    monkeypatch.setattr(relay_api, "_store_version", None)
+    names = [instrument.name for instrument in relay_api.DEFAULT_INSTRUMENTS]
+    monkeypatch.setattr(relay_api, "instruments", {i.name: i for i in relay_api.DEFAULT_INSTRUMENTS})
+    monkeypatch.setattr(relay_api, "dd", {name: {"command": None, "command_mjd": None} for name in names})
+    monkeypatch.setattr(relay_api, "_seq", {name: 0 for name in names})
+    monkeypatch.setattr(relay_api, "_events", {name: relay_api.deque(maxlen=relay_api.EVENT_BUFFER_SIZE)
+                                               for name in names})
+    monkeypatch.setattr(relay_api, "_waiters", {name: set() for name in names})
+    monkeypatch.setattr(relay_api, "_subscribers", {name: set() for name in names})
+    monkeypatch.setattr(relay_api, "_cache", {name: relay_api._render(name) for name in names})
+    return relay_api
+
+
+@pytest.fixture
+def relay_client(relay):
+    from fastapi.testclient import TestClient
+
+    with TestClient(relay.app) as client:
+        yield client
+
+
+@pytest.fixture
+def command_body():
+    """Build a PUT body, e.g. command_body("gcn", 60000.5, dm=1.5) (args are the keywords)."""
+    def body(route, command_mjd=60000.5, command="observation", **args):
+        return {"instrument": route, "command": command, "command_mjd": command_mjd, "args": args}
+    return body
+
+
+@pytest.fixture
+def put_command(relay_client, relay_key, command_body):
+    """PUT a command_body(...) to /{route} on relay_client, check for a 200 and return the JSON response."""
+    def put(route, command_mjd=60000.5, command="observation", **args):
+        resp = relay_client.put(f"/{route}", params={"key": relay_key},
+                                json=command_body(route, command_mjd, command, **args))
+        assert resp.status_code == 200
+        return resp.json()
+    return put
@@ -0,0 +1,190 @@
+"""AlertClient request construction against a fake session."""
+
+import json
+import os
+import threading
+from unittest.mock import MagicMock
+
+import pytest
+
+
+@pytest.fixture
+def ac(monkeypatch):
+    pytest.importorskip("requests")
+    os.environ.setdefault("RELAY_KEY", "test-relay-key")
+    from ovro_alert import alert_client
+
+    session = MagicMock()
+    session.get.return_value.status_code = 200
+    session.get.return_value.json.return_value = {"command_mjd": 1.0}
+    monkeypatch.setattr(alert_client, "s", session)
+    return alert_client, session
+
+
+def test_get_plain(ac):
+    alert_client, session = ac
+    client = alert_client.AlertClient("lwa", ip="localhost", port="8001")
+    assert client.get(route="chime") == {"command_mjd": 1.0}
+    kwargs = session.get.call_args[1]
+    assert kwargs["url"] == "http://localhost:8001/chime"
+    assert "since_mjd" not in kwargs["params"]
+    assert kwargs["timeout"] == 9.05
+
+
+def test_get_long_poll_extends_timeout(ac):
+    alert_client, session = ac
+    client = alert_client.AlertClient("chime", ip="localhost", port="8001")
+    client.get(since_mjd=60000.123456789, wait=30)
+    kwargs = session.get.call_args[1]
+    assert float(kwargs["params"]["since_mjd"]) == 60000.123456789
+    assert kwargs["params"]["wait"] == 30
+    assert kwargs["timeout"] == pytest.approx(39.05)
+
+
+def test_get_many(ac):
+    alert_client, session = ac
+    session.get.return_value.json.return_value = {"read_mjd": 2.0, "chime": {"command_mjd": 1.0}}
+    client = alert_client.AlertClient("lwa", ip="localhost", port="8001")
+    dd = client.get_many(["chime", "casm"])
+    assert dd["chime"] == {"command_mjd": 1.0}
+    kwargs = session.get.call_args[1]
+    assert kwargs["url"] == "http://localhost:8001/commands"
+    assert kwargs["params"]["routes"] == "chime,casm"
+
+
+def test_get_many_bad_key_returns_empty(ac):
+    alert_client, session = ac
+    session.get.return_value.json.return_value = "Bad key"
+    client = alert_client.AlertClient("lwa", ip="localhost", port="8001")
+    assert client.get_many(["chime"]) == {}
+
+
+def test_iter_events_advances_cursor(ac, monkeypatch):
+    alert_client, session = ac
+    pages = [
+        {"events": [{"seq": None, "command_mjd": 1.0}, {"seq": 4, "command_mjd": 2.0}], "gap": False},
+        {"events": [{"seq": 5, "command_mjd": 3.0}], "gap": False},
+    ]
+    session.get.return_value.json.side_effect = pages
+    monkeypatch.setattr(alert_client, "sleep", lambda sec: None)
+    client = alert_client.AlertClient("gcn", ip="localhost", port="8001")
+
+    events = client.iter_events(after=0, limit=2)
+    assert [next(events)["command_mjd"] for _ in range(3)] == [1.0, 2.0, 3.0]
+    last_params = session.get.call_args[1]["params"]
+    assert session.get.call_args[1]["url"] == "http://localhost:8001/gcn/events"
+    assert last_params["after"] == 4
+    assert float(last_params["after_mjd"]) == 2.0
+
+
+def test_get_revalidates_with_etag(ac):
+    alert_client, session = ac
+    first = MagicMock(status_code=200, headers={"ETag": 'W/"a-chime-1"'})
+    first.json.return_value = {"read_mjd": 1.0, "command_mjd": 1.0}
+    not_modified = MagicMock(status_code=304, headers={"ETag": 'W/"a-chime-1"'})
+    session.get.side_effect = [first, not_modified]
+    client = alert_client.AlertClient("chime", ip="localhost", port="8001")
+
+    assert client.get() == {"read_mjd": 1.0, "command_mjd": 1.0}
+    assert session.get.call_args[1]["headers"] is None
+    dd = client.get()
+    assert dd["command_mjd"] == 1.0 and dd["read_mjd"] > 60000  # revalidated now, not the cached read
+    assert session.get.call_args[1]["headers"] == {"If-None-Match": 'W/"a-chime-1"'}
+    not_modified.json.assert_not_called()
+
+
+def test_set_sends_fresh_idempotency_key(ac):
+    alert_client, session = ac
+    session.put.return_value.status_code = 200
+    client = alert_client.AlertClient("lwa", ip="localhost", port="8001")
+
+    client.set("observation", args={"dm": 1.0})
+    client.set("observation", args={"dm": 1.0})
+    keys = [c[1]["headers"]["Idempotency-Key"] for c in session.put.call_args_list]
+    assert len(keys) == 2 and keys[0] != keys[1]
+
+
+def test_set_many_chunks_bulk_puts(ac):
+    alert_client, session = ac
+    session.put.return_value.status_code = 200
+    client = alert_client.AlertClient("gcn", ip="localhost", port="8001")
+
+    commands = [{"command": "observation", "args": {"n": i}, "route": "swift" if i % 2 else None} for i in range(5)]
+    assert client.set_many(commands, chunk=2) == 200
+
+    calls = session.put.call_args_list
+    assert [c[1]["url"] for c in calls] == ["http://localhost:8001/bulk"] * 3
+    sent = [cmd for c in calls for cmd in json.loads(c[1]["data"])]
+    assert [cmd["instrument"] for cmd in sent] == ["gcn", "swift", "gcn", "swift", "gcn"]
+    assert [cmd["args"]["n"] for cmd in sent] == list(range(5))
+
+
+def test_get_marks_trace_read_once_and_reports(ac):
+    alert_client, session = ac
+    args = {"_trace": {"id": "t1", "marks": [["gcn_kafka_receiver", "kafka", 1.0]]}}
+    session.get.return_value.json.return_value = {"command_mjd": 1.0, "args": args}
+    session.put.return_value.status_code = 200
+    client = alert_client.AlertClient("chime", ip="localhost", port="8001")
+
+    dd = client.get()
+    client.get()
+    assert [m[1] for m in dd["args"]["_trace"]["marks"]] == ["kafka", "read"]
+
+    assert client.report_trace(dd["args"]) == 200
+    assert session.put.call_args[1]["url"] == "http://localhost:8001/traces"
+    assert json.loads(session.put.call_args[1]["data"])["id"] == "t1"
+    assert client.report_trace({"dm": 1}) is None
+
+
+def test_trace_reporter_sends_in_background(ac):
+    alert_client, session = ac
+    started, release = threading.Event(), threading.Event()
+
+    def put(**kwargs):
+        started.set()
+        release.wait(5)
+        return MagicMock(status_code=200)
+
+    session.put.side_effect = put
+    reporter = alert_client.TraceReporter(alert_client.AlertClient("lwa", ip="localhost", port="8001"), maxsize=1)
+
+    args = {"_trace": {"id": "t2", "marks": [["relay_api", "received", 1.0]]}}
+    assert reporter.post(args)  # returns while the relay is slow
+    assert started.wait(5) and not reporter.flush(timeout=0.05)
+    args["_trace"]["marks"].append(["lwa_alert_client", "put_dict", 2.0])
+    assert reporter.post(args) and not reporter.post(args)  # one sending, one queued, one dropped
+    assert not reporter.post({"dm": 1})
+
+    release.set()
+    assert reporter.flush(timeout=5)
+    sent = [json.loads(c[1]["data"]) for c in session.put.call_args_list]
+    assert [len(ctx["marks"]) for ctx in sent] == [1, 2]
+
+
+def test_relay_key_prompted_once_on_first_use(ac, monkeypatch):
+    alert_client, session = ac
+    prompts = []
+    monkeypatch.setattr(alert_client, "RELAY_KEY", None)
+    monkeypatch.delenv("RELAY_KEY")
+    monkeypatch.setattr("builtins.input", lambda msg: prompts.append(msg) or "typed-key")
+    client = alert_client.AlertClient("chime", ip="localhost", port="8001")
+
+    client.get()
+    client.get()
+    assert len(prompts) == 1
+    assert session.get.call_args[1]["params"]["key"] == "typed-key"
+
+    client.get(password="other-key")
+    assert session.get.call_args[1]["params"]["key"] == "other-key"
+
+
+def test_get_records_retry_after(ac):
+    alert_client, session = ac
+    session.get.return_value.headers = {"Retry-After": "12"}
+    client = alert_client.AlertClient("chime", ip="localhost", port="8001")
+    client.get()
+    assert client.retry_after == 12.0
+
+    session.get.return_value.headers = {"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"}
+    client.get()
+    assert client.retry_after is None
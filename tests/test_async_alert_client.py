@@ -0,0 +1,200 @@
+"""AsyncAlertClient against a stand-in relay served with asyncio.start_server."""
+
+import asyncio
+import json
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from ovro_alert import async_alert_client
+
+
+class StandInRelay():
+    """ Minimal HTTP/1.1 keep-alive relay: GET/PUT /<route>, GET /commands, PUT /bulk.
+    Routes listed in delays answer after that many seconds.
+    """
+
+    def __init__(self, delays=None):
+        self.delays = delays or {}
+        self.state = {}
+        self.requests = []
+        self.connections = 0
+        self.server = None
+
+    async def __aenter__(self):
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, *exc):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                method, target, _ = line.decode().split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line == b"\r\n":
+                        break
+                    name, _, value = line.decode().partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                url = urlsplit(target)
+                params = {k: v[0] for k, v in parse_qs(url.query).items()}
+                self.requests.append((method, url.path, params, headers, body))
+                status, payload, extra = await self._respond(method, url.path.strip("/"), params, headers, body)
+                data = b"" if status == 304 else json.dumps(payload).encode()
+                head = [f"HTTP/1.1 {status} X", f"Content-Length: {len(data)}"] + extra
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + data)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, method, path, params, headers, body):
+        if params.get("key") != "test-relay-key":
+            return 200, "Bad key", []
+        await asyncio.sleep(self.delays.get(path, 0))
+        if method == "PUT":
+            commands = json.loads(body) if path == "bulk" else [json.loads(body)]
+            for command in commands:
+                self.state[command["instrument"]] = command
+            return 200, "Success", []
+        if path == "commands":
+            routes = params["routes"].split(",")
+            return 200, dict({"read_mjd": 1.0}, **{r: self._state(r) for r in routes}), []
+        etag = f'W/"{self._state(path)["command_mjd"]}"'
+        if headers.get("if-none-match") == etag:
+            return 304, None, [f"ETag: {etag}"]
+        return 200, dict({"read_mjd": 1.0}, **self._state(path)), [f"ETag: {etag}"]
+
+    def _state(self, route):
+        return self.state.get(route, {"command": None, "command_mjd": None})
+
+
+@pytest.fixture(autouse=True)
+def relay_key(monkeypatch):
+    from ovro_alert import alert_client
+
+    monkeypatch.setattr(alert_client, "RELAY_KEY", "test-relay-key")
+
+
+def test_routes_fetched_concurrently_over_pool():
+    async def scenario():
+        async with StandInRelay(delays={"chime": 0.3, "casm": 0.3, "ligo": 0.3}) as relay:
+            client = async_alert_client.AsyncAlertClient("lwa", ip="127.0.0.1", port=str(relay.port), pool_size=3)
+            t0 = time.perf_counter()
+            dd = await client.get_routes(["chime", "casm", "ligo"])
+            elapsed = time.perf_counter() - t0
+            await client.get_routes(["chime", "casm", "ligo"])
+            client.close()
+            return dd, elapsed, relay.connections
+
+    dd, elapsed, connections = asyncio.run(scenario())
+    assert set(dd) == {"chime", "casm", "ligo"} and dd["chime"]["command_mjd"] is None
+    assert elapsed < 0.6  # max(route), not sum(route)
+    assert connections == 3  # second round reused the keep-alive connections
+
+
+def test_deadline_isolates_slow_route():
+    async def scenario():
+        async with StandInRelay(delays={"ligo": 5}) as relay:
+            client = async_alert_client.AsyncAlertClient("lwa", ip="127.0.0.1", port=str(relay.port), timeout=0.2)
+            t0 = time.perf_counter()
+            dd = await client.get_routes(["chime", "ligo"])
+            client.close()
+            return dd, time.perf_counter() - t0
+
+    dd, elapsed = asyncio.run(scenario())
+    assert dd["ligo"] == {} and "command_mjd" in dd["chime"]
+    assert elapsed < 1
+
+
+def test_set_and_get_match_sync_client():
+    async def scenario():
+        async with StandInRelay() as relay:
+            client = async_alert_client.AsyncAlertClient("chime", ip="127.0.0.1", port=str(relay.port))
+            assert await client.set("observation", args={"dm": 300}) == 200
+            first = await client.get()
+            second = await client.get()  # revalidated by ETag
+            assert await client.set_many([{"command": "test", "route": "casm"}, {"command": "observation"}]) == 200
+            many = await client.get_many(["chime", "casm"])
+            client.close()
+            return relay.requests, first, second, many
+
+    requests, first, second, many = asyncio.run(scenario())
+    method, path, params, headers, body = requests[0]
+    assert (method, path, params["key"]) == ("PUT", "/chime", "test-relay-key")
+    assert "idempotency-key" in headers
+    assert headers["host"] == "ovro.caltech.edu"  # same as AlertClient
+    sent = json.loads(body)
+    assert sent["instrument"] == "chime" and sent["args"] == {"dm": 300} and sent["command_mjd"] > 60000
+
+    assert first["args"] == {"dm": 300} and dict(second, read_mjd=1.0) == first
+    assert requests[2][3]["if-none-match"] and second["read_mjd"] > first["read_mjd"]  # 304: read now
+    assert requests[3][1] == "/bulk"
+    assert many["casm"]["command"] == "test" and many["chime"]["command"] == "observation"
+
+
+def test_bad_key_and_unreachable_relay():
+    async def scenario():
+        async with StandInRelay() as relay:
+            client = async_alert_client.AsyncAlertClient("chime", ip="127.0.0.1", port=str(relay.port))
+            bad = await client.get(password="wrong")
+            port = relay.port
+        client.close()
+        gone = async_alert_client.AsyncAlertClient("chime", ip="127.0.0.1", port=str(port), retries=0)
+        return bad, await gone.get(), await gone.set("observation")
+
+    bad, unreachable, status = asyncio.run(scenario())
+    assert bad == "Bad key"  # as returned by AlertClient.get
+    assert unreachable == {} and status is None
+
+
+def test_poll_yields_changed_routes():
+    async def scenario():
+        async with StandInRelay() as relay:
+            client = async_alert_client.AsyncAlertClient("lwa", ip="127.0.0.1", port=str(relay.port))
+            writer = async_alert_client.AsyncAlertClient("gcn", ip="127.0.0.1", port=str(relay.port))
+            await writer.set("observation", args={"n": 0})
+            events = client.poll(["gcn", "chime"], loop=0.05)
+
+            async def produce():
+                await asyncio.sleep(0.2)
+                await writer.set("observation", args={"n": 1})
+
+            task = asyncio.ensure_future(produce())
+            route, dd = await asyncio.wait_for(events.__anext__(), 5)
+            await task
+            client.close()
+            writer.close()
+            return route, dd
+
+    route, dd = asyncio.run(scenario())
+    assert route == "gcn" and dd["args"] == {"n": 1}
+
+
+def test_against_relay_app(relay, tmp_path):
+    pytest.importorskip("uvicorn")
+    from benchmarks import relay_load
+
+    async def scenario(port):
+        async with async_alert_client.AsyncAlertClient("chime", ip="127.0.0.1", port=str(port)) as client:
+            assert await client.set("observation", args={"dm": 10}) == 200
+            dd = await client.get_routes(["chime", "casm"])
+            again = await client.get()
+            return dd, again
+
+    with relay_load.local_relay(str(tmp_path / "relay.db")) as (_, port):
+        dd, again = asyncio.run(scenario(port))
+    assert dd["chime"]["args"] == {"dm": 10} and dd["casm"]["command_mjd"] is None
+    assert again["command_mjd"] == dd["chime"]["command_mjd"]
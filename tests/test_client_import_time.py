@@ -0,0 +1,64 @@
+"""Observing-host client modules import fast, without heavy packages or a RELAY_KEY prompt."""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+
+MODULES = ["ovro_alert.alert_client", "ovro_alert.notify", "ovro_alert.trace", "ovro_alert.timeutil",
+           "ovro_alert.outbox", "ovro_alert.async_alert_client", "ovro_alert.poll_scheduler", "ovro_alert.dispatch"]
+HEAVY = ["astropy", "numpy", "pandas", "requests", "urllib3", "slack_sdk"]
+# Seconds for interpreter start plus imports; a cold CI machine takes ~0.1 s.
+STARTUP_BUDGET = 1.0
+
+PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+for name in {modules!r}:
+    __import__(name)
+elapsed = time.perf_counter() - t0
+print(json.dumps({{"elapsed": elapsed, "heavy": sorted(m for m in {heavy!r} if m in sys.modules)}}))
+"""
+
+
+def _python36():
+    """ python3.6 on PATH if it actually runs (a pyenv shim may exist for an inactive version). """
+
+    python = shutil.which("python3.6")
+    if python and subprocess.run([python, "-c", "pass"], stdout=subprocess.DEVNULL,
+                                 stderr=subprocess.DEVNULL).returncode == 0:
+        return python
+    return None
+
+
+PYTHON36 = _python36()
+
+
+def _probe(python):
+    env = {k: v for k, v in os.environ.items() if k != "RELAY_KEY"}
+    env["PYTHONPATH"] = str(ROOT)
+    # stdin is empty, so an import-time input() would fail the run with EOFError.
+    proc = subprocess.run([python, "-c", PROBE.format(modules=MODULES, heavy=HEAVY)], cwd=str(ROOT), env=env,
+                          stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True, timeout=30, check=False)
+    assert proc.returncode == 0, proc.stdout + proc.stderr
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def test_client_import_is_light_on_current_python():
+    result = _probe(sys.executable)
+    assert result["heavy"] == []
+    assert result["elapsed"] < STARTUP_BUDGET
+
+
+@pytest.mark.skipif(PYTHON36 is None, reason="python3.6 not on PATH")
+def test_client_import_is_light_on_python_36():
+    result = _probe(PYTHON36)
+    assert result["heavy"] == []
+    assert result["elapsed"] < STARTUP_BUDGET
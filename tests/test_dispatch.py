@@ -0,0 +1,145 @@
+"""Table-driven dispatch (ovro_alert.dispatch) and its use in LWAAlertClient.poll."""
+
+import time
+
+import pytest
+
+from ovro_alert.dispatch import Dispatcher, Event, Rule
+
+
+def _state(mjd, command="observation", **args):
+    return {"command_mjd": mjd, "command": command, "args": args}
+
+
+def _recording_rules(calls):
+    def handler(event):
+        calls.append((event.route, event.command))
+
+    return {
+        "ligo": Rule(handler, urgency=0, rank=4, on_test=handler),
+        "chime": Rule(handler, urgency=1, rank=0, required=("dm", "position")),
+        "dsa": Rule(handler, urgency=1, rank=3, required=("dm", "ra", "dec")),
+    }
+
+
+def test_every_changed_route_is_dispatched_in_priority_order():
+    calls = []
+    dispatcher = Dispatcher(_recording_rules(calls))
+    assert dispatcher.diff({"ligo": _state(1), "chime": _state(1), "dsa": _state(1)}) == []  # baseline
+
+    events = dispatcher.diff({"ligo": _state(2, nsamp=10), "chime": _state(2, dm=100, position="1,2"),
+                              "dsa": _state(3, "test")})
+    assert sorted(event.route for event in events) == ["chime", "dsa", "ligo"]
+    assert [event.route for event in dispatcher.dispatch(events)] == ["ligo", "chime", "dsa"]
+    assert calls == [("ligo", "observation"), ("chime", "observation")]  # dsa test is only logged
+    assert dispatcher.diff({"ligo": _state(2), "chime": _state(2), "dsa": _state(3)}) == []
+
+
+def test_same_urgency_orders_by_rank_then_age():
+    calls = []
+    rules = {route: Rule(lambda event: calls.append(event.route), urgency=1, rank=rank)
+             for route, rank in [("chime", 0), ("casm", 1), ("dsa", 3)]}
+    dispatcher = Dispatcher(rules)
+    dispatcher.diff({route: _state(1) for route in rules})
+    dispatcher.dispatch(dispatcher.diff({"dsa": _state(2), "casm": _state(5), "chime": _state(9)}))
+    assert calls == ["chime", "casm", "dsa"]
+
+    calls.clear()
+    rules["casm"].rank = 0
+    dispatcher.dispatch(dispatcher.diff({"dsa": _state(3), "casm": _state(6), "chime": _state(10)}))
+    assert calls == ["casm", "chime", "dsa"]
+
+
+def test_bad_args_and_handler_errors_do_not_block_other_routes():
+    calls = []
+
+    def broken(event):
+        raise RuntimeError("controller offline")
+
+    rules = _recording_rules(calls)
+    rules["ligo"] = Rule(broken, urgency=0)
+    dispatcher = Dispatcher(rules)
+    dispatcher.diff({route: _state(1) for route in rules})
+
+    done = dispatcher.dispatch(dispatcher.diff({"ligo": _state(2), "chime": _state(2, dm=100),  # no position
+                                                "dsa": _state(2, dm=1, ra=2, dec=3)}))
+    assert [event.route for event in done] == ["ligo", "chime", "dsa"]
+    assert calls == [("dsa", "observation")]
+
+
+def test_incomplete_states_are_reported_and_baselined_later():
+    calls = []
+    dispatcher = Dispatcher(_recording_rules(calls))
+    assert dispatcher.diff({"ligo": _state(1)}) == []
+    assert sorted(dispatcher.missing) == ["chime", "dsa"]
+
+    events = dispatcher.diff({"ligo": _state(2), "chime": _state(5), "dsa": {}})
+    assert [event.route for event in events] == ["ligo"]  # chime's first state is only recorded
+    assert dispatcher.missing == ["dsa"]
+    assert dispatcher.diff(None) == [] and len(dispatcher.missing) == 3
+
+
+class StubPipeline():
+    def __init__(self, pipeline_id):
+        self.pipeline_id = pipeline_id
+        self.dumps = []
+        self.triggered_dump = self
+
+    def trigger(self, **kwargs):
+        self.dumps.append(kwargs)
+
+
+class StubController():
+    def __init__(self):
+        self.pipelines = [StubPipeline(i) for i in range(1, 5)]
+        self.configured = []
+
+    def configure_xengine(self, **kwargs):
+        self.configured.append(kwargs)
+
+
+def test_lwa_poll_dispatches_simultaneous_alerts_in_one_round(monkeypatch):
+    try:
+        import ovro_alert.lwa_alert_client as lac
+    except ImportError as e:
+        pytest.skip(f"LWA client dependencies unavailable: {e}")
+
+    con = StubController()
+    client = lac.LWAAlertClient(con)
+    beams = []
+    monkeypatch.setattr(client, "submit_voltagebeam", beams.append)
+
+    quiet = {route: _state(1, "test") for route in ["chime", "casm", "ligo", "gcn", "dsa"]}
+    burst = dict(quiet, chime=_state(2, dm=100, position="1,2,0.1"), casm=_state(2, dm=50),  # no position
+                 ligo=_state(2, nsamp=24000), dsa=_state(2, dm=200, ra=10, dec=20))
+    states = iter([quiet, quiet, burst, burst])
+
+    def get_many(routes):
+        client.retry_after = None
+        return next(states)  # StopIteration ends the poll loop
+
+    slept = []
+    monkeypatch.setattr(time, "sleep", slept.append)
+    monkeypatch.setattr(client, "get_many", get_many)
+    with pytest.raises(StopIteration):
+        client.poll(loop=5, min_loop=0.5)
+
+    assert [len(pipeline.dumps) for pipeline in con.pipelines] == [0, 1, 1, 0]
+    assert [beam["dm"] for beam in beams] == [100, 200]
+    assert beams[1]["position"] == "10,20"
+    assert len(slept) == 4 and slept[2] < 1  # tightened after the burst
+
+
+def test_lwa_ligo_test_passes_nsamp():
+    try:
+        import ovro_alert.lwa_alert_client as lac
+    except ImportError as e:
+        pytest.skip(f"LWA client dependencies unavailable: {e}")
+
+    con = StubController()
+    client = lac.LWAAlertClient(con)
+    rule = client.rules()["ligo"]
+    rule.on_test(Event("ligo", _state(2, "test", nsamp=48000), rule))
+    assert [pipeline.dumps for pipeline in con.pipelines[1:3]] == [[{"ntime_per_file": 1000320, "nfile": 1,
+                                                                     "dump_path": path}]
+                                                                   for path in ["/data0/", "/data1/"]]
@@ -0,0 +1,67 @@
+"""Histograms, Prometheus rendering and the relay /metrics endpoint."""
+
+from unittest.mock import MagicMock
+
+import pytest
+
+from ovro_alert import metrics
+
+
+def test_histogram_quantiles_are_bounded_estimates():
+    histogram = metrics.Histogram(buckets=(0.1, 0.2, 0.5, 1.0))
+    for value in [0.05] * 50 + [0.15] * 40 + [0.7] * 10:
+        histogram.observe(value)
+    assert histogram.count == 100
+    assert len(histogram.counts) == 5
+    assert 0.0 < histogram.quantile(0.5) <= 0.1
+    assert 0.1 < histogram.quantile(0.9) <= 0.2
+    assert 0.5 < histogram.quantile(0.99) <= 1.0
+    histogram.observe(100.0)
+    assert histogram.quantile(1.0) == 1.0
+
+
+def test_render_prometheus_text():
+    registry = metrics.Registry()
+    registry.observe("op_seconds", 0.003, "Op time", op="read")
+    registry.inc("ops_total", 2, op="read")
+    with registry.time("op_seconds", "Op time", op="write"):
+        pass
+    text = registry.render()
+
+    assert "# TYPE op_seconds histogram" in text
+    assert 'op_seconds_bucket{op="read",le="0.0025"} 0' in text
+    assert 'op_seconds_bucket{op="read",le="0.005"} 1' in text
+    assert 'op_seconds_bucket{op="read",le="+Inf"} 1' in text
+    assert 'op_seconds_count{op="write"} 1' in text
+    assert 'op_seconds_quantile{op="read",quantile="0.5"}' in text
+    assert 'ops_total{op="read"} 2' in text
+
+
+def test_relay_metrics_endpoint(relay, relay_client, relay_key):
+    body = {"instrument": "chime", "command": "observation", "command_mjd": 60000.5, "args": {}}
+    relay_client.put("/chime", params={"key": relay_key}, json=body)
+    relay_client.get("/chime", params={"key": relay_key})
+    relay_client.get("/history", params={"key": relay_key})
+
+    resp = relay_client.get("/metrics", params={"key": relay_key})
+    assert resp.headers["content-type"].startswith("text/plain")
+    text = resp.text
+    assert 'relay_requests_total{method="GET",route="/{instrument}",status="200"}' in text
+    assert 'relay_request_seconds_count{method="PUT",route="/{instrument}"}' in text
+    assert 'relay_request_seconds_quantile{method="GET",route="/{instrument}",quantile="0.99"}' in text
+    assert 'relay_db_seconds_count{op="get_history"}' in text
+    assert 'relay_state_age_seconds{instrument="chime"}' in text
+    assert 'relay_state_seq{instrument="chime"} 1' in text
+    assert relay_client.get("/metrics", params={"key": "wrong"}).json() == "Bad key"
+
+
+def test_slack_post_is_timed():
+    pytest.importorskip("slack_sdk")
+    from ovro_alert.notify import SlackNotifier
+
+    before = metrics.REGISTRY.get("slack_post_seconds")
+    before = before.count if before is not None else 0
+    notifier = SlackNotifier(MagicMock(), coalesce_window=0)
+    notifier.post("#test", "hello")
+    assert notifier.flush(5)
+    assert metrics.REGISTRY.get("slack_post_seconds").count == before + 1
@@ -0,0 +1,87 @@
+"""Background Slack notifier: enqueue, coalesce, rate-limit backoff, overflow."""
+
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("slack_sdk")
+
+from slack_sdk.errors import SlackApiError  # noqa: E402
+from slack_sdk.web import SlackResponse  # noqa: E402
+
+from ovro_alert.notify import SlackNotifier  # noqa: E402
+
+
+class FakeClient:
+    def __init__(self, delay=0.0, fail_first=0):
+        self.posts = []
+        self.delay = delay
+        self.fail_first = fail_first
+
+    def chat_postMessage(self, **kwargs):
+        if self.fail_first:
+            self.fail_first -= 1
+            response = SlackResponse(client=None, http_verb="POST", api_url="", req_args={},
+                                     data={"ok": False, "error": "ratelimited"},
+                                     headers={"Retry-After": "0"}, status_code=429)
+            raise SlackApiError("ratelimited", response)
+        time.sleep(self.delay)
+        self.posts.append(kwargs)
+
+
+def test_post_returns_without_waiting_for_slack():
+    client = FakeClient(delay=0.5)
+    notifier = SlackNotifier(client, coalesce_window=0)
+    t0 = time.monotonic()
+    assert notifier.post("#observing", "hello")
+    assert time.monotonic() - t0 < 0.1
+    assert notifier.flush(timeout=5)
+    assert client.posts == [{"channel": "#observing", "text": "hello"}]
+
+
+def test_messages_coalesce_per_channel():
+    client = FakeClient()
+    notifier = SlackNotifier(client, coalesce_window=0.2)
+    notifier.post("#a", "one")
+    notifier.post("#b", "two", icon_emoji=":zap:")
+    notifier.post("#a", "three")
+    assert notifier.flush(timeout=5)
+    assert client.posts == [
+        {"channel": "#a", "text": "one\nthree"},
+        {"channel": "#b", "text": "two", "icon_emoji": ":zap:"},
+    ]
+
+
+def test_retries_after_rate_limit():
+    client = FakeClient(fail_first=2)
+    notifier = SlackNotifier(client, coalesce_window=0)
+    notifier.post("#a", "x")
+    assert notifier.flush(timeout=5)
+    assert client.posts == [{"channel": "#a", "text": "x"}]
+
+
+def test_overflow_is_dropped_and_summarized():
+    gate = threading.Event()
+
+    class Blocking(FakeClient):
+        def chat_postMessage(self, **kwargs):
+            gate.wait(5)
+            super().chat_postMessage(**kwargs)
+
+    client = Blocking()
+    notifier = SlackNotifier(client, maxsize=2, coalesce_window=0, max_batch=1)
+    notifier.post("#a", "first")
+    time.sleep(0.1)  # worker now blocked posting "first"
+    assert notifier.post("#a", "2")
+    assert notifier.post("#a", "3")
+    assert not notifier.post("#a", "4")
+    gate.set()
+    assert notifier.flush(timeout=5)
+    texts = [post["text"] for post in client.posts]
+    assert texts[0] == "first"
+    assert any("1 Slack messages dropped" in text for text in texts)
+
+
+def test_no_client_is_noop():
+    assert SlackNotifier(None).post("#a", "x") is False
@@ -0,0 +1,163 @@
+"""Durable outbox (ovro_alert.outbox) between AlertClient.set and the relay."""
+
+import json
+import threading
+import time
+from unittest.mock import MagicMock
+
+import pytest
+
+from ovro_alert import outbox
+
+
+class FakeClient():
+    """ put_bulk that fails while down is True, recording what was accepted. """
+
+    def __init__(self, down=False):
+        self.down = down
+        self.calls = []
+        self.accepted = []
+
+    def put_bulk(self, dd, chunk=500, idempotency_key=None):
+        self.calls.append((idempotency_key, [cmd["args"]["n"] for cmd in dd]))
+        if self.down:
+            raise ConnectionError("relay down")
+        self.accepted.extend(dd)
+        return 200
+
+
+def _commands(start, stop):
+    return [{"instrument": "gcn", "command": "observation", "command_mjd": 60000.0 + n, "args": {"n": n}}
+            for n in range(start, stop)]
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_commands_survive_restart_and_replay_in_order(tmp_path):
+    path = str(tmp_path / "outbox.db")
+    down = FakeClient(down=True)
+    box = outbox.Outbox(path, down, batch=2)
+    assert box.put(_commands(0, 3)) == 3
+    assert box.flush() is False
+    box.close()
+
+    up = FakeClient()
+    box = outbox.Outbox(path, up, batch=2)
+    assert box.pending() == 3
+    assert box.flush() is True
+    assert [cmd["args"]["n"] for cmd in up.accepted] == [0, 1, 2]
+    assert [call[1] for call in up.calls] == [[0, 1], [2]]
+    assert up.calls[0][0] == down.calls[0][0]  # same Idempotency-Key for the resent batch
+    assert box.pending() == 0
+    box.close()
+
+
+def test_restart_resends_the_failed_batch_unchanged(tmp_path):
+    path = str(tmp_path / "outbox.db")
+    down = FakeClient(down=True)
+    box = outbox.Outbox(path, down, batch=10)
+    box.put(_commands(0, 1))
+    assert box.flush() is False  # the relay may still have committed this batch
+    box.close()
+
+    up = FakeClient()
+    box = outbox.Outbox(path, up, batch=10)
+    box.put(_commands(1, 3))  # appended after the failed send, before it is retried
+    assert box.flush() is True
+    assert [call[1] for call in up.calls] == [[0], [1, 2]]
+    assert up.calls[0][0] == down.calls[0][0]
+    box.close()
+
+
+def test_flusher_backs_off_and_resends_same_batch(tmp_path):
+    client = FakeClient(down=True)
+    box = outbox.Outbox(str(tmp_path / "outbox.db"), client, batch=10, backoff=0.02, max_backoff=0.05).start()
+    box.put(_commands(0, 2))
+    _wait_for(lambda: len(client.calls) >= 2)
+    box.put(_commands(2, 4))  # arrives while the first batch is unacknowledged
+    client.down = False
+    _wait_for(lambda: box.pending() == 0)
+    box.close()
+
+    sent = [call for call in client.calls if call[1] == [0, 1]]
+    assert len({key for key, _ in sent}) == 1
+    assert [cmd["args"]["n"] for cmd in client.accepted] == [0, 1, 2, 3]
+
+
+def test_alert_client_set_goes_through_outbox(tmp_path, monkeypatch):
+    pytest.importorskip("requests")
+    from ovro_alert import alert_client
+
+    session = MagicMock()
+    session.put.return_value.status_code = 200
+    session.put.return_value.text = '"Success"'
+    monkeypatch.setattr(alert_client, "s", session)
+    monkeypatch.setattr(alert_client, "RELAY_KEY", "test-relay-key")
+
+    client = alert_client.AlertClient("ligo", ip="localhost", port="8001", outbox=str(tmp_path / "ligo.db"))
+    assert client.set("observation", args={"GraceID": "S1"}) == 202
+    assert client.set_many([{"command": "test", "args": {"GraceID": "S2"}}]) == 202
+    _wait_for(lambda: client.outbox.pending() == 0)
+    client.outbox.close()
+
+    sent = [cmd for call in session.put.call_args_list for cmd in json.loads(call[1]["data"])]
+    assert [cmd["args"]["GraceID"] for cmd in sent] == ["S1", "S2"]
+    assert all(call[1]["url"] == "http://localhost:8001/bulk" for call in session.put.call_args_list)
+
+
+def test_bad_key_keeps_commands(tmp_path, monkeypatch):
+    pytest.importorskip("requests")
+    from ovro_alert import alert_client
+
+    session = MagicMock()
+    session.put.return_value.status_code = 200
+    session.put.return_value.text = '"Bad key"'
+    monkeypatch.setattr(alert_client, "s", session)
+    monkeypatch.setattr(alert_client, "RELAY_KEY", "wrong-key")
+
+    client = alert_client.AlertClient("ligo", ip="localhost", port="8001")
+    box = outbox.Outbox(str(tmp_path / "ligo.db"), client)
+    box.put(_commands(0, 1))
+    assert box.flush() is False and box.pending() == 1
+    box.close()
+
+
+def test_rejected_batch_is_dead_lettered(tmp_path):
+    client = FakeClient()
+    statuses = [429, 422, 200]
+    client.put_bulk = lambda dd, chunk=500, idempotency_key=None: statuses.pop(0)
+    box = outbox.Outbox(str(tmp_path / "outbox.db"), client, batch=2)
+    box.put(_commands(0, 3))
+    assert box.flush_once() is None and box.pending() == 3  # rate limited: retried
+    assert box.flush_once() == 2 and box.pending() == 1 and box.dead() == 2
+    assert box.flush() is True and box.dead() == 2
+    box.close()
+
+
+def test_close_returns_while_relay_hangs(tmp_path):
+    release = threading.Event()
+    client = FakeClient()
+    client.put_bulk = lambda dd, chunk=500, idempotency_key=None: release.wait(5) and 200
+    box = outbox.Outbox(str(tmp_path / "outbox.db"), client)
+    box.put(_commands(0, 1))
+    start = time.monotonic()
+    box.close(timeout=0.1)
+    assert time.monotonic() - start < 1
+    release.set()
+    _wait_for(lambda: not box._thread.is_alive())
+    box = outbox.Outbox(str(tmp_path / "outbox.db"), FakeClient())
+    assert box.pending() == 0
+    box.close()
+
+
+def test_path_from_env(tmp_path, monkeypatch):
+    monkeypatch.delenv("OVRO_ALERT_OUTBOX_DIR", raising=False)
+    assert outbox.path_from_env("gcn_receiver") is None
+    monkeypatch.setenv("OVRO_ALERT_OUTBOX_DIR", str(tmp_path / "outbox"))
+    assert outbox.path_from_env("gcn_receiver") == str(tmp_path / "outbox" / "gcn_receiver.db")
+    assert (tmp_path / "outbox").is_dir()
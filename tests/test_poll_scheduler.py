@@ -0,0 +1,82 @@
+"""Adaptive poll intervals (ovro_alert.poll_scheduler) and their use in the DSA poll loop."""
+
+import json
+import random
+import time
+
+import pytest
+
+from ovro_alert.poll_scheduler import PollScheduler
+
+
+def test_tightens_on_activity_and_decays_when_idle():
+    scheduler = PollScheduler(min_interval=0.5, max_interval=5, decay=2, jitter=0)
+    assert scheduler.next_delay() == 5
+    scheduler.activity()
+    assert scheduler.next_delay() == 0.5
+    delays = []
+    for _ in range(5):
+        scheduler.idle()
+        delays.append(scheduler.next_delay())
+    assert delays == [1, 2, 4, 5, 5]
+
+
+def test_jitter_spreads_clients():
+    schedulers = [PollScheduler(max_interval=5, jitter=0.1, rng=random.Random(seed)) for seed in range(20)]
+    delays = [scheduler.next_delay() for scheduler in schedulers]
+    assert all(4.5 <= delay <= 5.5 for delay in delays)
+    assert len(set(delays)) == len(delays)
+
+
+def test_hint_is_a_one_shot_floor():
+    scheduler = PollScheduler(min_interval=0.5, max_interval=5, jitter=0)
+    scheduler.activity()
+    scheduler.hint(None)
+    scheduler.hint(3)
+    scheduler.hint(2)
+    assert scheduler.next_delay() == 3
+    assert scheduler.next_delay() == 0.5
+    scheduler.hint(0.1)  # shorter than the interval: no effect
+    assert scheduler.next_delay() == 0.5
+
+
+def test_wait_uses_sleep():
+    slept = []
+    scheduler = PollScheduler(max_interval=2, jitter=0, sleep=slept.append)
+    assert scheduler.wait() == 2 and slept == [2]
+    with pytest.raises(ValueError):
+        PollScheduler(min_interval=3, max_interval=2)
+
+
+def test_dsa_poll_sleeps_after_events_and_honors_retry_after(tmp_path, monkeypatch):
+    pytest.importorskip("slack_sdk")
+    from ovro_alert import dsa_alert_client
+
+    frbs = tmp_path / "frbs.json"
+    frbs.write_text(json.dumps([]))
+    client = dsa_alert_client.DSAAlertClient(str(frbs))
+    client.compare_voevent_with_frbs = lambda dm, ra, dec: []
+
+    event = {"command": "observation", "args": {"dm": 100, "position": "1,2,0.1"}}
+    states = iter([{"command_mjd": 1.0, "command": "test"},  # baseline
+                   {"command_mjd": 1.0, "command": "test"},
+                   dict(event, command_mjd=2.0),
+                   {},  # relay error
+                   dict(event, command_mjd=2.0)])
+    hints = iter([None, None, None, 7.0, None])
+
+    def get():
+        dd = next(states)  # StopIteration ends the poll loop
+        client.retry_after = next(hints)
+        return dd
+
+    slept = []
+    monkeypatch.setattr(time, "sleep", slept.append)
+    monkeypatch.setattr(client, "get", get)
+    with pytest.raises(StopIteration):
+        client.poll(loop=5, min_loop=0.5)
+
+    # idle start, quiet poll, event (tight), relay error (Retry-After 7), quiet.
+    expected = [5, 5, 0.5, 7, 2]
+    assert len(slept) == len(expected)
+    assert all(0.9 * e <= delay <= 1.1 * e for delay, e in zip(slept, expected))
@@ -0,0 +1,118 @@
+"""Archival of old relay commands into monthly partitions."""
+
+import datetime
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("pydantic")
+
+from ovro_alert import relay_archive, relay_db  # noqa: E402
+
+
+def _mjd(year, month, day):
+    return relay_archive._mjd(datetime.datetime(year, month, day))
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(relay_db, "DBPATH", str(tmp_path / "relay.db"))
+    relay_db.create_db()
+    # Two commands per day from 2024-01-01 for 120 days.
+    start = _mjd(2024, 1, 1)
+    for day in range(120):
+        for instrument in ("gcn", "chime"):
+            relay_db.set_command(relay_db.Command(instrument=instrument, command="observation",
+                                                  command_mjd=start + day + 0.25, args={"day": day}))
+    relay_db.flush()
+    yield relay_db
+    relay_db.close()
+
+
+def test_archive_moves_old_rows_by_month(db, tmp_path):
+    archive_dir = str(tmp_path / "archive")
+    now = _mjd(2024, 5, 1)
+    moved = relay_archive.archive_commands(older_than_days=60, archive_dir=archive_dir, now_mjd=now)
+
+    cutoff = now - 60
+    hot = db.get_range()
+    assert moved + len(hot) == 240
+    assert min(row[3] for row in hot) >= cutoff
+    assert sorted(os.listdir(archive_dir)) == ["commands-2024-01.npz", "commands-2024-02.npz",
+                                               "commands-2024-03.npz"]
+    assert relay_archive.archive_commands(older_than_days=60, archive_dir=archive_dir, now_mjd=now) == 0
+
+
+def test_query_merges_hot_and_archive(db, tmp_path):
+    archive_dir = str(tmp_path / "archive")
+    before = db.get_range(instrument="gcn")
+    relay_archive.archive_commands(older_than_days=60, archive_dir=archive_dir, now_mjd=_mjd(2024, 5, 1))
+
+    after = relay_archive.query_commands(instrument="gcn", archive_dir=archive_dir)
+    assert after == before
+
+    window = relay_archive.query_commands(from_mjd=_mjd(2024, 2, 28), to_mjd=_mjd(2024, 3, 3),
+                                          archive_dir=archive_dir)
+    assert [row[3] for row in window] == sorted(row[3] for row in window)
+    assert len(window) == 2 * 4  # Feb 28, Feb 29, Mar 1, Mar 2
+
+
+def test_query_only_opens_overlapping_partitions(db, tmp_path, monkeypatch):
+    archive_dir = str(tmp_path / "archive")
+    relay_archive.archive_commands(older_than_days=60, archive_dir=archive_dir, now_mjd=_mjd(2024, 5, 1))
+    opened = []
+    real_load = relay_archive._load
+    monkeypatch.setattr(relay_archive, "_load", lambda path: opened.append(os.path.basename(path)) or real_load(path))
+
+    relay_archive.query_commands(from_mjd=_mjd(2024, 2, 10), to_mjd=_mjd(2024, 2, 11), archive_dir=archive_dir)
+    assert opened == ["commands-2024-02.npz"]
+
+
+def test_interrupted_archive_is_deduplicated(db, tmp_path):
+    archive_dir = str(tmp_path / "archive")
+    os.makedirs(archive_dir)
+    january = db.get_range(from_mjd=_mjd(2024, 1, 1), to_mjd=_mjd(2024, 2, 1))
+    relay_archive._write_partition(relay_archive._partition_path(archive_dir, datetime.datetime(2024, 1, 1)),
+                                   january)  # partition written, rows not yet deleted
+
+    assert len(relay_archive.query_commands(to_mjd=_mjd(2024, 2, 1), archive_dir=archive_dir)) == 62
+    relay_archive.archive_commands(older_than_days=60, archive_dir=archive_dir, now_mjd=_mjd(2024, 5, 1))
+    part = relay_archive._load(os.path.join(archive_dir, "commands-2024-01.npz"))
+    assert len(part["id"]) == len(set(part["id"].tolist())) == 62
+
+
+def test_ids_of_archived_rows_are_not_reused(tmp_path, monkeypatch):
+    monkeypatch.setattr(relay_db, "DBPATH", str(tmp_path / "relay.db"))
+    relay_db.create_db()
+    try:
+        for n in range(3):
+            relay_db.set_command(relay_db.Command(instrument="gcn", command="observation",
+                                                  command_mjd=59000.0 + n, args={"n": n}))
+        relay_db.flush()
+        archive_dir = str(tmp_path / "archive")
+        assert relay_archive.archive_commands(older_than_days=1, archive_dir=archive_dir, now_mjd=59100.0) == 3
+
+        relay_db.set_command(relay_db.Command(instrument="gcn", command="observation", command_mjd=59200.0,
+                                              args={"n": 3}), wait=True)
+        rows = relay_archive.query_commands(archive_dir=archive_dir)
+        assert [row[3] for row in rows] == [59000.0, 59001.0, 59002.0, 59200.0]
+        assert rows[-1][0] == 4
+    finally:
+        relay_db.close()
+
+
+def test_query_keeps_archived_row_whose_id_was_reused(db, tmp_path):
+    """Databases from before schema 3 could hand an archived row's id to a new row."""
+    archive_dir = str(tmp_path / "archive")
+    relay_archive.archive_commands(older_than_days=60, archive_dir=archive_dir, now_mjd=_mjd(2024, 5, 1))
+    archived = relay_archive.query_commands(to_mjd=_mjd(2024, 1, 2), archive_dir=archive_dir)[0]
+    db.manager().write("INSERT INTO commands (id, instrument, command, command_mjd, args) VALUES (?, ?, ?, ?, ?)",
+                       (archived[0], "ligo", "observation", _mjd(2024, 4, 20), "{}")).wait()
+
+    rows = relay_archive.query_commands(archive_dir=archive_dir)
+    assert archived in rows
+    assert sum(row[0] == archived[0] for row in rows) == 2
+    relay_archive._write_partition(relay_archive._partition_path(archive_dir, datetime.datetime(2024, 1, 1)),
+                                   [archived])
+    assert relay_archive.query_commands(archive_dir=archive_dir) == rows
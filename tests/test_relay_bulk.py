@@ -0,0 +1,77 @@
+"""PUT /bulk and relay_db.set_commands."""
+
+import gc
+import sqlite3
+import time
+
+import pytest
+
+from ovro_alert import relay_db
+
+
+def test_bulk_updates_state_in_order(relay, relay_client, relay_key, command_body):
+    body = [command_body("gcn", 60000.1, n=1), command_body("chime", 60000.2, n=2),
+            command_body("gcn", 60000.3, n=3), command_body("swift", 60000.4, n=4)]
+    responses = relay_client.put("/bulk", params={"key": relay_key}, json=body).json()
+    assert responses == ["Set GCN event: observation with {'n': 1}", "Set CHIME event: observation with {'n': 2}",
+                         "Set GCN event: observation with {'n': 3}", "Set swift event: observation with {'n': 4}"]
+
+    assert [e["args"]["n"] for e in relay._events["gcn"]] == [1, 3]
+    assert relay.dd["gcn"]["command_mjd"] == 60000.3
+    assert relay._seq["chime"] == 1
+    assert "swift" in relay.instruments
+
+    relay_db.flush()
+    assert [c.args["n"] for c in relay_db.get_commands_since("gcn", 0)] == [1, 3]
+
+
+def test_bulk_applies_policies_and_rejects_bad_names(relay, relay_client, relay_key, command_body):
+    body = [command_body("gcn", 60000.1, command="test"), command_body("Bad.Name", 60000.2),
+            command_body("lwa", 60000.3, command="test")]
+    responses = relay_client.put("/bulk", params={"key": relay_key}, json=body).json()
+    assert responses[1] == "Bad instrument name: Bad.Name"
+    relay_db.flush()
+    assert relay_db.get_latest("gcn") is None  # gcn persists observations only
+    assert relay_db.get_latest("lwa").command == "test"
+
+
+def test_bulk_replay_and_limits(relay, relay_client, relay_key, monkeypatch, command_body):
+    body = [command_body("casm", 60000.1), command_body("casm", 60000.2)]
+    headers = {"Idempotency-Key": "burst-1"}
+    first = relay_client.put("/bulk", params={"key": relay_key}, json=body, headers=headers).json()
+    assert relay_client.put("/bulk", params={"key": relay_key}, json=body, headers=headers).json() == first
+    assert relay._seq["casm"] == 2
+
+    monkeypatch.setattr(relay, "MAX_BULK", 1)
+    assert relay_client.put("/bulk", params={"key": relay_key}, json=body).json() == "Too many commands: 2 > 1"
+    assert relay_client.put("/bulk", params={"key": "wrong"}, json=body).json() == "Bad key"
+
+
+def test_set_commands_is_one_transaction(relay):
+    relay_db.create_db()
+    good = relay_db.Command(instrument="gcn", command="observation", command_mjd=1.0, args={})
+    bad = relay_db.Command(instrument="gcn", command="observation", command_mjd=2.0, args={})
+    relay_db.manager().write("CREATE TRIGGER no_two BEFORE INSERT ON commands WHEN NEW.command_mjd = 2.0 "
+                             "BEGIN SELECT RAISE(ABORT, 'no'); END").wait()
+    pending = relay_db.manager().write_many('INSERT INTO commands (instrument, command, command_mjd, args) '
+                                            'VALUES (?, ?, ?, ?)',
+                                            [(c.instrument, c.command, c.command_mjd, "{}") for c in (good, bad)])
+    with pytest.raises(sqlite3.Error):
+        pending.wait()
+    assert relay_db.get_latest("gcn") is None
+
+
+def test_bulk_is_faster_than_single_puts(relay, relay_client, relay_key, command_body):
+    n = 200
+    t0 = time.perf_counter()
+    for i in range(n):
+        relay_client.put("/gcn", params={"key": relay_key}, json=command_body("gcn", 60000.0 + i))
+    single = time.perf_counter() - t0
+
+    gc.collect()  # a full collection inside the ~5 ms bulk PUT would swamp it
+    t0 = time.perf_counter()
+    relay_client.put("/bulk", params={"key": relay_key}, json=[command_body("gcn", 60001.0 + i) for i in range(n)])
+    bulk = time.perf_counter() - t0
+
+    assert relay._seq["gcn"] == 2 * n
+    assert bulk * 5 < single
@@ -0,0 +1,19 @@
+"""Batched multi-route GET /commands."""
+
+
+def test_commands_returns_requested_routes(relay_client, relay_key):
+    body = {"instrument": "chime", "command": "observation", "command_mjd": 60000.5, "args": {"dm": 10}}
+    relay_client.put("/chime", params={"key": relay_key}, json=body)
+
+    dd = relay_client.get("/commands", params={"key": relay_key, "routes": "chime,ligo"}).json()
+    assert set(dd) == {"read_mjd", "chime", "ligo"}
+    assert dd["chime"] == {"command": "observation", "command_mjd": 60000.5, "args": {"dm": 10}}
+    assert dd["ligo"] == {"command": None, "command_mjd": None}
+
+
+def test_commands_unknown_route(relay_client, relay_key):
+    assert "Unknown routes" in relay_client.get("/commands", params={"key": relay_key, "routes": "chime,x"}).json()
+
+
+def test_commands_bad_key(relay_client):
+    assert relay_client.get("/commands", params={"key": "wrong", "routes": "chime"}).json() == "Bad key"
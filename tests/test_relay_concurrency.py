@@ -0,0 +1,124 @@
+"""Parallel PUTs and GETs leave relay state consistent."""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from ovro_alert import relay_db, relay_state
+
+ROUTES = ("dsa", "ligo", "chime", "casm", "gcn")
+PUTS = 40
+WRITERS = 4  # concurrent writers per route in the contention test
+
+
+def test_parallel_put_and_get_stay_consistent(relay, relay_key):
+    httpx = pytest.importorskip("httpx")
+    relay_db.create_db()
+    written = {route: {60000.0 + i / 1000 for i in range(PUTS)} for route in ROUTES}
+    seen = []
+
+    async def writer(client, route):
+        for i in range(PUTS):
+            body = {"instrument": route, "command": "observation", "command_mjd": 60000.0 + i / 1000,
+                    "args": {"i": i}}
+            resp = await client.put(f"/{route}", params={"key": relay_key}, json=body)
+            assert resp.status_code == 200
+
+    async def reader(client, route):
+        for _ in range(PUTS):
+            resp = await client.get(f"/{route}", params={"key": relay_key})
+            seen.append((route, resp.headers["ETag"], resp.json()))
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=relay.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://relay") as client:
+            tasks = [writer(client, route) for route in ROUTES] + [reader(client, route) for route in ROUTES * 2]
+            await asyncio.gather(*tasks)
+
+    asyncio.run(scenario())
+    relay_db.flush()
+
+    for route in ROUTES:
+        events = list(relay._events[route])
+        assert relay._seq[route] == PUTS
+        assert [event["seq"] for event in events] == list(range(1, PUTS + 1))
+        assert [event["args"]["i"] for event in events] == list(range(PUTS))
+        assert relay.dd[route]["args"] == {"i": PUTS - 1}
+        assert len(relay_db.get_commands_since(route, 0, limit=2 * PUTS)) == PUTS
+
+    by_seq = {(route, event["seq"]): event for route in ROUTES for event in relay._events[route]}
+    for route, etag, body in seen:
+        seq = int(etag.rstrip('"').rsplit("-", 1)[1])
+        if seq:
+            # Served body always matches the state its ETag names.
+            assert body["command_mjd"] == by_seq[(route, seq)]["command_mjd"]
+            assert body["command_mjd"] in written[route]
+
+
+def test_concurrent_writers_on_one_route_get_contiguous_seqs(relay, relay_key):
+    httpx = pytest.importorskip("httpx")
+    relay_db.create_db()
+
+    async def writer(client, route, w):
+        for i in range(PUTS // WRITERS):
+            body = {"instrument": route, "command": "observation", "command_mjd": 60000.0 + w + i / 1000,
+                    "args": {"w": w, "i": i}}
+            resp = await client.put(f"/{route}", params={"key": relay_key}, json=body)
+            assert resp.status_code == 200
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=relay.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://relay") as client:
+            await asyncio.gather(*[writer(client, route, w) for route in ROUTES for w in range(WRITERS)])
+
+    asyncio.run(scenario())
+
+    for route in ROUTES:
+        events = list(relay._events[route])
+        assert relay._seq[route] == PUTS
+        assert [event["seq"] for event in events] == list(range(1, PUTS + 1))
+        assert sorted((event["args"]["w"], event["args"]["i"]) for event in events) == \
+            [(w, i) for w in range(WRITERS) for i in range(PUTS // WRITERS)]
+        for w in range(WRITERS):  # each writer's PUTs keep their order
+            assert [event["args"]["i"] for event in events if event["args"]["w"] == w] == list(range(PUTS // WRITERS))
+        assert relay.dd[route] == {key: events[-1][key] for key in ("command", "command_mjd", "args")}
+
+
+class SlowStore(relay_state.MemoryStateStore):
+    """ A store whose writes block, like SQLite waiting on another worker's lock. """
+
+    def __init__(self):
+        super().__init__()
+        self.writing = threading.Event()
+
+    def set(self, instrument, state):
+        self.writing.set()
+        time.sleep(0.5)
+        return super().set(instrument, state)
+
+
+def test_store_io_does_not_block_event_loop(relay, relay_key, monkeypatch):
+    httpx = pytest.importorskip("httpx")
+    relay_db.create_db()
+    store = SlowStore()
+    monkeypatch.setattr(relay, "store", store)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=relay.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://relay") as client:
+            body = {"instrument": "chime", "command": "observation", "command_mjd": 60000.1, "args": {}}
+            put = asyncio.ensure_future(client.put("/chime", params={"key": relay_key}, json=body))
+            while not store.writing.is_set():
+                await asyncio.sleep(0.005)
+            t0 = time.perf_counter()
+            resp = await client.get("/chime/events", params={"key": relay_key})  # takes _lock on the loop
+            elapsed = time.perf_counter() - t0
+            await put
+            return resp, elapsed
+
+    resp, elapsed = asyncio.run(scenario())
+    assert resp.json()["events"] == []
+    assert elapsed < 0.25
+    assert relay._seq["chime"] == 1
@@ -0,0 +1,170 @@
+"""relay_db: connection manager, schema migration and queries."""
+
+import json
+import sqlite3
+import threading
+
+import pytest
+
+pytest.importorskip("pydantic")
+
+from ovro_alert import relay_db  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(relay_db, "DBPATH", str(tmp_path / "relay.db"))
+    relay_db.create_db()
+    yield relay_db
+    relay_db.close()
+
+
+def _command(instrument, mjd, **args):
+    return relay_db.Command(instrument=instrument, command="observation", command_mjd=mjd, args=args)
+
+
+def test_wal_mode(db):
+    mode = db.manager().reader().execute("PRAGMA journal_mode").fetchone()[0]
+    assert mode == "wal"
+
+
+def test_set_is_visible_after_flush(db):
+    db.set_command(_command("chime", 60000.5, dm=10.0))
+    db.flush()
+    assert db.get_command("chime").args == {"dm": 10.0}
+
+
+def test_set_wait_commits(db):
+    db.set_command(_command("gcn", 60000.5), wait=True)
+    assert db.get_command("gcn").command_mjd == 60000.5
+
+
+def test_concurrent_writes_and_reads(db):
+    def write(i):
+        for j in range(50):
+            db.set_command(_command(f"inst{i}", 60000 + j))
+
+    readers_ok = []
+
+    def read():
+        for _ in range(20):
+            db.get_commands()
+        readers_ok.append(db.manager().reader())
+
+    threads = [threading.Thread(target=write, args=(i,)) for i in range(4)]
+    threads += [threading.Thread(target=read) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    db.flush()
+
+    assert len(db.get_commands()) == 200
+    assert len({id(conn) for conn in readers_ok}) == 3
+
+
+def test_bad_write_does_not_drop_batch(db):
+    manager = db.manager()
+    good = manager.write("INSERT INTO commands (instrument, command, command_mjd, args) VALUES ('a', 'x', 1, '{}')")
+    bad = manager.write("INSERT INTO nope VALUES (1)")
+    manager.flush()
+    good.wait()
+    with pytest.raises(Exception):
+        bad.wait()
+    assert db.get_command("a") is not None
+
+
+def test_manager_follows_dbpath(db, tmp_path, monkeypatch):
+    first = db.manager()
+    monkeypatch.setattr(db, "DBPATH", str(tmp_path / "other.db"))
+    assert db.manager() is not first
+
+
+def test_get_latest_returns_newest(db):
+    for mjd in (60000.2, 60000.9, 60000.5):
+        db.set_command(_command("ligo", mjd))
+    db.flush()
+    assert db.get_latest("ligo").command_mjd == 60000.9
+    assert db.get_command("ligo").command_mjd == 60000.9
+    assert db.get_latest("nope") is None
+
+
+def test_get_latest_uses_index(db):
+    plan = db.manager().reader().execute(
+        "EXPLAIN QUERY PLAN SELECT instrument, command, command_mjd, args FROM commands "
+        "WHERE instrument = ? ORDER BY command_mjd DESC, id DESC LIMIT 1", ("ligo",)).fetchall()
+    detail = " ".join(row[-1] for row in plan)
+    assert "idx_commands_instrument_mjd" in detail
+    assert "TEMP B-TREE" not in detail
+
+
+def test_args_round_trip_as_json(db):
+    db.set_command(_command("gcn", 60000.5, position="1,2,3", nested={"a": [1, 2]}, flag=True))
+    db.flush()
+    stored = db.manager().reader().execute("SELECT args FROM commands").fetchone()[0]
+    assert json.loads(stored)["flag"] is True
+    assert db.get_latest("gcn").args["nested"] == {"a": [1, 2]}
+
+
+def test_migrates_legacy_repr_args(tmp_path, monkeypatch):
+    path = tmp_path / "legacy.db"
+    conn = sqlite3.connect(str(path))
+    conn.execute("CREATE TABLE commands (id INTEGER PRIMARY KEY, instrument TEXT, command TEXT, "
+                 "command_mjd REAL, args TEXT)")
+    rows = [("chime", "observation", 60000.0 + i, str({"dm": float(i), "known": i % 2 == 0})) for i in range(25)]
+    rows.append(("gcn", "observation", 60001.0, "{'when': datetime(2024, 1, 1)}"))
+    conn.executemany("INSERT INTO commands (instrument, command, command_mjd, args) VALUES (?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+    monkeypatch.setattr(relay_db, "DBPATH", str(path))
+    monkeypatch.setattr(relay_db, "MIGRATION_CHUNK", 7)
+    relay_db.create_db()
+    try:
+        latest = relay_db.get_latest("chime")
+        assert latest.args == {"dm": 24.0, "known": True}
+        assert relay_db.get_latest("gcn").args == {"raw": "{'when': datetime(2024, 1, 1)}"}
+        reader = relay_db.manager().reader()
+        assert reader.execute("PRAGMA user_version").fetchone()[0] == relay_db.SCHEMA_VERSION
+        sql = reader.execute("SELECT sql FROM sqlite_master WHERE name = 'commands'").fetchone()[0]
+        assert "AUTOINCREMENT" in sql
+        assert reader.execute("SELECT COUNT(*) FROM commands").fetchone()[0] == 26
+        for (args,) in reader.execute("SELECT args FROM commands"):
+            json.loads(args)
+    finally:
+        relay_db.close()
+
+
+def test_interrupted_autoincrement_migration_resumes(tmp_path, monkeypatch):
+    path = tmp_path / "v2.db"
+    conn = sqlite3.connect(str(path))
+    conn.execute("CREATE TABLE commands (id INTEGER PRIMARY KEY, instrument TEXT, command TEXT, "
+                 "command_mjd REAL, args TEXT)")
+    conn.executemany("INSERT INTO commands (id, instrument, command, command_mjd, args) VALUES (?, 'gcn', "
+                     "'observation', ?, '{}')", [(2 * i + 1, 60000.0 + i) for i in range(20)])
+    conn.execute("CREATE TABLE commands_v3 (id INTEGER PRIMARY KEY AUTOINCREMENT, instrument TEXT, "
+                 "command TEXT, command_mjd REAL, args TEXT)")
+    conn.execute("INSERT INTO commands_v3 SELECT * FROM commands WHERE id <= 13")  # first chunks, then killed
+    conn.execute("PRAGMA user_version = 2")
+    conn.commit()
+    conn.close()
+
+    monkeypatch.setattr(relay_db, "DBPATH", str(path))
+    monkeypatch.setattr(relay_db, "MIGRATION_CHUNK", 3)
+    relay_db.create_db()
+    try:
+        reader = relay_db.manager().reader()
+        assert [row[0] for row in reader.execute("SELECT id FROM commands ORDER BY id")] == \
+            [2 * i + 1 for i in range(20)]
+        names = [row[0] for row in reader.execute("SELECT name FROM sqlite_master")]
+        assert "commands_v3" not in names and "idx_commands_mjd" in names
+        relay_db.set_command(_command("gcn", 60100.0), wait=True)
+        assert reader.execute("SELECT MAX(id) FROM commands").fetchone()[0] == 40
+    finally:
+        relay_db.close()
+
+
+def test_reset_table_keeps_index(db):
+    db.reset_table()
+    names = [row[0] for row in db.manager().reader().execute("SELECT name FROM sqlite_master WHERE type='index'")]
+    assert "idx_commands_instrument_mjd" in names
@@ -0,0 +1,34 @@
+"""Cached GET bodies with ETag / If-None-Match."""
+
+
+def test_get_returns_etag_and_304(relay_client, relay_key, put_command):
+    put_command("chime", 60000.5)
+    resp = relay_client.get("/chime", params={"key": relay_key})
+    assert resp.status_code == 200
+    etag = resp.headers["etag"]
+    assert resp.json()["command_mjd"] == 60000.5
+    assert isinstance(resp.json()["read_mjd"], float)
+
+    resp = relay_client.get("/chime", params={"key": relay_key}, headers={"If-None-Match": etag})
+    assert resp.status_code == 304
+    assert resp.content == b""
+
+
+def test_etag_changes_on_put(relay_client, relay_key, put_command):
+    etag = relay_client.get("/ligo", params={"key": relay_key}).headers["etag"]
+    put_command("ligo", 60000.5, dm=1.5)
+    resp = relay_client.get("/ligo", params={"key": relay_key}, headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+    assert resp.headers["etag"] != etag
+    assert resp.json()["args"] == {"dm": 1.5}
+
+
+def test_commands_etag(relay_client, relay_key, put_command):
+    params = {"key": relay_key, "routes": "chime,gcn"}
+    resp = relay_client.get("/commands", params=params)
+    etag = resp.headers["etag"]
+    assert relay_client.get("/commands", params=params, headers={"If-None-Match": etag}).status_code == 304
+    put_command("gcn", 60000.5)
+    resp = relay_client.get("/commands", params=params, headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+    assert resp.json()["gcn"]["command_mjd"] == 60000.5
@@ -0,0 +1,54 @@
+"""Cursor-based event log (/{instrument}/events)."""
+
+
+def _events(client, key, route, **params):
+    params["key"] = key
+    return client.get(f"/{route}/events", params=params).json()
+
+
+def test_burst_is_not_overwritten(relay_client, relay_key, put_command):
+    for mjd in (60000.1, 60000.2, 60000.3):
+        put_command("gcn", mjd)
+
+    page = _events(relay_client, relay_key, "gcn")
+    assert page["last_seq"] == 3
+    assert page["gap"] is False
+    assert [(e["seq"], e["command_mjd"]) for e in page["events"]] == [(1, 60000.1), (2, 60000.2), (3, 60000.3)]
+
+    page = _events(relay_client, relay_key, "gcn", after=2)
+    assert [e["seq"] for e in page["events"]] == [3]
+    assert _events(relay_client, relay_key, "gcn", after=3)["events"] == []
+
+
+def test_limit_pages(relay_client, relay_key, put_command):
+    for mjd in (60000.1, 60000.2, 60000.3):
+        put_command("chime", mjd)
+    page = _events(relay_client, relay_key, "chime", after=0, limit=2)
+    assert [e["seq"] for e in page["events"]] == [1, 2]
+
+
+def test_falls_back_to_db_when_buffer_overrun(relay, relay_client, relay_key, monkeypatch, put_command):
+    for instrument in relay._events:
+        monkeypatch.setitem(relay._events, instrument, relay.deque(maxlen=2))
+    for mjd in (60000.1, 60000.2, 60000.3, 60000.4):
+        put_command("ligo", mjd)
+
+    relay.relay_db.flush()
+    page = _events(relay_client, relay_key, "ligo", after=1)
+    assert page["gap"] is True
+    assert [e["seq"] for e in page["events"]] == [3, 4]
+
+    page = _events(relay_client, relay_key, "ligo", after=1, after_mjd=60000.1)
+    assert page["gap"] is False
+    assert [(e["seq"], e["command_mjd"]) for e in page["events"]] == [
+        (None, 60000.2), (3, 60000.3), (4, 60000.4)]
+
+
+def test_cursor_from_before_restart(relay_client, relay_key, put_command):
+    put_command("casm", 60000.1)
+    page = _events(relay_client, relay_key, "casm", after=50, after_mjd=60000.0)
+    assert [(e["seq"], e["command_mjd"]) for e in page["events"]][-1] == (1, 60000.1)
+
+
+def test_unknown_route(relay_client, relay_key):
+    assert "Unknown route" in _events(relay_client, relay_key, "nope")
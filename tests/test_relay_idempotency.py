@@ -0,0 +1,128 @@
+"""Replayed PUTs (Idempotency-Key header, or identical body) apply only once."""
+
+import asyncio
+from unittest.mock import MagicMock
+
+from ovro_alert import relay_db
+
+
+def test_replay_with_same_key_has_no_side_effects(relay, relay_client, relay_key, monkeypatch, command_body):
+    slack = MagicMock()
+    monkeypatch.setattr(relay, "cl", object())
+    monkeypatch.setattr(relay, "slack", slack)
+    headers = {"Idempotency-Key": "abc"}
+
+    first = relay_client.put("/chime", params={"key": relay_key}, json=command_body("chime", 60000.1), headers=headers)
+    replay = relay_client.put("/chime", params={"key": relay_key}, json=command_body("chime", 60000.1), headers=headers)
+
+    assert replay.status_code == 200
+    assert replay.json() == first.json()
+    assert relay._seq["chime"] == 1
+    assert slack.post.call_count == 1
+    relay_db.flush()
+    assert len(relay_db.get_commands_since("chime", 0)) == 1
+
+
+def test_same_key_on_other_instrument_is_independent(relay, relay_client, relay_key, command_body):
+    headers = {"Idempotency-Key": "abc"}
+    relay_client.put("/chime", params={"key": relay_key}, json=command_body("chime", 60000.1), headers=headers)
+    relay_client.put("/casm", params={"key": relay_key}, json=command_body("casm", 60000.1), headers=headers)
+    assert relay._seq["chime"] == relay._seq["casm"] == 1
+
+
+def test_identical_body_without_key_is_deduplicated(relay, relay_client, relay_key, command_body):
+    for _ in range(3):
+        relay_client.put("/gcn", params={"key": relay_key}, json=command_body("gcn", 60000.2))
+    relay_client.put("/gcn", params={"key": relay_key}, json=command_body("gcn", 60000.3))
+    assert relay._seq["gcn"] == 2
+
+
+def test_bad_key_is_not_cached(relay, relay_client, relay_key, command_body):
+    assert relay_client.put("/lwa", params={"key": "wrong"}, json=command_body("lwa", 60000.4)).json() == "Bad key"
+    relay_client.put("/lwa", params={"key": relay_key}, json=command_body("lwa", 60000.4))
+    assert relay._seq["lwa"] == 1
+
+
+def test_in_flight_duplicate_waits_for_original(relay, relay_key, monkeypatch, command_body):
+    calls = []
+    update = relay._update
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def slow_update(instrument, command):
+            calls.append(instrument)
+            await release.wait()
+            await update(instrument, command)
+
+        monkeypatch.setattr(relay, "_update", slow_update)
+        command = relay_db.Command(**command_body("casm", 60000.5))
+        first = asyncio.ensure_future(relay.set_instrument("casm", command, relay_key, "k1"))
+        second = asyncio.ensure_future(relay.set_instrument("casm", command, relay_key, "k1"))
+        await asyncio.sleep(0.05)
+        assert not second.done()
+        release.set()
+        return await asyncio.wait_for(asyncio.gather(first, second), 5)
+
+    results = asyncio.run(scenario())
+    assert calls == ["casm"]
+    assert results[0] == results[1]
+    assert relay._seq["casm"] == 1
+
+
+def test_cache_is_bounded(relay, relay_client, relay_key, monkeypatch, command_body):
+    monkeypatch.setattr(relay, "IDEMPOTENCY_CACHE_SIZE", 2)
+    for i in range(4):
+        relay_client.put("/ligo", params={"key": relay_key}, json=command_body("ligo", 60000.0 + i))
+    assert len(relay._idempotency) == 2
+
+
+def test_duplicate_of_failed_original_runs_the_put(relay, relay_key, monkeypatch, command_body):
+    calls = []
+    update = relay._update
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def flaky_update(instrument, command):
+            calls.append(instrument)
+            if len(calls) == 1:
+                await release.wait()
+                raise RuntimeError("boom")
+            await update(instrument, command)
+
+        monkeypatch.setattr(relay, "_update", flaky_update)
+        command = relay_db.Command(**command_body("gcn", 60000.6))
+        first = asyncio.ensure_future(relay.set_instrument("gcn", command, relay_key, "k2"))
+        second = asyncio.ensure_future(relay.set_instrument("gcn", command, relay_key, "k2"))
+        await asyncio.sleep(0.05)
+        release.set()
+        return await asyncio.wait_for(asyncio.gather(first, second, return_exceptions=True), 5)
+
+    first, second = asyncio.run(scenario())
+    assert isinstance(first, RuntimeError)
+    assert second == "Set GCN event: observation with {}"
+    assert calls == ["gcn", "gcn"]
+    assert relay._seq["gcn"] == 1
+
+
+def test_duplicate_of_stuck_original_gets_503(relay, relay_key, monkeypatch, command_body):
+    monkeypatch.setattr(relay, "IDEMPOTENCY_WAIT", 0.05)
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def stuck_update(instrument, command):
+            await release.wait()
+
+        monkeypatch.setattr(relay, "_update", stuck_update)
+        command = relay_db.Command(**command_body("dsa", 60000.7))
+        first = asyncio.ensure_future(relay.set_instrument("dsa", command, relay_key, "k3"))
+        await asyncio.sleep(0.01)
+        second = await relay.set_instrument("dsa", command, relay_key, "k3")
+        release.set()
+        await first
+        return second
+
+    resp = asyncio.run(scenario())
+    assert resp.status_code == 503 and resp.headers["Retry-After"] == "1"
@@ -0,0 +1,96 @@
+"""Registry-driven /{instrument} routes: auto-registration, admin PUT and per-instrument policies."""
+
+from unittest.mock import MagicMock
+
+from ovro_alert import relay_db
+
+
+def test_unknown_instrument_is_registered_on_first_put(relay, relay_client, relay_key, put_command):
+    assert relay_client.get("/einstein_probe", params={"key": relay_key}).json() == "Unknown route: einstein_probe"
+    assert put_command("einstein_probe", id=1) == \
+        "Set einstein_probe event: observation with {'id': 1}"
+
+    assert relay_client.get("/einstein_probe", params={"key": relay_key}).json()["args"] == {"id": 1}
+    names = [i["name"] for i in relay_client.get("/instruments", params={"key": relay_key}).json()]
+    assert "einstein_probe" in names
+    relay_db.flush()
+    assert relay_db.get_latest("einstein_probe").args == {"id": 1}
+
+
+def test_admin_put_sets_policy(relay, relay_client, relay_key, put_command):
+    policy = {"name": "swift", "persist": "none", "slack_channel": None, "response": "Set Swift alert"}
+    assert relay_client.put("/instruments", params={"key": relay_key}, json=policy).json() == "Registered instrument swift"
+    assert put_command("swift") == "Set Swift alert: observation with {}"
+    relay_db.flush()
+    assert relay_db.get_latest("swift") is None
+
+    policy["persist"] = "all"
+    assert relay_client.put("/instruments", params={"key": relay_key}, json=policy).json() == "Updated instrument swift"
+    put_command("swift", command="test")
+    relay_db.flush()
+    assert relay_db.get_latest("swift").command == "test"
+
+
+def test_bad_and_reserved_names_are_rejected(relay, relay_client, relay_key, put_command):
+    bad = {"name": "history", "persist": "none"}
+    assert relay_client.put("/instruments", params={"key": relay_key}, json=bad).json() == "Reserved route: history"
+    bad = {"name": "x", "persist": "sometimes"}
+    assert relay_client.put("/instruments", params={"key": relay_key}, json=bad).json() == "Bad persist policy: sometimes"
+    assert put_command("Bad.Name") == "Bad instrument name: Bad.Name"
+    assert "Bad.Name" not in relay.instruments
+    assert relay_client.put("/instruments", params={"key": "wrong"}, json=bad).json() == "Bad key"
+
+
+def test_default_slack_messages(relay, relay_client, relay_key, monkeypatch, put_command):
+    slack = MagicMock()
+    monkeypatch.setattr(relay, "cl", object())
+    monkeypatch.setattr(relay, "slack", slack)
+
+    put_command("dsa", trigname="240101aaab")
+    put_command("chime", dm=300)
+    put_command("lwa")
+    put_command("fermi", trigger=7)
+    put_command("casm", command="test")
+
+    assert [c.args for c in slack.post.call_args_list] == [
+        ("#alert-driven-astro", "DSA-110 event 240101aaab received"),
+        ("#alert-driven-astro", "CHIME/FRB event received: {'dm': 300}"),
+    ]  # fermi was auto-registered without a Slack channel
+
+    policy = {"name": "fermi", "slack_channel": "#alert-driven-astro"}
+    assert relay_client.put("/instruments", params={"key": relay_key}, json=policy).json() == "Updated instrument fermi"
+    put_command("fermi", trigger=8)
+    assert slack.post.call_args_list[-1].args == ("#alert-driven-astro", "fermi event with args: {'trigger': 8}")
+
+
+def test_bad_slack_messages(relay, relay_client, relay_key, monkeypatch, put_command):
+    slack = MagicMock()
+    monkeypatch.setattr(relay, "cl", object())
+    monkeypatch.setattr(relay, "slack", slack)
+
+    for message in ["{args.foo}", "{0}", "{args[dm]}", "{dm"]:
+        policy = {"name": "swift", "slack_channel": "#alerts", "slack_message": message}
+        assert relay_client.put("/instruments", params={"key": relay_key}, json=policy).json().startswith(
+            "Bad Slack message")
+    assert "swift" not in relay.instruments
+
+    policy = {"name": "swift", "slack_channel": "#alerts", "slack_message": "Swift {dm:.1f}"}
+    assert relay_client.put("/instruments", params={"key": relay_key}, json=policy).json() == "Registered instrument swift"
+    assert put_command("swift", dm="high") == "Set swift event: observation with {'dm': 'high'}"
+    assert slack.post.call_args.args == ("#alerts", "swift event with args: {'dm': 'high'}")
+
+    relay.instruments["swift"].slack_message = "Swift {dm.foo}"  # set before validation existed
+    put_command("swift", dm=5)
+    assert slack.post.call_args.args == ("#alerts", "swift event with args: {'dm': 5}")
+
+
+def test_restart_restores_registered_instruments(relay, relay_key):
+    from fastapi.testclient import TestClient
+
+    relay_db.create_db()
+    relay_db.set_command(relay_db.Command(instrument="maxi", command="observation", command_mjd=60000.1,
+                                          args={"n": 1}), wait=True)
+    relay_db.close()
+
+    with TestClient(relay.app) as client:
+        assert client.get("/maxi", params={"key": relay_key}).json()["args"] == {"n": 1}
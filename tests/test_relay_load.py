@@ -0,0 +1,27 @@
+"""Short run of the relay load-test harness (benchmarks/relay_load.py) as a regression check."""
+
+import pytest
+
+# A one-second run on a shared CI machine: looser than benchmarks.relay_load.THRESHOLDS.
+SMOKE_THRESHOLDS = {"get_rps": 50.0, "put_rps": 5.0, "get_p99_ms": 1000.0, "put_p99_ms": 2000.0, "errors": 0}
+
+
+def test_load_harness_smoke(relay, tmp_path):
+    pytest.importorskip("uvicorn")
+    pytest.importorskip("requests")
+    from benchmarks import relay_load
+
+    report = relay_load.run(pollers=4, producers=1, duration=1.0, burst=5, burst_interval=0.1,
+                            dbpath=str(tmp_path / "bench.db"))
+    assert report["gets"] > 0 and report["puts"] > 0
+    assert report["db_rows_added"] == report["puts"]
+    assert report["db_bytes_added"] > 0
+    assert relay_load.check(report, SMOKE_THRESHOLDS) == []
+
+
+def test_check_reports_failures():
+    from benchmarks import relay_load
+
+    report = {"get_rps": 10.0, "put_rps": 100.0, "get_p99_ms": 5.0, "put_p99_ms": 900.0, "errors": 1}
+    assert relay_load.check(report, {"get_rps": 20.0, "put_rps": 20.0, "put_p99_ms": 500.0, "errors": 0}) == [
+        "get_rps 10.0 < 20.0", "put_p99_ms 900.0 > 500.0", "errors 1 > 0"]
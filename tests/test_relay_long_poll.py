@@ -0,0 +1,52 @@
+"""Long-poll (since_mjd/wait) behaviour of the relay GET routes."""
+
+import threading
+import time
+
+
+def test_get_without_since_returns_immediately(relay_client, relay_key, put_command):
+    put_command("chime", 60000.5)
+    t0 = time.monotonic()
+    resp = relay_client.get("/chime", params={"key": relay_key, "wait": 5})
+    assert time.monotonic() - t0 < 1
+    assert resp.json()["command_mjd"] == 60000.5
+
+
+def test_get_returns_immediately_when_already_changed(relay_client, relay_key, put_command):
+    put_command("gcn", 60000.5)
+    t0 = time.monotonic()
+    resp = relay_client.get("/gcn", params={"key": relay_key, "since_mjd": 59999.0, "wait": 5})
+    assert time.monotonic() - t0 < 1
+    assert resp.json()["command_mjd"] == 60000.5
+
+
+def test_get_times_out_without_change(relay_client, relay_key, put_command):
+    put_command("ligo", 60000.5)
+    t0 = time.monotonic()
+    resp = relay_client.get("/ligo", params={"key": relay_key, "since_mjd": 60000.5, "wait": 0.3})
+    assert time.monotonic() - t0 >= 0.3
+    assert resp.json()["command_mjd"] == 60000.5
+
+
+def test_get_wakes_on_put(relay_client, relay_key, put_command):
+    put_command("casm", 60000.5)
+    result = {}
+
+    def poll():
+        t0 = time.monotonic()
+        resp = relay_client.get("/casm", params={"key": relay_key, "since_mjd": 60000.5, "wait": 10})
+        result["elapsed"] = time.monotonic() - t0
+        result["body"] = resp.json()
+
+    thread = threading.Thread(target=poll)
+    thread.start()
+    time.sleep(0.2)
+    put_command("casm", 60000.75, command="test")
+    thread.join(timeout=10)
+
+    assert result["body"]["command_mjd"] == 60000.75
+    assert result["elapsed"] < 5
+
+
+def test_get_bad_key(relay_client):
+    assert relay_client.get("/dsa", params={"key": "wrong"}).json() == "Bad key"
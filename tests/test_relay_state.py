@@ -0,0 +1,219 @@
+"""State stores behind the relay (relay_state) and syncing between relay workers."""
+
+import asyncio
+import subprocess
+import sys
+import time
+import uuid
+
+import pytest
+
+from ovro_alert import relay_state
+
+
+@pytest.fixture(params=["memory", "sqlite", "shm"])
+def stores(request, tmp_path):
+    """Two handles on one store, standing in for two relay workers."""
+    if request.param == "memory":
+        store = relay_state.MemoryStateStore()
+        yield store, store
+    elif request.param == "sqlite":
+        path = str(tmp_path / "state.db")
+        a, b = relay_state.SQLiteStateStore(path), relay_state.SQLiteStateStore(path)
+        yield a, b
+        a.close()
+        b.close()
+    else:
+        pytest.importorskip("fcntl")
+        name = f"ovro_test_{uuid.uuid4().hex[:8]}"
+        lock_path = str(tmp_path / "state.lock")
+        a = relay_state.SharedMemoryStateStore(name, slots=8, slot_size=256, lock_path=lock_path)
+        b = relay_state.SharedMemoryStateStore(name, slots=8, slot_size=256, lock_path=lock_path)
+        yield a, b
+        b.close()
+        a.unlink()
+        a.close()
+
+
+def _state(mjd):
+    return {"command": "observation", "command_mjd": mjd, "args": {"dm": 10.0}}
+
+
+def test_set_is_visible_to_other_worker(stores):
+    a, b = stores
+    version = b.version()
+    assert a.set("chime", _state(60000.1)) == 1
+    assert a.set("chime", _state(60000.2)) == 2
+    assert b.version() != version
+    assert b.snapshot() == {"chime": (2, _state(60000.2))}
+    assert b.set("chime", _state(60000.3)) == 3
+    assert a.id == b.id
+
+
+def test_restore_only_fills_empty(stores):
+    a, b = stores
+    assert a.restore("gcn", _state(60000.1))
+    assert not b.restore("gcn", _state(60000.9))
+    assert b.snapshot()["gcn"] == (0, _state(60000.1))
+    assert b.set("gcn", _state(60000.2)) == 1
+
+
+def test_idempotency_keys_are_shared(stores):
+    a, b = stores
+    if a.keys is None:
+        pytest.skip("in-process store keeps idempotency keys in the relay")
+    assert a.keys.claim('["chime", "k1"]') == (True, None)
+    assert b.keys.claim('["chime", "k1"]') == (False, None)  # pending on the other worker
+    a.keys.finish('["chime", "k1"]', "Set CHIME event")
+    assert b.keys.claim('["chime", "k1"]') == (False, "Set CHIME event")
+
+    assert b.keys.claim('["casm", "k2"]') == (True, None)
+    b.keys.release('["casm", "k2"]')  # failed PUT: a retry runs it again
+    assert a.keys.claim('["casm", "k2"]') == (True, None)
+    assert b.keys.claim('["casm", "k2"]', now=time.time() + 120) == (True, None)  # stale claim taken over
+
+
+def test_shm_spills_what_does_not_fit(tmp_path):
+    pytest.importorskip("fcntl")
+    name = f"ovro_test_{uuid.uuid4().hex[:8]}"
+    lock_path = str(tmp_path / "state.lock")
+    store = relay_state.SharedMemoryStateStore(name, slots=2, slot_size=96, lock_path=lock_path)
+    other = relay_state.SharedMemoryStateStore(name, slots=2, slot_size=96, lock_path=lock_path)
+    try:
+        big = {"command": "observation", "command_mjd": 1.0, "args": {"note": "x" * 100}}
+        assert store.set("lwa", big) == 1
+        assert store.set("dsa", _state(1.0)) == 1
+        assert store.set("casm", _state(1.0)) == 1  # no slot left
+        assert store.set("lwa", _state(2.0)) == 2  # fits again
+        assert store.set("casm", big) == 2
+        version = other.version()
+        assert other.set("dsa", big) == 2
+
+        assert store.version() != version
+        assert store.snapshot() == {"lwa": (2, _state(2.0)), "dsa": (2, big), "casm": (2, big)}
+        assert not other.restore("casm", _state(0.5))
+    finally:
+        other.close()
+        store.unlink()
+        store.close()
+
+
+def test_shm_shared_across_processes(tmp_path):
+    pytest.importorskip("fcntl")
+    name = f"ovro_test_{uuid.uuid4().hex[:8]}"
+    lock_path = str(tmp_path / "state.lock")
+    store = relay_state.SharedMemoryStateStore(name, lock_path=lock_path)
+    try:
+        code = ("from ovro_alert import relay_state; "
+                f"s = relay_state.SharedMemoryStateStore({name!r}, lock_path={lock_path!r}); "
+                "s.set('ligo', {'command': 'observation', 'command_mjd': 60000.5, 'args': {}}); s.close()")
+        subprocess.run([sys.executable, "-c", code], check=True, timeout=60)
+        assert store.snapshot()["ligo"][1]["command_mjd"] == 60000.5
+    finally:
+        store.unlink()
+        store.close()
+
+
+def test_relay_sees_put_from_other_worker(relay, relay_key, tmp_path, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    path = str(tmp_path / "state.db")
+    monkeypatch.setattr(relay, "store", relay_state.SQLiteStateStore(path))
+    for instrument in relay.dd:
+        relay._cache[instrument] = relay._render(instrument)
+    other = relay_state.SQLiteStateStore(path)
+
+    with TestClient(relay.app) as client:
+        other.set("casm", _state(60000.7))
+        assert client.get("/casm", params={"key": relay_key}).json()["command_mjd"] == 60000.7
+        assert relay._seq["casm"] == 1
+        page = client.get("/casm/events", params={"key": relay_key}).json()
+        assert [e["command_mjd"] for e in page["events"]] == [60000.7]
+
+        other.set("casm", _state(60000.8))
+        other.set("casm", _state(60000.9))
+        page = client.get("/casm/events", params={"key": relay_key, "after": 1}).json()
+        assert page["gap"] is True  # 60000.8 was never seen by this worker
+    other.close()
+
+
+def test_long_poll_wakes_for_other_worker(relay, tmp_path, monkeypatch):
+    path = str(tmp_path / "state.db")
+    monkeypatch.setattr(relay, "store", relay_state.SQLiteStateStore(path))
+    monkeypatch.setattr(relay, "STATE_POLL_INTERVAL", 0.01)
+    other = relay_state.SQLiteStateStore(path)
+    other.set("dsa", _state(60000.9))
+    relay._sync_state()
+
+    async def scenario():
+        watcher = asyncio.get_running_loop().create_task(relay._watch_state())
+        try:
+            poll = asyncio.ensure_future(relay._wait_for_change("dsa", 60000.9, 5))
+            await asyncio.sleep(0.05)
+            assert not poll.done()
+            other.set("dsa", _state(60001.0))
+            await asyncio.wait_for(poll, 2)
+        finally:
+            watcher.cancel()
+
+    asyncio.run(scenario())
+    assert relay.dd["dsa"]["command_mjd"] == 60001.0
+    other.close()
+
+
+def test_replay_on_other_worker_is_applied_once(relay, relay_key, tmp_path, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    from ovro_alert import relay_db
+
+    path = str(tmp_path / "state.db")
+    workers = [relay_state.SQLiteStateStore(path), relay_state.SQLiteStateStore(path)]
+    body = {"instrument": "gcn", "command": "observation", "command_mjd": 60000.4, "args": {"id": 1}}
+    headers = {"Idempotency-Key": "retry-1"}
+
+    responses = []
+    with TestClient(relay.app) as client:
+        for store in workers:  # the urllib3 retry lands on the second worker
+            monkeypatch.setattr(relay, "store", store)
+            monkeypatch.setattr(relay, "_idempotency", relay.OrderedDict())  # nothing shared in process
+            responses.append(client.put("/gcn", params={"key": relay_key}, json=body, headers=headers).json())
+        bulk = [dict(body, command_mjd=60000.5)]
+        for store in workers:
+            monkeypatch.setattr(relay, "store", store)
+            monkeypatch.setattr(relay, "_idempotency", relay.OrderedDict())
+            responses.append(client.put("/bulk", params={"key": relay_key}, json=bulk, headers=headers).json())
+
+    assert responses[0] == responses[1] and responses[2] == responses[3]
+    assert workers[0].snapshot()["gcn"][0] == 2
+    relay_db.flush()
+    assert [c.command_mjd for c in relay_db.get_commands_since("gcn", 0)] == [60000.4, 60000.5]
+    for store in workers:
+        store.close()
+
+
+def test_replay_of_failed_put_on_other_worker_runs_it(relay, relay_key, tmp_path, monkeypatch):
+    from ovro_alert import relay_db
+
+    path = str(tmp_path / "state.db")
+    monkeypatch.setattr(relay, "store", relay_state.SQLiteStateStore(path))
+    other = relay_state.SQLiteStateStore(path)
+    token = '["chime", "retry-2"]'
+    assert other.keys.claim(token) == (True, None)  # original PUT in flight on the other worker
+    command = relay_db.Command(instrument="chime", command="observation", command_mjd=60000.6, args={"dm": 1.0})
+
+    async def scenario():
+        replay = asyncio.ensure_future(relay.set_instrument("chime", command, relay_key, "retry-2"))
+        await asyncio.sleep(0.1)
+        assert not replay.done()
+        other.keys.release(token)  # original failed
+        return await asyncio.wait_for(replay, 5)
+
+    assert asyncio.run(scenario()).startswith("Set CHIME event")
+    assert relay.store.snapshot()["chime"][0] == 1
+
+    assert other.keys.claim('["chime", "retry-3"]') == (True, None)
+    monkeypatch.setattr(relay, "IDEMPOTENCY_WAIT", 0.05)
+    resp = asyncio.run(relay.set_instrument("chime", command, relay_key, "retry-3"))
+    assert resp.status_code == 503  # original still in flight
+    relay.store.close()
+    other.close()
@@ -0,0 +1,216 @@
+"""Server-sent event stream (/stream) and the AlertStream parser."""
+
+import asyncio
+import json
+import os
+
+import pytest
+
+
+class _Request:
+    async def is_disconnected(self):
+        return False
+
+
+def _set(relay, route, command_mjd):
+    with relay._lock:
+        relay._apply(route, relay._seq[route] + 1, {"command": "observation", "command_mjd": command_mjd, "args": {}})
+
+
+async def _collect(relay, routes, since_mjd, count, after=None, cursor=None):
+    """Read count data events from the stream, applying after() once the first is read."""
+    events = []
+    gen = relay._stream_events(_Request(), routes, since_mjd, cursor)
+    async for chunk in gen:
+        for line in chunk.splitlines():
+            if line.startswith("data:"):
+                events.append(json.loads(line[5:]))
+        if after is not None and events:
+            after()
+            after = None
+        if len(events) >= count:
+            break
+    await gen.aclose()
+    return events
+
+
+def test_stream_snapshot_then_updates(relay):
+    _set(relay, "chime", 60000.5)
+
+    def later():
+        asyncio.get_running_loop().call_later(0.1, _set, relay, "ligo", 60000.6)
+
+    events = asyncio.run(asyncio.wait_for(_collect(relay, ["chime", "ligo"], None, 3, after=later), 5))
+    assert [(e["instrument"], e["command_mjd"]) for e in events] == [
+        ("chime", 60000.5), ("ligo", None), ("ligo", 60000.6)]
+
+
+def test_stream_resume_skips_seen(relay):
+    _set(relay, "chime", 60000.5)
+    _set(relay, "gcn", 60000.7)
+    events = asyncio.run(asyncio.wait_for(_collect(relay, ["chime", "gcn"], 60000.5, 1), 5))
+    assert [(e["instrument"], e["command_mjd"]) for e in events] == [("gcn", 60000.7)]
+
+
+def test_stream_sends_every_update_between_wakeups(relay):
+    from ovro_alert import relay_db
+
+    commands = [relay_db.Command(instrument="chime", command="observation", command_mjd=60000.1 + i / 1000,
+                                 args={"n": i}) for i in range(1, 4)]
+
+    def burst():
+        asyncio.ensure_future(relay._update_many([("chime", command) for command in commands]))
+
+    events = asyncio.run(asyncio.wait_for(_collect(relay, ["chime"], None, 4, after=burst), 5))
+    assert [(e["seq"], e["command_mjd"]) for e in events] == \
+        [(0, None)] + [(i, command.command_mjd) for i, command in enumerate(commands, 1)]
+
+
+def test_stream_resumes_from_per_route_cursor(relay):
+    for mjd in (60000.5, 60000.6, 60000.7):
+        _set(relay, "chime", mjd)
+    _set(relay, "gcn", 60000.2)  # older client timestamp than chime's
+    cursor = relay._parse_cursor("chime:1,gcn:0")
+    events = asyncio.run(asyncio.wait_for(_collect(relay, ["chime", "gcn"], None, 3, cursor=cursor), 5))
+    assert [(e["instrument"], e["seq"]) for e in events] == [("chime", 2), ("chime", 3), ("gcn", 1)]
+
+
+def test_stream_event_ids_are_cursors(relay):
+    _set(relay, "chime", 60000.5)
+
+    async def first_id():
+        gen = relay._stream_events(_Request(), ["chime", "gcn"])
+        chunk = await gen.__anext__()
+        await gen.aclose()
+        return chunk.splitlines()[0]
+
+    assert asyncio.run(asyncio.wait_for(first_id(), 5)) == "id: chime:1,gcn:0"
+    assert relay._parse_cursor("chime:1,gcn:0,bad,x:y") == {"chime": 1, "gcn": 0}
+
+
+def test_stream_cursor_older_than_buffer_or_relay(relay, monkeypatch):
+    monkeypatch.setattr(relay, "_events", {name: relay.deque(maxlen=2) for name in relay._events})
+    for mjd in (60000.1, 60000.2, 60000.3, 60000.4):
+        _set(relay, "ligo", mjd)
+
+    events = asyncio.run(asyncio.wait_for(_collect(relay, ["ligo"], None, 2, cursor={"ligo": 1}), 5))
+    assert [(e["seq"], e.get("gap")) for e in events] == [(3, True), (4, None)]
+
+    # A cursor from before a relay restart: send the current state, then new events.
+    later = lambda: asyncio.get_running_loop().call_later(0.05, _set, relay, "ligo", 60000.5)  # noqa: E731
+    events = asyncio.run(asyncio.wait_for(_collect(relay, ["ligo"], None, 2, after=later, cursor={"ligo": 99}), 5))
+    assert [e["seq"] for e in events] == [4, 5]
+
+
+def test_slow_stream_is_disconnected(relay, monkeypatch):
+    monkeypatch.setattr(relay, "STREAM_QUEUE_SIZE", 2)
+
+    async def scenario():
+        gen = relay._stream_events(_Request(), ["dsa"], 0.0)
+        first = asyncio.ensure_future(gen.__anext__())
+        await asyncio.sleep(0.01)
+        for i in range(4):
+            _set(relay, "dsa", 60000.0 + i)
+        await asyncio.sleep(0.01)
+        chunks = [await first]
+        async for chunk in gen:
+            chunks.append(chunk)
+        return chunks
+
+    chunks = asyncio.run(asyncio.wait_for(scenario(), 5))
+    assert len(chunks) == 1  # the queue overflowed, so the stream ended for the client to resume
+
+
+def test_stream_heartbeat(relay, monkeypatch):
+    monkeypatch.setattr(relay, "STREAM_HEARTBEAT", 0.05)
+
+    async def first_chunk():
+        gen = relay._stream_events(_Request(), ["casm"], 0.0)
+        chunk = await gen.__anext__()
+        await gen.aclose()
+        return chunk
+
+    assert asyncio.run(asyncio.wait_for(first_chunk(), 5)).startswith(":")
+
+
+def test_stream_rejects_unknown_route(relay_client, relay_key):
+    resp = relay_client.get("/stream", params={"key": relay_key, "routes": "nope"})
+    assert "Unknown routes" in resp.json()
+
+
+def test_alert_stream_parse():
+    pytest.importorskip("requests")
+    pytest.importorskip("astropy")
+    os.environ.setdefault("RELAY_KEY", "test-relay-key")
+    from ovro_alert.alert_client import AlertStream
+
+    lines = [": keepalive", "", "id: chime:1", "event: chime", 'data: {"command_mjd": 1.5}', "",
+             "event: casm", 'data: {"command_mjd": null}', ""]
+    assert list(AlertStream._parse(lines)) == [("chime", {"command_mjd": 1.5}), ("casm", {"command_mjd": None})]
+
+
+def test_alert_stream_resumes_with_cursor(monkeypatch):
+    pytest.importorskip("requests")
+    from unittest.mock import MagicMock
+
+    from ovro_alert import alert_client
+
+    class Stop(Exception):
+        pass
+
+    streams = [["id: chime:3,gcn:0", "event: chime", 'data: {"seq": 3, "command_mjd": 60000.9}', "",
+                "id: chime:3,gcn:1", "event: gcn", 'data: {"seq": 1, "command_mjd": 60000.1}', ""], []]
+    session = MagicMock()
+    session.get.return_value.__enter__.return_value.headers = {"Content-Type": "text/event-stream"}
+    session.get.return_value.__enter__.return_value.iter_lines.side_effect = lambda **kwargs: iter(streams.pop(0))
+    monkeypatch.setattr(alert_client, "s", session)
+    monkeypatch.setattr(alert_client, "RELAY_KEY", "test-relay-key")
+    sleeps = []
+
+    def sleep(delay):
+        sleeps.append(delay)
+        if len(sleeps) == 2:
+            raise Stop
+
+    monkeypatch.setattr(alert_client, "sleep", sleep)
+
+    stream = alert_client.AlertStream(["chime", "gcn"], since_mjd=60000.5)
+    with pytest.raises(Stop):
+        list(stream.events())
+    assert stream.cursor == {"chime": 3, "gcn": 1}
+    first, second = (call[1]["params"] for call in session.get.call_args_list)
+    assert first["since_mjd"] == "60000.5" and "since" not in first
+    assert second["since"] == "chime:3,gcn:1" and "since_mjd" not in second
+
+
+def test_alert_stream_skips_state_resent_after_relay_restart(monkeypatch):
+    pytest.importorskip("requests")
+    from unittest.mock import MagicMock
+
+    from ovro_alert import alert_client
+
+    class Stop(Exception):
+        pass
+
+    streams = [["event: chime", 'data: {"seq": 4, "command_mjd": 60000.9}', ""],
+               ["event: chime", 'data: {"seq": 0, "command_mjd": 60000.9}', "",  # restored after a restart
+                "event: chime", 'data: {"seq": 1, "command_mjd": 60001.2}', ""]]
+    session = MagicMock()
+    session.get.return_value.__enter__.return_value.headers = {"Content-Type": "text/event-stream"}
+    session.get.return_value.__enter__.return_value.iter_lines.side_effect = lambda **kwargs: iter(streams.pop(0))
+    monkeypatch.setattr(alert_client, "s", session)
+    monkeypatch.setattr(alert_client, "RELAY_KEY", "test-relay-key")
+
+    def sleep(delay):
+        if not streams:
+            raise Stop
+
+    monkeypatch.setattr(alert_client, "sleep", sleep)
+
+    stream = alert_client.AlertStream(["chime"])
+    seen = []
+    with pytest.raises(Stop):
+        for route, dd in stream.events():
+            seen.append(dd["command_mjd"])
+    assert seen == [60000.9, 60001.2]
+    assert stream.cursor == {"chime": 1}
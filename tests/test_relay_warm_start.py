@@ -0,0 +1,57 @@
+"""Relay startup rehydrates in-memory state from relay_db."""
+
+import os
+import sqlite3
+import time
+
+BENCH_ROWS = int(os.environ.get("OVRO_ALERT_BENCH_ROWS", 2_000_000))
+STARTUP_BUDGET_SEC = float(os.environ.get("OVRO_ALERT_STARTUP_BUDGET_SEC", 0.5))
+
+
+def test_startup_restores_latest(relay):
+    from fastapi.testclient import TestClient
+
+    relay.relay_db.create_db()
+    for mjd in (60000.1, 60000.3, 60000.2):
+        relay.relay_db.set_command(relay.relay_db.Command(
+            instrument="chime", command="observation", command_mjd=mjd, args={"dm": mjd}))
+    relay.relay_db.flush()
+
+    with TestClient(relay.app) as client:
+        dd = client.get("/chime", params={"key": relay.RELAY_KEY}).json()
+        assert dd["command_mjd"] == 60000.3
+        assert dd["args"] == {"dm": 60000.3}
+        assert client.get("/ligo", params={"key": relay.RELAY_KEY}).json()["command_mjd"] is None
+        assert client.get("/chime/events", params={"key": relay.RELAY_KEY}).json()["events"] == []
+
+
+def _build_large_db(relay_db, rows):
+    """Create the current schema (indexes included), then bulk-insert rows round-robin over instruments."""
+    relay_db.create_db()
+    conn = sqlite3.connect(relay_db.DBPATH)
+    conn.execute(f"""
+        WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i < {rows - 1})
+        INSERT INTO commands (instrument, command, command_mjd, args)
+        SELECT CASE i % 5 WHEN 0 THEN 'dsa' WHEN 1 THEN 'lwa' WHEN 2 THEN 'ligo'
+                          WHEN 3 THEN 'chime' ELSE 'gcn' END,
+               'observation', 59000 + i * 0.0005, '{{"n": ' || i || '}}'
+        FROM n""")
+    conn.commit()
+    conn.close()
+
+
+def test_startup_benchmark_large_table(relay):
+    """Warm start must stay within budget regardless of table size (indexed lookups only)."""
+    _build_large_db(relay.relay_db, BENCH_ROWS)
+
+    t0 = time.perf_counter()
+    relay.relay_db.create_db()
+    relay._restore_state()
+    elapsed = time.perf_counter() - t0
+    relay.relay_db.close()
+
+    print(f"warm start over {BENCH_ROWS} rows: {elapsed * 1e3:.1f} ms")
+    last_gcn = max(i for i in range(BENCH_ROWS - 5, BENCH_ROWS) if i % 5 == 4)
+    assert relay.dd["gcn"]["args"] == {"n": last_gcn}
+    assert relay.dd["casm"]["command_mjd"] is None
+    assert elapsed < STARTUP_BUDGET_SEC
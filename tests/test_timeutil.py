@@ -0,0 +1,39 @@
+"""Fast time helpers (ovro_alert.timeutil) agree with astropy and parse receiver timestamps."""
+
+from datetime import datetime
+
+import pytest
+
+from ovro_alert import timeutil
+
+
+def test_mjd_agrees_with_astropy():
+    np = pytest.importorskip("numpy")
+    pytest.importorskip("astropy")
+    from astropy.time import Time
+
+    unix = np.array([0.0, 946684800.5, 1700000000.123, 2208988800.0])
+    assert np.all(np.abs(timeutil.unix_to_mjd(unix) - Time(unix, format="unix").utc.mjd) * 86400 < 1e-3)
+    assert abs(timeutil.now_mjd() - Time.now().mjd) * 86400 < 1e-3 + 0.1  # two clock reads
+    assert timeutil.mjd_to_unix(timeutil.unix_to_mjd(1700000000.123)) == pytest.approx(1700000000.123, abs=1e-4)
+
+    # Not on a leap-second day, which astropy stretches to 86401 s (documented in timeutil).
+    for text in ["2024-05-01T12:34:56.789", "2017-01-01T00:00:01"]:
+        assert abs(timeutil.iso_to_mjd(text) - Time(text, format="isot", scale="utc").mjd) * 86400 < 1e-3
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("2024-05-01T12:34:56.789Z", datetime(2024, 5, 1, 12, 34, 56, 789000)),
+    ("2024-05-01T12:34:56.123456789", datetime(2024, 5, 1, 12, 34, 56, 123456)),
+    ("2024-05-01 12:34:56", datetime(2024, 5, 1, 12, 34, 56)),
+    ("2024-05-01T12:34:56+02:00", datetime(2024, 5, 1, 10, 34, 56)),
+    ("2024-05-01T23:30:00.5-01:00", datetime(2024, 5, 2, 0, 30, 0, 500000)),
+])
+def test_parse_iso(text, expected):
+    assert timeutil.parse_iso(text) == expected
+
+
+@pytest.mark.parametrize("text", [None, "", "yesterday", "2024-05-01T12:34", "2024-13-01T00:00:00",
+                                  "2024-05-01T12:34:56 PST"])
+def test_parse_iso_rejects(text):
+    assert timeutil.parse_iso(text) is None
@@ -0,0 +1,65 @@
+"""Latency trace context (ovro_alert.trace) and the relay /traces endpoints."""
+
+from ovro_alert import relay_db, trace
+
+
+def test_marks_and_breakdown():
+    args = trace.start({"dm": 10}, "gcn_kafka_receiver", "kafka", ts=100.0, trace_id="t1")
+    trace.mark(args, "gcn_kafka_receiver", "parsed", ts=100.002)
+    trace.mark(args, "alert_client", "read", ts=100.5, once=True)
+    trace.mark(args, "alert_client", "read", ts=101.0, once=True)
+    assert [m[1] for m in args["_trace"]["marks"]] == ["kafka", "parsed", "read"]
+    assert trace.carry(args, {})["_trace"]["id"] == "t1"
+    assert trace.mark({"dm": 10}, "x", "y") == {"dm": 10}  # untraced args are left alone
+
+    result = trace.breakdown(args["_trace"]["marks"])
+    assert result["total_ms"] == 500.0
+    assert result["slowest"]["stage"] == "read"
+    assert result["marks"][1]["since_prev_ms"] == 2.0
+
+
+def test_relay_records_and_serves_breakdown(relay, relay_client, relay_key):
+    args = trace.start({"dm": 300}, "gcn_kafka_receiver", "kafka", trace_id="abc")
+    body = {"instrument": "chime", "command": "observation", "command_mjd": 60000.5, "args": args}
+    relay_client.put("/chime", params={"key": relay_key}, json=body)
+
+    state = relay_client.get("/chime", params={"key": relay_key}).json()
+    assert [m[:2] for m in state["args"]["_trace"]["marks"]] == [["gcn_kafka_receiver", "kafka"],
+                                                                  ["relay_api", "received"]]
+    downstream = trace.mark(state["args"], "lwa_alert_client", "sbatch")["_trace"]
+    assert relay_client.put("/traces", params={"key": relay_key}, json=downstream).status_code == 200
+
+    relay_db.flush()
+    result = relay_client.get("/traces/abc", params={"key": relay_key}).json()
+    stages = [(m["component"], m["stage"]) for m in result["marks"]]
+    assert stages[:2] == [("gcn_kafka_receiver", "kafka"), ("relay_api", "received")]
+    assert set(stages[2:]) == {("relay_api", "persisted"), ("lwa_alert_client", "sbatch")}
+    assert result["total_ms"] >= 0
+
+    recent = relay_client.get("/traces", params={"key": relay_key}).json()
+    assert recent[0]["id"] == "abc" and recent[0]["marks"] == 4
+    assert relay_client.get("/traces/nope", params={"key": relay_key}).json() == "Unknown trace: nope"
+
+
+def test_unpersisted_command_has_no_persisted_mark(relay, relay_client, relay_key):
+    args = trace.start({}, "test", "start", trace_id="t-test")
+    body = {"instrument": "chime", "command": "test", "command_mjd": 60000.5, "args": args}
+    relay_client.put("/chime", params={"key": relay_key}, json=body)
+    relay_db.flush()
+    assert [m[1] for m in relay_db.get_trace("t-test")] == ["start", "received"]
+
+
+def test_recent_traces_and_pruning(relay):
+    relay_db.create_db()
+    for i, trace_id in enumerate(["old", "mid", "new"]):
+        relay_db.add_trace_marks(trace_id, [["a", "start", 1000.0 + i], ["b", "end", 1010.0 + 5 * i]])
+    relay_db.add_trace_marks("mid", [["c", "late", 1030.0]])
+    relay_db.flush()
+    assert relay_db.get_traces(2) == [("mid", 1001.0, 1030.0, 3), ("new", 1002.0, 1020.0, 2)]
+
+    plan = relay_db.manager().reader().execute('EXPLAIN QUERY PLAN SELECT trace_id FROM traces ORDER BY ts DESC')
+    assert not any("TEMP B-TREE" in row[-1] for row in plan.fetchall())
+
+    relay_db.prune_traces(1, now=1015.0 + 86400).wait()
+    assert [row[0] for row in relay_db.get_traces()] == ["mid", "new"]
+    assert relay_db.get_trace("old") == [] and [m[1] for m in relay_db.get_trace("mid")] == ["end", "late"]